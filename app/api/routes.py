@@ -1,13 +1,11 @@
-from flask import Flask, request, jsonify, render_template, send_file, make_response
+from flask import Flask, Response, request, jsonify, render_template, make_response
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timedelta
 import os
-import json
 import numpy as np
 import sys
 import io
-import csv
 
 # Ensure project root is on sys.path so imports like `from config import config` work
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
@@ -16,10 +14,21 @@ if ROOT not in sys.path:
 
 from config import config
 from config import Config
-from app.models.database import db, Person, Attendance, Device, Log, init_db, get_db_stats
+from app.models.database import (db, Person, Attendance, Device, Log, init_db,
+                                 attendance_rows, attendance_row_dict, log_rows, log_row_dict)
 from app.services.face_recognition import FaceRecognitionService
 from app.services.tracking import TrackingService
-from app.services.attendance import AttendanceService
+from app.services.attendance import AttendanceService, EXPORT_COLUMNS
+from app.services.attendance_rollup import ensure_rollup
+from app.services.db_stats import db_stats_cache
+from app.services.event_bus import event_bus
+from app.services.registration_jobs import RegistrationJobs
+from app.services.motion_gate import MotionGate
+from app.utils.timing import stage_timer
+from app.utils.export import iter_csv, write_xlsx, iter_file
+from app.utils.pagination import keyset_page, parse_limit
+from app.services.monitoring import registry as metrics_registry, init_monitoring
+from app.services.log_writer import log_writer
 
 def create_app(config_name='default'):
     """Tạo Flask app"""
@@ -43,6 +52,8 @@ def create_app(config_name='default'):
     app.face_service = face_service
     app.tracking_service = tracking_service
     app.attendance_service = attendance_service
+    # Camera-side motion gate; the camera loop picks it up so its stats are queryable here
+    app.motion_gate = MotionGate()
     # Allow services to access the Flask app (so they can push DB writes from other threads)
     try:
         face_service.app = app
@@ -67,12 +78,27 @@ def create_app(config_name='default'):
     # Initialize database
     with app.app_context():
         init_db(app)
-        # After DB init, reload known faces so filenames in known_faces/ map to Person records
+        # Daily attendance rollup: backfill once for databases created before it existed
+        ensure_rollup()
+        # After DB init, refresh known faces so filenames in known_faces/ map to Person records
+        # (files already encoded by the service constructor are not encoded again)
         try:
-            face_service.load_known_faces()
+            face_service.refresh_known_faces()
         except Exception:
             pass
     
+    # Log events are written in batches by a background thread
+    log_writer.start(app)
+    # Attendance changes: replay the local journal, then write behind the frame loop
+    attendance_service.journal.start(app)
+    # Person registration: images are encoded on a worker thread, not in the request
+    registration_jobs = RegistrationJobs(face_service)
+    registration_jobs.start(app)
+    app.registration_jobs = registration_jobs
+    
+    # Metrics: SQL, request latency and service gauges
+    init_monitoring(app)
+    
     # API Routes
     @app.route('/')
     def index():
@@ -86,7 +112,7 @@ def create_app(config_name='default'):
     def get_stats():
         """Lấy thống kê tổng quan"""
         try:
-            db_stats = get_db_stats()
+            db_stats = db_stats_cache.get()
             # Lấy thống kê realtime từ service in-memory
             realtime_stats = attendance_service.get_realtime_stats()
 
@@ -117,51 +143,37 @@ def create_app(config_name='default'):
     def get_attendance():
         """Lấy danh sách attendance"""
         try:
-            # Get attendance data directly from database
-            from app.models.database import Attendance, Person
+            # Keyset pagination: ?limit=&cursor= (next_cursor / prev_cursor from the previous page)
+            try:
+                limit = parse_limit(request.args.get('limit'), 100, Config.PAGINATION_MAX_LIMIT)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            person_id = request.args.get('person_id', type=int)
+            date_from = request.args.get('date_from')
+            date_to = request.args.get('date_to')
 
-            # Support limit query parameter for pagination / templates
-            limit = request.args.get('limit', 100, type=int)
+            # Column-only joined query: no ORM objects, no lazy loads
+            query = attendance_rows()
+            if person_id is not None:
+                query = query.filter(Attendance.person_id == person_id)
+            if date_from:
+                query = query.filter(Attendance.time_in >= datetime.fromisoformat(date_from))
+            if date_to:
+                query = query.filter(Attendance.time_in <= datetime.fromisoformat(date_to))
 
-            # Simple query without relationships
-            attendances = db.session.query(
-                Attendance.attendance_id,
-                Attendance.person_id,
-                Attendance.track_id,
-                Attendance.time_in,
-                Attendance.time_out,
-                Attendance.status,
-                Person.name.label('person_name')
-            ).outerjoin(Person, Attendance.person_id == Person.person_id)\
-             .order_by(Attendance.time_in.desc())\
-             .limit(limit).all()
-            
-            # Convert to dict
-            attendance_data = []
-            for row in attendances:
-                # Calculate duration manually
-                duration_minutes = 0
-                if row.time_in and row.time_out:
-                    duration = row.time_out - row.time_in
-                    duration_minutes = int(duration.total_seconds() / 60)
-                elif row.time_in:
-                    duration = datetime.now() - row.time_in
-                    duration_minutes = int(duration.total_seconds() / 60)
-                
-                attendance_data.append({
-                    'attendance_id': row.attendance_id,
-                    'person_id': row.person_id,
-                    'person_name': row.person_name or 'Unknown',
-                    'track_id': row.track_id,
-                    'time_in': row.time_in.isoformat() if row.time_in else None,
-                    'time_out': row.time_out.isoformat() if row.time_out else None,
-                    'status': row.status,
-                    'duration_minutes': duration_minutes
-                })
+            try:
+                attendances, next_cursor, prev_cursor = keyset_page(
+                    query, Attendance.time_in, Attendance.attendance_id, limit, request.args.get('cursor'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
             
+            now = datetime.now()
+            attendance_data = [attendance_row_dict(row, now=now) for row in attendances]
+
             return jsonify({
                 'success': True,
-                'data': attendance_data
+                'data': attendance_data,
+                'pagination': {'limit': limit, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
             })
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
@@ -203,6 +215,9 @@ def create_app(config_name='default'):
             if not data or 'name' not in data:
                 return jsonify({'success': False, 'error': 'Name is required'}), 400
             
+            if Person.query.filter_by(name=data['name']).first():
+                return jsonify({'success': False, 'error': 'Person with this name already exists'}), 409
+            
             person = Person(
                 name=data['name'],
                 role=data.get('role', 'user')
@@ -219,6 +234,23 @@ def create_app(config_name='default'):
             db.session.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
     
+    @app.route('/api/persons/attendance-summary', methods=['GET'])
+    def get_persons_attendance_summary():
+        """Tổng kết attendance của tất cả (hoặc một số) người"""
+        try:
+            days = request.args.get('days', 30, type=int)
+            ids_param = request.args.get('person_ids')
+            person_ids = [int(pid) for pid in ids_param.split(',') if pid.strip()] if ids_param else None
+            
+            summaries = attendance_service.get_persons_attendance_summary(person_ids, days)
+            
+            return jsonify({
+                'success': True,
+                'data': summaries
+            })
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+    
     @app.route('/api/persons/<int:person_id>/attendance-summary', methods=['GET'])
     def get_person_attendance_summary(person_id):
         """Lấy tổng kết attendance của một người"""
@@ -266,7 +298,8 @@ def create_app(config_name='default'):
     @app.route('/api/persons/register', methods=['POST'])
     def register_person():
         """Đăng ký người mới bằng tên + up to 3 ảnh upload (multipart/form-data)
-        Fields: name (str), images (file[])"""
+        Fields: name (str), images (file[])
+        Returns 202 with a job id; poll GET /api/persons/register/<job_id> for the result."""
         try:
             name = request.form.get('name')
             if not name:
@@ -277,14 +310,12 @@ def create_app(config_name='default'):
                 return jsonify({'success': False, 'error': 'At least one image is required'}), 400
 
             saved_files = []
-            encodings = []
 
             # Ensure known_faces directory exists
             os.makedirs(Config.KNOWN_FACES_DIR, exist_ok=True)
 
-            # Save images and compute encodings
+            # Save images now (uploads are tied to the request); encoding runs in a background job
             idx = 0
-            failed_files = []
             for f in files[:3]:
                 if f and f.filename:
                     idx += 1
@@ -293,72 +324,25 @@ def create_app(config_name='default'):
                     f.save(path)
                     saved_files.append(path)
 
-                    # Compute encoding using face service
-                    try:
-                        enc = face_service.get_face_encoding_from_image(path)
-                        if enc is not None:
-                            encodings.append(enc)
-                            print(f"Successfully processed {filename}, encoding shape: {enc.shape}")
-                        else:
-                            failed_files.append(filename)
-                            print(f"No face detected in {filename}")
-                    except Exception as e:
-                        failed_files.append(filename)
-                        print(f"Error processing {filename}: {e}")
-                        import traceback
-                        traceback.print_exc()
-
-            if not encodings:
-                error_msg = 'No valid faces detected in uploaded images'
-                if failed_files:
-                    error_msg += f'. Failed files: {", ".join(failed_files)}'
-                error_msg += '. Please ensure images contain clear, front-facing faces with good lighting.'
-                return jsonify({'success': False, 'error': error_msg}), 400
-
-            # Create or update person record
-            person = Person.query.filter_by(name=name).first()
-            if not person:
-                person = Person(name=name, role='user')
-                db.session.add(person)
-                db.session.commit()
+            job = registration_jobs.submit(name, saved_files)
+            if job is None:
+                return jsonify({'success': False, 'error': 'Registration queue is full, please retry later'}), 503
 
-            # Compute centroid encoding and save
-            try:
-                centroid = np.mean(encodings, axis=0)
-                centroid = centroid / (np.linalg.norm(centroid) + 1e-7)
-                
-                person.face_encoding = json.dumps(centroid.tolist())
-                db.session.commit()
-                
-                # Add to face service
-                face_service.add_known_face(name, centroid, person.person_id)
-                
-                # Reload all face encodings to ensure consistency
-                face_service.load_known_faces()
-                
-                print(f"Successfully registered {name} with {len(encodings)} face encodings")
-                print(f"Total known faces after reload: {len(face_service.known_face_encodings)}")
-                
-            except Exception as e:
-                db.session.rollback()
-                print(f"Error saving person {name}: {e}")
-                return jsonify({'success': False, 'error': f'Failed to save person: {str(e)}'}), 500
-
-            return jsonify({
-                'success': True, 
-                'data': {
-                    'person_id': person.person_id, 
-                    'name': person.name,
-                    'saved_files': saved_files,
-                    'encodings_count': len(encodings)
-                }
-            }), 201
+            job['status_url'] = f"/api/persons/register/{job['job_id']}"
+            return jsonify({'success': True, 'data': job}), 202
             
         except Exception as e:
-            db.session.rollback()
             print(f"Registration error: {e}")
             return jsonify({'success': False, 'error': str(e)}), 500
     
+    @app.route('/api/persons/register/<job_id>', methods=['GET'])
+    def get_registration_job(job_id):
+        """Trạng thái job đăng ký: queued, running, succeeded (kèm result) hoặc failed (kèm error)"""
+        job = registration_jobs.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'data': job})
+    
     @app.route('/api/tracking/active', methods=['GET'])
     def get_active_tracks():
         """Lấy danh sách track đang hoạt động"""
@@ -419,23 +403,80 @@ def create_app(config_name='default'):
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
     
+    @app.route('/api/tracking/motion-gate', methods=['GET'])
+    def get_motion_gate_stats():
+        """Thống kê cổng chuyển động của camera (idle / wake-up)"""
+        try:
+            return jsonify({
+                'success': True,
+                'data': app.motion_gate.stats()
+            })
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+    
+    @app.route('/api/performance', methods=['GET'])
+    def get_performance_stats():
+        """Độ trễ từng stage của vòng lặp camera (p50/p95/p99, FPS)"""
+        try:
+            return jsonify({
+                'success': True,
+                'data': stage_timer.stats()
+            })
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
+    
+    @app.route('/api/events', methods=['GET'])
+    def stream_events():
+        """Server-Sent Events: track, vào/ra và thống kê được đẩy tới dashboard khi thay đổi"""
+        response = Response(event_bus.stream(event_bus.subscribe()), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # Disable proxy buffering (nginx) so events are delivered immediately
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Metrics dạng text cho Prometheus"""
+        response = make_response(metrics_registry.render())
+        response.headers['Content-Type'] = metrics_registry.CONTENT_TYPE
+        return response
+    
     @app.route('/api/logs', methods=['GET'])
     def get_logs():
         """Lấy logs hệ thống"""
         try:
-            limit = request.args.get('limit', 100, type=int)
+            try:
+                limit = parse_limit(request.args.get('limit'), 100, Config.PAGINATION_MAX_LIMIT)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
             event_type = request.args.get('event_type')
+            date_from = request.args.get('date_from')
+            date_to = request.args.get('date_to')
             
-            query = Log.query
+            # Column-only joined query (device name included): no lazy loads
+            query = log_rows()
             
             if event_type:
-                query = query.filter(Log.event_type.like(f'%{event_type}%'))
+                # Resolve the substring to concrete event types first, so the
+                # (event_type, timestamp) index serves the main query
+                matching_types = [row[0] for row in db.session.query(Log.event_type).distinct()
+                                  .filter(Log.event_type.like(f'%{event_type}%'))]
+                query = query.filter(Log.event_type.in_(matching_types))
+            if date_from:
+                query = query.filter(Log.timestamp >= datetime.fromisoformat(date_from))
+            if date_to:
+                query = query.filter(Log.timestamp <= datetime.fromisoformat(date_to))
             
-            logs = query.order_by(Log.timestamp.desc()).limit(limit).all()
+            try:
+                logs, next_cursor, prev_cursor = keyset_page(
+                    query, Log.timestamp, Log.log_id, limit, request.args.get('cursor'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
             
             return jsonify({
                 'success': True,
-                'data': [log.to_dict() for log in logs]
+                'data': [log_row_dict(row) for row in logs],
+                'pagination': {'limit': limit, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
             })
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
@@ -511,113 +552,45 @@ def create_app(config_name='default'):
             normalized_format = (format_type or 'json').lower() if format_type else 'json'
             request_format = normalized_format if normalized_format in ('json', 'excel', 'xlsx', 'csv') else 'json'
 
-            data = attendance_service.export_attendance_data(
-                date_from=date_from,
-                date_to=date_to,
-                format='json' if request_format in ('excel', 'xlsx', 'csv') else request_format
-            )
+            if request_format == 'json':
+                return jsonify({
+                    'success': True,
+                    'data': attendance_service.export_attendance_data(date_from=date_from, date_to=date_to)
+                })
 
-            if request_format == 'csv':
-                output = io.StringIO()
-                writer = csv.writer(output)
-                headers = ['attendance_id', 'person_name', 'person_id', 'track_id', 'time_in', 'time_out', 'status', 'duration_minutes']
-                writer.writerow(headers)
-                for item in data:
-                    writer.writerow([
-                        item.get('attendance_id'),
-                        item.get('person_name'),
-                        item.get('person_id'),
-                        item.get('track_id'),
-                        item.get('time_in'),
-                        item.get('time_out'),
-                        item.get('status'),
-                        item.get('duration_minutes')
-                    ])
-                csv_content = output.getvalue()
-                output.close()
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f'attendance_report_{timestamp}.csv'
-                response = make_response(csv_content)
-                response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-                response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-                return response
+            # CSV / Excel: rows are streamed from a chunked query, never held in memory
+            rows = attendance_service.iter_attendance_export(date_from=date_from, date_to=date_to)
+            filename_parts = ['attendance_report']
+            if date_from:
+                filename_parts.append(f"from_{date_from.strftime('%Y%m%d')}")
+            if date_to:
+                filename_parts.append(f"to_{date_to.strftime('%Y%m%d')}")
+            filename_parts.append(datetime.now().strftime('%Y%m%d_%H%M%S'))
+            filename = '_'.join(filename_parts)
 
             if request_format in ('excel', 'xlsx'):
                 try:
-                    from openpyxl import Workbook
-                except ImportError as e:
+                    import openpyxl  # noqa: F401
+                except ImportError:
                     # Fallback: generate CSV if openpyxl is unavailable
-                    output = io.StringIO()
-                    writer = csv.writer(output)
-                    headers = ['attendance_id', 'person_name', 'person_id', 'track_id', 'time_in', 'time_out', 'status', 'duration_minutes']
-                    writer.writerow(headers)
-                    for item in data:
-                        writer.writerow([
-                            item.get('attendance_id'),
-                            item.get('person_name'),
-                            item.get('person_id'),
-                            item.get('track_id'),
-                            item.get('time_in'),
-                            item.get('time_out'),
-                            item.get('status'),
-                            item.get('duration_minutes')
-                        ])
-                    csv_content = output.getvalue()
-                    output.close()
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = f'attendance_report_{timestamp}.csv'
-                    response = make_response(csv_content)
-                    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
-                    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-                    return response
-
-                workbook = Workbook()
-                ws = workbook.active
-                ws.title = 'Attendance'
-                headers = ['Attendance ID', 'Tên', 'Person ID', 'Track ID', 'Time In', 'Time Out', 'Trạng thái', 'Thời lượng (phút)']
-                ws.append(headers)
-
-                for item in data:
-                    ws.append([
-                        item.get('attendance_id'),
-                        item.get('person_name'),
-                        item.get('person_id'),
-                        item.get('track_id'),
-                        item.get('time_in'),
-                        item.get('time_out'),
-                        item.get('status'),
-                        item.get('duration_minutes')
-                    ])
+                    request_format = 'csv'
 
-                # Auto width
-                for column_cells in ws.columns:
-                    length = max(len(str(cell.value)) if cell.value is not None else 0 for cell in column_cells)
-                    adjusted_width = min(length + 2, 40)
-                    ws.column_dimensions[column_cells[0].column_letter].width = adjusted_width
-
-                output = io.BytesIO()
-                workbook.save(output)
-                output.seek(0)
-                filename_parts = ['attendance_report']
-                if date_from:
-                    filename_parts.append(f"from_{date_from.strftime('%Y%m%d')}")
-                if date_to:
-                    filename_parts.append(f"to_{date_to.strftime('%Y%m%d')}")
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename_parts.append(timestamp)
-                filename = '_'.join(filename_parts) + '.xlsx'
-
-                return send_file(
-                    output,
-                    as_attachment=True,
-                    download_name=filename,
-                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                )
+            if request_format == 'csv':
+                response = Response(iter_csv(EXPORT_COLUMNS, rows), mimetype='text/csv')
+                response.headers['Content-Disposition'] = f'attachment; filename={filename}.csv'
+                response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+                return response
 
-            return jsonify({
-                'success': True,
-                'data': data
-            })
+            headers = ['Attendance ID', 'Tên', 'Person ID', 'Track ID', 'Time In', 'Time Out', 'Trạng thái', 'Thời lượng (phút)']
+            # Write-only sheets cannot be auto-sized afterwards: fixed widths
+            output = write_xlsx(headers, rows, title='Attendance', widths=[15, 25, 11, 10, 28, 28, 12, 19],
+                                spool_max_size=Config.EXPORT_SPOOL_MAX_SIZE)
+            size = output.seek(0, io.SEEK_END)
+            output.seek(0)
+            response = Response(iter_file(output), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            response.headers['Content-Disposition'] = f'attachment; filename={filename}.xlsx'
+            response.headers['Content-Length'] = str(size)
+            return response
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
     
@@ -651,17 +624,22 @@ def create_app(config_name='default'):
     
     @app.route('/api/face-recognition/reload', methods=['POST'])
     def reload_face_encodings():
-        """Reload face encodings từ database vào memory"""
+        """Cập nhật face encodings trong memory theo các thay đổi (?full=1 để load lại toàn bộ)"""
         try:
-            # Reload known faces
-            face_service.load_known_faces()
+            if request.args.get('full', '').lower() in ('1', 'true', 'yes'):
+                face_service.load_known_faces()
+                refresh = None
+            else:
+                refresh = face_service.refresh_known_faces()
             
             return jsonify({
                 'success': True,
                 'data': {
                     'known_faces_count': len(face_service.known_face_encodings),
                     'encoding_dimension': face_service.encoding_dim,
-                    'embedding_enabled': face_service._embedding_enabled
+                    'embedding_enabled': face_service._embedding_enabled,
+                    'embedding_backend': face_service.backend_info,
+                    'refresh': refresh
                 }
             })
         except Exception as e:
@@ -1,12 +1,21 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import os
+from config import Config
 
 db = SQLAlchemy()
 
 class Person(db.Model):
     """Bảng lưu thông tin người dùng"""
     __tablename__ = 'person'
+    __table_args__ = (
+        # Name lookups (check-in by name, known_faces sync); one person per name
+        db.Index('uq_person_name', 'name', unique=True),
+        # Incremental gallery refresh reads persons changed since a watermark
+        db.Index('ix_person_updated_at', 'updated_at'),
+    )
     
     person_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -33,8 +42,19 @@ class Person(db.Model):
 class Attendance(db.Model):
     """Bảng ghi nhận vào/ra"""
     __tablename__ = 'attendance'
+    __table_args__ = (
+        # "Open attendance of this person" (check-in / check-out paths)
+        db.Index('ix_attendance_open_person', 'person_id',
+                 sqlite_where=db.text('time_out IS NULL'),
+                 postgresql_where=db.text('time_out IS NULL')),
+        # Date-range stats / exports and the time_in DESC listing
+        db.Index('ix_attendance_time_in', 'time_in'),
+        # Per-person summaries over a period
+        db.Index('ix_attendance_person_time_in', 'person_id', 'time_in'),
+    )
     
-    attendance_id = db.Column(db.Integer, primary_key=True)
+    # Ids come from id_sequence, shared with the attendance journal (see reserve_attendance_ids)
+    attendance_id = db.Column(db.Integer, primary_key=True, default=lambda context: reserve_attendance_ids(context.connection))
     person_id = db.Column(db.Integer, db.ForeignKey('person.person_id'), nullable=True)
     track_id = db.Column(db.String(50), nullable=True)
     time_in = db.Column(db.DateTime, nullable=False)
@@ -45,47 +65,81 @@ class Attendance(db.Model):
         return f'<Attendance {self.person_id} - {self.time_in}>'
     
     def to_dict(self):
-        # Safe access to person name to avoid lazy loading issues
-        person_name = 'Unknown'
-        
-        # First try to use preloaded person name
+        # Preloaded name (get_attendance_history) avoids the relationship load
         if hasattr(self, '_person_name'):
             person_name = self._person_name
         else:
             try:
-                if self.person:
-                    person_name = self.person.name
-            except:
-                # If lazy loading fails, try to get name from database
-                try:
-                    from app.models.database import Person
-                    person = Person.query.get(self.person_id)
-                    if person:
-                        person_name = person.name
-                except:
-                    person_name = f'Person {self.person_id}' if self.person_id else 'Unknown'
-        
-        return {
-            'attendance_id': self.attendance_id,
-            'person_id': self.person_id,
-            'person_name': person_name,
-            'track_id': self.track_id,
-            'time_in': self.time_in.isoformat() if self.time_in else None,
-            'time_out': self.time_out.isoformat() if self.time_out else None,
-            'status': self.status,
-            'duration_minutes': self.get_duration_minutes()
-        }
+                person_name = self.person.name if self.person else None
+            except Exception:
+                # Detached instance: the relationship cannot be loaded
+                person_name = f'Person {self.person_id}' if self.person_id else None
+        return attendance_row_dict(self, person_name=person_name)
     
     def get_duration_minutes(self):
         """Tính thời gian hiện diện (phút)"""
-        if self.time_in and self.time_out:
-            duration = self.time_out - self.time_in
-            return int(duration.total_seconds() / 60)
-        elif self.time_in:
-            # Nếu chưa có time_out, tính từ time_in đến hiện tại
-            duration = datetime.now() - self.time_in
-            return int(duration.total_seconds() / 60)
-        return 0
+        return duration_minutes(self.time_in, self.time_out)
+
+class AttendanceDaily(db.Model):
+    """Bảng tổng hợp attendance theo ngày và theo người (cập nhật tăng dần)"""
+    __tablename__ = 'attendance_daily'
+    __table_args__ = (
+        # Per-person summaries over a range of days
+        db.Index('ix_attendance_daily_person_day', 'person_key', 'day'),
+    )
+    
+    day = db.Column(db.Date, primary_key=True)  # ngày của time_in
+    person_key = db.Column(db.Integer, primary_key=True, autoincrement=False)  # person_id, 0 = Unknown
+    checkins = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    total_minutes = db.Column(db.Integer, nullable=False, default=0)
+    first_in = db.Column(db.DateTime, nullable=True)
+    last_out = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<AttendanceDaily {self.day} person={self.person_key} checkins={self.checkins}>'
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat() if self.day else None,
+            'person_id': self.person_key or None,
+            'checkins': self.checkins,
+            'completed': self.completed,
+            'total_minutes': self.total_minutes,
+            'first_in': self.first_in.isoformat() if self.first_in else None,
+            'last_out': self.last_out.isoformat() if self.last_out else None
+        }
+
+class IdSequence(db.Model):
+    """Bộ đếm id dùng chung giữa các tiến trình (attendance_id cấp trước khi ghi DB)"""
+    __tablename__ = 'id_sequence'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<IdSequence {self.name}={self.next_value}>'
+
+def reserve_attendance_ids(connection, count=1):
+    """Giữ chỗ ``count`` attendance_id liên tiếp trong transaction của ``connection``; trả về id đầu tiên.
+
+    The attendance journal reserves blocks of ids before its rows reach
+    the database, and every other insert takes its id here as well, so
+    processes sharing the database never hand out the same id. The
+    counter never falls behind MAX(attendance_id), which covers rows
+    inserted with an explicit id. The UPDATE locks the counter (SQLite
+    serializes writers) until the caller commits.
+    """
+    sequence = IdSequence.__table__
+    floor = db.select(db.func.coalesce(db.func.max(Attendance.attendance_id), 0) + 1).scalar_subquery()
+    start = db.case((sequence.c.next_value > floor, sequence.c.next_value), else_=floor)
+    result = connection.execute(
+        sequence.update().where(sequence.c.name == 'attendance').values(next_value=start + count))
+    if result.rowcount == 0:
+        connection.execute(sequence.insert().values(name='attendance', next_value=floor + count))
+    next_value = connection.execute(
+        db.select(sequence.c.next_value).where(sequence.c.name == 'attendance')).scalar()
+    return next_value - count
 
 class Device(db.Model):
     """Bảng lưu thông tin thiết bị"""
@@ -115,6 +169,11 @@ class Device(db.Model):
 class Log(db.Model):
     """Bảng ghi nhận log hệ thống"""
     __tablename__ = 'log'
+    __table_args__ = (
+        # /api/logs: newest first, optionally filtered by event type
+        db.Index('ix_log_timestamp', 'timestamp'),
+        db.Index('ix_log_event_type_timestamp', 'event_type', 'timestamp'),
+    )
     
     log_id = db.Column(db.Integer, primary_key=True)
     device_id = db.Column(db.Integer, db.ForeignKey('device.device_id'), nullable=True)
@@ -126,14 +185,115 @@ class Log(db.Model):
         return f'<Log {self.event_type} - {self.timestamp}>'
     
     def to_dict(self):
-        return {
-            'log_id': self.log_id,
-            'device_id': self.device_id,
-            'device_name': self.device.name if self.device else 'Unknown',
-            'event_type': self.event_type,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
-            'details': self.details
-        }
+        return log_row_dict(self, device_name=self.device.name if self.device else None)
+
+# ----- column projections and serializers for list endpoints / exports -----
+# One joined query returning plain rows: no ORM objects, no per-row lazy loads.
+
+ATTENDANCE_ROW_COLUMNS = (
+    Attendance.attendance_id,
+    Attendance.person_id,
+    Person.name.label('person_name'),
+    Attendance.track_id,
+    Attendance.time_in,
+    Attendance.time_out,
+    Attendance.status
+)
+
+LOG_ROW_COLUMNS = (
+    Log.log_id,
+    Log.device_id,
+    Device.name.label('device_name'),
+    Log.event_type,
+    Log.timestamp,
+    Log.details
+)
+
+def attendance_rows():
+    """Query attendance + tên người (outer join), trả về row theo ATTENDANCE_ROW_COLUMNS"""
+    return db.session.query(*ATTENDANCE_ROW_COLUMNS).outerjoin(Person, Attendance.person_id == Person.person_id)
+
+def log_rows():
+    """Query log + tên thiết bị (outer join), trả về row theo LOG_ROW_COLUMNS"""
+    return db.session.query(*LOG_ROW_COLUMNS).outerjoin(Device, Log.device_id == Device.device_id)
+
+def duration_minutes(time_in, time_out, now=None):
+    """Thời gian hiện diện (phút); phiên chưa kết thúc tính tới hiện tại"""
+    if not time_in:
+        return 0
+    end = time_out or now or datetime.now()
+    return int((end - time_in).total_seconds() / 60)
+
+def attendance_row_dict(row, person_name=None, now=None):
+    """Serialize một attendance (row của attendance_rows() hoặc Attendance)"""
+    return {
+        'attendance_id': row.attendance_id,
+        'person_id': row.person_id,
+        'person_name': getattr(row, 'person_name', None) or person_name or 'Unknown',
+        'track_id': row.track_id,
+        'time_in': row.time_in.isoformat() if row.time_in else None,
+        'time_out': row.time_out.isoformat() if row.time_out else None,
+        'status': row.status,
+        'duration_minutes': duration_minutes(row.time_in, row.time_out, now)
+    }
+
+def log_row_dict(row, device_name=None):
+    """Serialize một log (row của log_rows() hoặc Log)"""
+    return {
+        'log_id': row.log_id,
+        'device_id': row.device_id,
+        'device_name': getattr(row, 'device_name', None) or device_name or 'Unknown',
+        'event_type': row.event_type,
+        'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+        'details': row.details
+    }
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Áp dụng cấu hình SQLite cho mỗi connection mới"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f'PRAGMA journal_mode={Config.SQLITE_JOURNAL_MODE}')
+        cursor.execute(f'PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA cache_size=-{int(Config.SQLITE_CACHE_SIZE_KB)}')
+        cursor.execute(f'PRAGMA mmap_size={int(Config.SQLITE_MMAP_SIZE)}')
+        cursor.execute(f'PRAGMA busy_timeout={int(Config.SQLITE_BUSY_TIMEOUT * 1000)}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+    finally:
+        cursor.close()
+
+def configure_sqlite(engine):
+    """Gắn PRAGMA tuning (WAL, synchronous, cache, mmap, busy timeout) vào engine SQLite"""
+    if engine.dialect.name != 'sqlite':
+        return
+    if not event.contains(engine, 'connect', _set_sqlite_pragmas):
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+        # Connections opened before the listener existed are replaced
+        engine.dispose()
+
+def ensure_indexes(engine):
+    """Migration: tạo các index khai báo trong model nếu database cũ chưa có.
+
+    ``create_all`` only creates indexes together with new tables, so
+    existing databases get them here (CREATE INDEX IF NOT EXISTS). If the
+    person table already holds duplicate names, the unique index cannot be
+    built and a plain index on name is created instead; once that index
+    exists the unique one is no longer attempted.
+    """
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+        for index in list(table.indexes):
+            if index.name == 'uq_person_name' and 'ix_person_name' in existing:
+                # Duplicate names found earlier: the non-unique fallback replaces it
+                continue
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except IntegrityError:
+                if index.name != 'uq_person_name':
+                    raise
+                print("Duplicate person names found: creating non-unique index ix_person_name instead")
+                # Plain SQL: an Index object would attach itself to the model table
+                with engine.begin() as connection:
+                    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_person_name ON person (name)'))
 
 def init_db(app):
     """Khởi tạo database"""
@@ -141,8 +301,13 @@ def init_db(app):
         # Tạo thư mục database nếu chưa có
         os.makedirs('database', exist_ok=True)
         
+        # WAL, synchronous, cache / mmap size và busy timeout cho SQLite
+        configure_sqlite(db.engine)
+        
         # Tạo tất cả bảng
         db.create_all()
+        # Thêm index còn thiếu cho database cũ
+        ensure_indexes(db.engine)
         
         # Tạo device mặc định nếu chưa có
         if not Device.query.first():
@@ -1,7 +1,14 @@
 from datetime import datetime, timedelta
-from app.models.database import Attendance, Person, Log, Device, db
+from sqlalchemy import func, case, and_
+from app.models.database import Attendance, AttendanceDaily, Person, Log, db, attendance_rows, attendance_row_dict
+from app.services.log_writer import log_writer
+from app.services.event_bus import event_bus
+from app.services.attendance_journal import AttendanceJournal
+from app.services.attendance_rollup import UNKNOWN_PERSON_KEY, clear_rollup
 from config import Config
-import json
+
+# Cột của dữ liệu export (JSON / CSV / Excel)
+EXPORT_COLUMNS = ('attendance_id', 'person_name', 'person_id', 'track_id', 'time_in', 'time_out', 'status', 'duration_minutes')
 
 class AttendanceService:
     """Service quản lý chấm công và theo dõi hiện diện"""
@@ -21,10 +28,22 @@ class AttendanceService:
         #   }
         # }
         self.active_attendances = {}
+        # Write-behind persistence; started by create_app once the DB is ready
+        self.journal = AttendanceJournal()
     
+    def _flush_journal(self, action):
+        """Chờ journal commit các thay đổi đang chờ trước khi đọc / ghi trực tiếp DB; False nếu quá thời gian"""
+        if self.journal.flush(Config.ATTENDANCE_FLUSH_TIMEOUT):
+            return True
+        print(f"Attendance journal still has uncommitted changes: {action} aborted")
+        return False
+
     def log_time_in_manual(self, track_id, person_id=None, person_name=None):
         """Ghi log thời gian vào thủ công - chỉ tạo mới nếu user chưa có attendance đang mở"""
         try:
+            # Attendance changes still in the journal must be visible to the queries below
+            if not self._flush_journal('manual time in'):
+                return None
             try:
                 app_ctx = getattr(self, 'app', None)
                 if app_ctx:
@@ -167,6 +186,8 @@ class AttendanceService:
     def log_time_out_manual(self, person_id=None, person_name=None):
         """Check-out user dựa vào person_id hoặc name (không cần track_id, user có thể không có mặt trên camera)"""
         try:
+            if not self._flush_journal('manual time out'):
+                return None
             try:
                 app_ctx = getattr(self, 'app', None)
                 if app_ctx:
@@ -279,6 +300,30 @@ class AttendanceService:
             if track_id in self.active_attendances:
                 return self.active_attendances[track_id]
             
+            if self.journal.running:
+                # Write-behind: memory first, DB insert happens on the journal writer thread
+                attendance_data = {
+                    'attendance_id': self.journal.allocate_id(),
+                    'person_id': person_id,
+                    'person_name': person_name,
+                    'track_id': track_id,
+                    'time_in': datetime.now(),
+                    'time_out': None,
+                    'status': 'Present'
+                }
+                self.active_attendances[track_id] = attendance_data
+                self.journal.record_open(attendance_data)
+
+                self.log_attendance_event('time_in', {
+                    'track_id': track_id,
+                    'person_id': person_id,
+                    'person_name': person_name,
+                    'attendance_id': attendance_data['attendance_id']
+                })
+
+                print(f"Time in logged: {person_name or 'Unknown'} (Track ID: {track_id})")
+                return attendance_data
+            
             # Tạo attendance record mới (chỉ lưu trong memory nếu không có app context)
             try:
                 # Prefer using self.app if set (allows other threads to push DB writes)
@@ -380,6 +425,26 @@ class AttendanceService:
 
             attendance = self.active_attendances[track_id]
 
+            if self.journal.running and attendance.get('attendance_id'):
+                # Write-behind: close in memory now, the journal writer updates the row
+                attendance['time_out'] = datetime.now()
+                self.journal.record_close(attendance['attendance_id'], attendance['time_out'])
+                person_name = attendance.get('person_name') or 'Unknown'
+                try:
+                    duration_minutes = int((attendance['time_out'] - attendance['time_in']).total_seconds() / 60)
+                except Exception:
+                    duration_minutes = 0
+                self.log_attendance_event('time_out', {
+                    'track_id': track_id,
+                    'person_id': attendance.get('person_id'),
+                    'person_name': person_name,
+                    'attendance_id': attendance['attendance_id'],
+                    'duration_minutes': duration_minutes
+                })
+                print(f"Time out logged: {person_name} (Track ID: {track_id})")
+                del self.active_attendances[track_id]
+                return attendance
+
             try:
                 app_ctx = getattr(self, 'app', None)
                 if app_ctx:
@@ -471,6 +536,8 @@ class AttendanceService:
         """Check-out tất cả attendance còn đang mở trong hệ thống (in-memory + database)."""
         try:
             results = []
+            if not self._flush_journal('checkout all'):
+                return results
 
             # Khi có app context: cập nhật trực tiếp các bản ghi trong DB
             app_ctx = getattr(self, 'app', None)
@@ -540,6 +607,9 @@ class AttendanceService:
     def clear_all_history(self):
         """Xóa toàn bộ lịch sử attendance (DB và bộ nhớ)."""
         deleted = 0
+        # Pending journal entries must not re-create rows after the delete
+        if not self._flush_journal('clear history'):
+            raise RuntimeError('Attendance changes are still being written, try again')
         try:
             app_ctx = getattr(self, 'app', None)
             ctx = None
@@ -556,6 +626,8 @@ class AttendanceService:
                 with ctx:
                     try:
                         deleted = Attendance.query.delete()
+                        # Bulk delete bypasses the rollup hook
+                        clear_rollup()
                         db.session.commit()
                     except Exception as e:
                         db.session.rollback()
@@ -563,6 +635,8 @@ class AttendanceService:
                         deleted = 0
 
             self.active_attendances.clear()
+            event_bus.publish('attendance', {'action': 'history_cleared', 'deleted': deleted,
+                                             'timestamp': datetime.now().isoformat()})
             return deleted
         except Exception as e:
             print(f"Error in clear_all_history: {e}")
@@ -598,35 +672,40 @@ class AttendanceService:
         return self.active_attendances.copy()
     
     def get_attendance_stats(self, date=None):
-        """Lấy thống kê attendance"""
+        """Lấy thống kê attendance (một câu SQL aggregate)"""
         if date is None:
             date = datetime.now().date()
         
         try:
             app_ctx = getattr(self, 'app', None)
             if app_ctx:
-                with app_ctx.app_context():
-                    start_date = datetime.combine(date, datetime.min.time())
-                    end_date = start_date + timedelta(days=1)
-
-                    # Attendance trong ngày
-                    daily_attendances = Attendance.query.filter(
-                        Attendance.time_in >= start_date,
-                        Attendance.time_in < end_date
-                    ).all()
-
-                    # Thống kê
-                    stats = {
-                        'date': date.isoformat(),
-                        'total_checkins': len(daily_attendances),
-                        'active_now': len(self.active_attendances),
-                        'completed_sessions': len([a for a in daily_attendances if a.time_out is not None]),
-                        'ongoing_sessions': len([a for a in daily_attendances if a.time_out is None]),
-                        'unique_people': len(set([a.person_id for a in daily_attendances if a.person_id is not None])),
-                        'unknown_people': len([a for a in daily_attendances if a.person_id is None])
-                    }
-
-                    return stats
+                ctx = app_ctx.app_context()
+            else:
+                from flask import current_app
+                ctx = current_app.app_context()
+
+            with ctx:
+                # Đọc từ bảng tổng hợp attendance_daily (một dòng mỗi người)
+                row = db.session.query(
+                    func.sum(AttendanceDaily.checkins),
+                    func.sum(AttendanceDaily.completed),
+                    func.sum(case((AttendanceDaily.person_key != UNKNOWN_PERSON_KEY, 1), else_=0)),
+                    func.sum(case((AttendanceDaily.person_key == UNKNOWN_PERSON_KEY, AttendanceDaily.checkins), else_=0))
+                ).filter(AttendanceDaily.day == date).one()
+                total, completed, unique_people, unknown_people = (int(value or 0) for value in row)
+
+                # Thống kê
+                stats = {
+                    'date': date.isoformat(),
+                    'total_checkins': total or 0,
+                    'active_now': len(self.active_attendances),
+                    'completed_sessions': completed or 0,
+                    'ongoing_sessions': (total or 0) - (completed or 0),
+                    'unique_people': unique_people or 0,
+                    'unknown_people': int(unknown_people or 0)
+                }
+
+                return stats
         except RuntimeError:
             # Không có application context, trả về thống kê cơ bản
             return {
@@ -679,106 +758,128 @@ class AttendanceService:
             return []
     
     def get_person_attendance_summary(self, person_id, days=30):
-        """Lấy tổng kết attendance của một người"""
+        """Lấy tổng kết attendance của một người (từ bảng tổng hợp theo ngày)"""
         try:
             from flask import current_app
             with current_app.app_context():
-                end_date = datetime.now()
-                start_date = end_date - timedelta(days=days)
+                start_day = (datetime.now() - timedelta(days=days)).date()
                 
-                attendances = Attendance.query.filter(
-                    Attendance.person_id == person_id,
-                    Attendance.time_in >= start_date,
-                    Attendance.time_in <= end_date
-                ).all()
+                total_sessions, total_minutes = db.session.query(
+                    func.sum(AttendanceDaily.completed),
+                    func.sum(AttendanceDaily.total_minutes)
+                ).filter(
+                    AttendanceDaily.person_key == person_id,
+                    AttendanceDaily.day >= start_day
+                ).one()
                 
-                total_hours = 0
-                total_days = 0
-                avg_session_hours = 0
-                
-                for attendance in attendances:
-                    if attendance.time_out:
-                        duration_hours = attendance.get_duration_minutes() / 60
-                        total_hours += duration_hours
-                        total_days += 1
+                return self._summary_dict(person_id, days, total_sessions, total_minutes)
+        except RuntimeError:
+            # Không có application context, trả về thống kê cơ bản
+            return self._summary_dict(person_id, days, 0, 0)
+    
+    def get_persons_attendance_summary(self, person_ids=None, days=30):
+        """Tổng kết attendance của nhiều người trong một câu GROUP BY.
+
+        Returns one summary per person (persons without sessions included),
+        in the same format as get_person_attendance_summary plus 'name'.
+        Reads the daily rollup, so the period starts at midnight ``days``
+        days ago.
+        """
+        try:
+            from flask import current_app
+            with current_app.app_context():
+                start_day = (datetime.now() - timedelta(days=days)).date()
                 
-                if total_days > 0:
-                    avg_session_hours = total_hours / total_days
+                query = db.session.query(
+                    Person.person_id,
+                    Person.name,
+                    func.sum(AttendanceDaily.completed),
+                    func.sum(AttendanceDaily.total_minutes)
+                ).outerjoin(AttendanceDaily, and_(
+                    AttendanceDaily.person_key == Person.person_id,
+                    AttendanceDaily.day >= start_day
+                ))
+                if person_ids:
+                    query = query.filter(Person.person_id.in_(person_ids))
+                rows = query.group_by(Person.person_id, Person.name).order_by(Person.name).all()
                 
-                return {
-                    'person_id': person_id,
-                    'period_days': days,
-                    'total_hours': round(total_hours, 2),
-                    'total_sessions': total_days,
-                    'avg_session_hours': round(avg_session_hours, 2),
-                    'attendance_rate': round((total_days / days) * 100, 2) if days > 0 else 0
-                }
+                summaries = []
+                for pid, name, total_sessions, total_minutes in rows:
+                    summary = self._summary_dict(pid, days, total_sessions, total_minutes)
+                    summary['name'] = name
+                    summaries.append(summary)
+                return summaries
         except RuntimeError:
-            # Không có application context, trả về thống kê cơ bản
-            return {
-                'person_id': person_id,
-                'period_days': days,
-                'total_hours': 0,
-                'total_sessions': 0,
-                'avg_session_hours': 0,
-                'attendance_rate': 0
-            }
+            # Không có application context
+            return []
+    
+    def _summary_dict(self, person_id, days, total_sessions, total_minutes):
+        total_sessions = int(total_sessions or 0)
+        total_hours = float(total_minutes or 0) / 60
+        avg_session_hours = total_hours / total_sessions if total_sessions > 0 else 0
+        return {
+            'person_id': person_id,
+            'period_days': days,
+            'total_hours': round(total_hours, 2),
+            'total_sessions': total_sessions,
+            'avg_session_hours': round(avg_session_hours, 2),
+            'attendance_rate': round((total_sessions / days) * 100, 2) if days > 0 else 0
+        }
     
     def export_attendance_data(self, date_from=None, date_to=None, format='json'):
-        """Xuất dữ liệu attendance"""
-        try:
-            app_ctx = getattr(self, 'app', None)
-            if app_ctx:
-                with app_ctx.app_context():
-                    query = Attendance.query
-
-                    if date_from:
-                        query = query.filter(Attendance.time_in >= date_from)
+        """Xuất dữ liệu attendance (danh sách dict, cùng cột với file CSV / Excel)"""
+        return [dict(zip(EXPORT_COLUMNS, row)) for row in self.iter_attendance_export(date_from, date_to)]
+    
+    def iter_attendance_export(self, date_from=None, date_to=None, chunk_size=None):
+        """Sinh từng dòng export (theo EXPORT_COLUMNS), đọc DB theo khối.
+
+        One joined column query (attendance_rows: no ORM objects, no lazy loads)
+        fetched ``EXPORT_CHUNK_SIZE`` rows at a time, so memory stays flat
+        for any date range. The generator opens its own app context and can
+        be consumed by a streaming response after the request has returned.
+        Raises RuntimeError, before any row is produced, when changes still
+        waiting in the journal could not be committed.
+        """
+        # Include changes still waiting in the write-behind journal
+        if not self._flush_journal('export'):
+            raise RuntimeError('Attendance changes are still being written, try again')
+        return self._iter_export_rows(date_from, date_to, chunk_size)
+
+    def _iter_export_rows(self, date_from, date_to, chunk_size):
+        app_ctx = getattr(self, 'app', None)
+        if app_ctx:
+            ctx = app_ctx.app_context()
+        else:
+            try:
+                from flask import current_app
+                ctx = current_app._get_current_object().app_context()
+            except RuntimeError:
+                # Không có application context
+                return
 
-                    if date_to:
-                        query = query.filter(Attendance.time_in <= date_to)
+        with ctx:
+            query = attendance_rows()
 
-                    attendances = query.order_by(Attendance.time_in.desc()).all()
+            if date_from:
+                query = query.filter(Attendance.time_in >= date_from)
 
-                    if format == 'json':
-                        return [attendance.to_dict() for attendance in attendances]
-                    elif format == 'csv':
-                        # Implement CSV export
-                        pass
+            if date_to:
+                query = query.filter(Attendance.time_in <= date_to)
 
-                    return attendances
-        except RuntimeError:
-            # Không có application context, trả về danh sách rỗng
-            return []
+            query = query.order_by(Attendance.time_in.desc(), Attendance.attendance_id.desc())
+            now = datetime.now()
+            try:
+                for row in query.yield_per(chunk_size or Config.EXPORT_CHUNK_SIZE):
+                    item = attendance_row_dict(row, now=now)
+                    yield tuple(item[column] for column in EXPORT_COLUMNS)
+            finally:
+                db.session.rollback()
     
     def log_attendance_event(self, event_type, details):
-        """Ghi log sự kiện attendance"""
+        """Ghi log sự kiện attendance (bất đồng bộ qua log_writer) và đẩy tới dashboard (SSE)"""
         try:
-            app_ctx = getattr(self, 'app', None)
-            if app_ctx:
-                with app_ctx.app_context():
-                    device = Device.query.first()
-                    log = Log(
-                        device_id=device.device_id if device else None,
-                        event_type=f'attendance_{event_type}',
-                        details=json.dumps(details) if isinstance(details, dict) else str(details)
-                    )
-                    db.session.add(log)
-                    db.session.commit()
-            else:
-                from flask import current_app
-                with current_app.app_context():
-                    device = Device.query.first()
-                    log = Log(
-                        device_id=device.device_id if device else None,
-                        event_type=f'attendance_{event_type}',
-                        details=json.dumps(details) if isinstance(details, dict) else str(details)
-                    )
-                    db.session.add(log)
-                    db.session.commit()
-        except RuntimeError:
-            # Không có application context, bỏ qua logging
-            pass
+            log_writer.submit(f'attendance_{event_type}', details)
+            event_bus.publish('attendance', dict(details, action=event_type, timestamp=datetime.now().isoformat()))
         except Exception as e:
             print(f"Error logging attendance event: {e}")
     
@@ -834,7 +935,9 @@ class AttendanceService:
                 updated = True
 
             # Update DB record if present
-            if updated and attendance.get('attendance_id'):
+            if updated and attendance.get('attendance_id') and self.journal.running:
+                self.journal.record_identity(attendance['attendance_id'], attendance.get('person_id'))
+            elif updated and attendance.get('attendance_id'):
                 try:
                     app_ctx = getattr(self, 'app', None)
                     if app_ctx:
@@ -0,0 +1,295 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from app.models.database import db, Attendance, reserve_attendance_ids
+from app.utils.queues import BoundedQueue, DROP_NEWEST
+from app.utils.workers import BackgroundWorker
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock_file(f):
+    """Khoá độc quyền (không chờ) một file đang mở; False nếu tiến trình khác đang giữ"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+class AttendanceJournal(BackgroundWorker):
+    """Write-behind cho bảng Attendance: journal cục bộ + ghi DB theo lô.
+
+    The frame loop updates ``active_attendances`` in memory and calls
+    ``record_open`` / ``record_close`` / ``record_identity``. Each change
+    is appended to a JSONL journal file (fsynced when
+    ``ATTENDANCE_JOURNAL_FSYNC`` is set) and queued for a writer thread,
+    which applies up to ``ATTENDANCE_BATCH_SIZE`` changes per transaction.
+    Applying a change is idempotent (rows are looked up by id), so the
+    journal can be replayed after a crash: ``start`` replays whatever is
+    still in the file before accepting new changes. The file is truncated
+    once every queued change has been committed.
+
+    Attendance ids are allocated here from blocks of
+    ``ATTENDANCE_ID_BLOCK`` ids reserved in the shared id sequence
+    (``reserve_attendance_ids``), so a row has its final id before it
+    reaches the database and no other process or direct insert can take
+    it. The writer thread reserves the next block before the current one
+    runs out.
+
+    The journal file belongs to one process: ``start`` takes an exclusive
+    lock on ``<path>.lock`` and, if another process holds it, leaves the
+    journal stopped so this process writes attendance synchronously.
+    """
+
+    thread_name = 'attendance-writer'
+    stop_order = 50
+
+    def __init__(self, path=None, batch_size=None, flush_interval=None):
+        self.path = path or Config.ATTENDANCE_JOURNAL_PATH
+        self.batch_size = max(1, int(batch_size or Config.ATTENDANCE_BATCH_SIZE))
+        self.flush_interval = flush_interval or Config.ATTENDANCE_FLUSH_INTERVAL
+        super().__init__()
+        self._file = None
+        self._lock = threading.Lock()
+        self._committed_cond = threading.Condition()
+        self._lock_file = None
+        self._next_id = None
+        self._block_end = None
+        self._next_block = None
+        self._seq = 0
+        self._committed_seq = 0
+        self._pending = []
+        self._overflow = False
+        self.committed = 0
+        self.failed_flushes = 0
+        self.replayed = 0
+
+    # ----- lifecycle -----
+
+    def _new_queue(self):
+        return BoundedQueue(Config.ATTENDANCE_QUEUE_SIZE, DROP_NEWEST, 'attendance')
+
+    def _on_start(self, app):
+        """Replay journal còn sót và khởi tạo bộ cấp id trước khi writer thread chạy"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock_file = open(self.path + '.lock', 'a+')
+        if not _lock_file(self._lock_file):
+            self._lock_file.close()
+            self._lock_file = None
+            print(f"Attendance journal {self.path} is in use by another process: writing attendance synchronously")
+            return False
+
+        leftover = self._read_journal()
+        with app.app_context():
+            if leftover:
+                try:
+                    self._apply(leftover)
+                    self.replayed += len(leftover)
+                    print(f"Replayed {len(leftover)} attendance changes from journal")
+                except Exception as e:
+                    # Keep the journal; the writer thread retries these first
+                    self._pending = leftover
+                    print(f"Error replaying attendance journal: {e}")
+        self._next_id, self._block_end = self._reserve_block()
+        self._next_block = None
+        self._seq = max((entry.get('seq', 0) for entry in leftover), default=0)
+        self._committed_seq = 0 if self._pending else self._seq
+
+        self._file = open(self.path, 'a' if self._pending else 'w', encoding='utf-8')
+
+    def _on_stop(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._lock_file is not None:
+                # Closing the file releases the lock
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _reserve_block(self):
+        """(id đầu, id cuối + 1) của một khối attendance_id mới giữ chỗ trong DB"""
+        size = max(1, int(Config.ATTENDANCE_ID_BLOCK))
+        with self.app.app_context():
+            try:
+                first = reserve_attendance_ids(db.session.connection(), size)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        return first, first + size
+
+    # ----- producer side (frame loop) -----
+
+    def allocate_id(self):
+        """Cấp attendance_id mới (duy nhất giữa các tiến trình, tăng dần)"""
+        with self._lock:
+            if self._next_id >= self._block_end:
+                # Normally prefetched by the writer thread; reserve now after a burst
+                self._next_id, self._block_end = self._next_block or self._reserve_block()
+                self._next_block = None
+            attendance_id = self._next_id
+            self._next_id += 1
+            return attendance_id
+
+    def _prefetch_block(self):
+        with self._lock:
+            low = self._next_block is None and self._block_end - self._next_id < max(1, Config.ATTENDANCE_ID_BLOCK // 4)
+        if low:
+            try:
+                block = self._reserve_block()
+            except Exception as e:
+                print(f"Error reserving attendance ids: {e}")
+                return
+            with self._lock:
+                if self._next_block is None:
+                    self._next_block = block
+
+    def record_open(self, attendance):
+        self._record({
+            'op': 'open',
+            'attendance_id': attendance['attendance_id'],
+            'person_id': attendance.get('person_id'),
+            'track_id': attendance.get('track_id'),
+            'time_in': attendance['time_in'].isoformat(),
+            'status': attendance.get('status') or 'Present'
+        })
+
+    def record_close(self, attendance_id, time_out):
+        self._record({'op': 'close', 'attendance_id': attendance_id, 'time_out': time_out.isoformat()})
+
+    def record_identity(self, attendance_id, person_id):
+        self._record({'op': 'identity', 'attendance_id': attendance_id, 'person_id': person_id})
+
+    def _record(self, entry):
+        with self._lock:
+            self._seq += 1
+            entry['seq'] = self._seq
+            if self._file is not None:
+                self._file.write(json.dumps(entry) + '\n')
+                self._file.flush()
+                if Config.ATTENDANCE_JOURNAL_FSYNC:
+                    os.fsync(self._file.fileno())
+            if not self.queue.put(entry):
+                # Still in the journal file; the writer replays it from there
+                self._overflow = True
+
+    # ----- writer side -----
+
+    def flush(self, timeout=5.0):
+        """Chờ writer commit mọi thay đổi đã ghi nhận; trả về False nếu quá thời gian"""
+        with self._lock:
+            target = self._seq
+        with self._committed_cond:
+            return self._committed_cond.wait_for(
+                lambda: self._committed_seq >= target or not self.running, timeout) and self._committed_seq >= target
+
+    def _run(self):
+        while True:
+            batch = self._pending or self.queue.get_batch(self.batch_size, timeout=self.flush_interval)
+            if batch or self._overflow:
+                if not self._flush(batch):
+                    time.sleep(self.flush_interval)
+            elif self.queue.closed:
+                break
+            self._prefetch_block()
+
+    def _flush(self, batch):
+        if self._overflow:
+            # Queue overflowed: the journal file holds every change not yet committed
+            with self._lock:
+                self._overflow = False
+                batch = self._read_journal()
+                self.queue.get_batch(self.queue.maxsize, timeout=0)
+        try:
+            with self.app.app_context():
+                self._apply(batch)
+            self._pending = []
+            self.committed += len(batch)
+        except Exception as e:
+            self._pending = batch
+            self.failed_flushes += 1
+            print(f"Error writing {len(batch)} attendance changes: {e}")
+            return False
+        with self._committed_cond:
+            self._committed_seq = max([self._committed_seq] + [entry.get('seq', 0) for entry in batch])
+            self._committed_cond.notify_all()
+        self._compact()
+        return True
+
+    def _apply(self, entries):
+        """Áp dụng các thay đổi vào DB trong một transaction (idempotent)"""
+        try:
+            for entry in entries:
+                attendance = db.session.get(Attendance, entry['attendance_id'])
+                op = entry.get('op')
+                if op == 'open':
+                    if attendance is None:
+                        db.session.add(Attendance(
+                            attendance_id=entry['attendance_id'],
+                            person_id=entry.get('person_id'),
+                            track_id=entry.get('track_id'),
+                            time_in=datetime.fromisoformat(entry['time_in']),
+                            status=entry.get('status') or 'Present'
+                        ))
+                elif attendance is None:
+                    continue
+                elif op == 'close':
+                    attendance.time_out = datetime.fromisoformat(entry['time_out'])
+                elif op == 'identity':
+                    attendance.person_id = entry.get('person_id')
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _compact(self):
+        """Xóa nội dung journal khi mọi thay đổi đã được commit"""
+        with self._lock:
+            if self._file is not None and len(self.queue) == 0 and not self._pending and not self._overflow:
+                self._file.seek(0)
+                self._file.truncate()
+                self._file.flush()
+
+    def _read_journal(self):
+        if self._file is not None:
+            self._file.flush()
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Torn last line after a crash
+                    continue
+        entries.sort(key=lambda entry: entry.get('seq', 0))
+        return entries
+
+    def stats(self):
+        """Thống kê journal: số thay đổi đang chờ, đã commit, lỗi và replay"""
+        return {
+            'running': self.running,
+            'pending': len(self.queue) + len(self._pending),
+            'committed': self.committed,
+            'failed_flushes': self.failed_flushes,
+            'replayed': self.replayed,
+            'next_id': self._next_id,
+            'queue': self.queue.stats()
+        }
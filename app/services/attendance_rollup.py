@@ -0,0 +1,244 @@
+from datetime import datetime, date, timedelta
+from sqlalchemy import event, func, case, cast, Integer, literal, literal_column, or_, inspect
+from sqlalchemy.orm import Session
+from app.models.database import db, Attendance, AttendanceDaily
+
+
+UNKNOWN_PERSON_KEY = 0
+
+_daily = AttendanceDaily.__table__
+_hooks_installed = False
+
+
+def duration_minutes_expr(dialect_name):
+    """Biểu thức SQL: số phút (làm tròn xuống) giữa time_in và time_out, như get_duration_minutes.
+
+    Returns None for other dialects; callers then sum the minutes in
+    Python with ``_duration_minutes`` (this runs inside a flush hook and
+    must not fail the commit).
+    """
+    if dialect_name == 'sqlite':
+        # julianday is a float: round to milliseconds before the integer division
+        milliseconds = cast(func.round((func.julianday(Attendance.time_out) - func.julianday(Attendance.time_in)) * 86400000), Integer)
+        return milliseconds // 60000
+    if dialect_name == 'postgresql':
+        return func.floor(func.extract('epoch', Attendance.time_out - Attendance.time_in) / 60)
+    if dialect_name in ('mysql', 'mariadb'):
+        return func.timestampdiff(literal_column('MINUTE'), Attendance.time_in, Attendance.time_out)
+    return None
+
+
+def _person_key(person_id):
+    return person_id if person_id is not None else UNKNOWN_PERSON_KEY
+
+
+def _duration_minutes(time_in, time_out):
+    if time_in is None or time_out is None:
+        return 0
+    return int((time_out - time_in).total_seconds() / 60)
+
+
+def _minutes_sum(duration):
+    """SUM(số phút) của các dòng đã check-out; 0 nếu dialect không có biểu thức duration"""
+    if duration is None:
+        return literal(0)
+    return func.coalesce(func.sum(case((Attendance.time_out.isnot(None), duration), else_=0)), 0)
+
+
+def _iter_completed(connection, *conditions):
+    """(time_in, time_out, person_id) của các dòng đã check-out (tính số phút trong Python)"""
+    return connection.execute(
+        db.select(Attendance.time_in, Attendance.time_out, Attendance.person_id)
+        .where(Attendance.time_out.isnot(None), *conditions))
+
+
+# ----- incremental maintenance -----
+
+def _add(connection, day, key, checkins=0, completed=0, minutes=0, first_in=None, last_out=None):
+    """Cộng dồn vào một dòng (day, person_key); tạo dòng nếu chưa có"""
+    values = {
+        'checkins': _daily.c.checkins + checkins,
+        'completed': _daily.c.completed + completed,
+        'total_minutes': _daily.c.total_minutes + minutes
+    }
+    if first_in is not None:
+        values['first_in'] = case(
+            (or_(_daily.c.first_in.is_(None), _daily.c.first_in > first_in), first_in), else_=_daily.c.first_in)
+    if last_out is not None:
+        values['last_out'] = case(
+            (or_(_daily.c.last_out.is_(None), _daily.c.last_out < last_out), last_out), else_=_daily.c.last_out)
+    result = connection.execute(
+        _daily.update().where(_daily.c.day == day, _daily.c.person_key == key).values(**values))
+    if result.rowcount == 0:
+        connection.execute(_daily.insert().values(
+            day=day, person_key=key, checkins=checkins, completed=completed,
+            total_minutes=minutes, first_in=first_in, last_out=last_out))
+
+
+def _recompute(connection, day, key):
+    """Tính lại một dòng (day, person_key) từ bảng attendance"""
+    start = datetime.combine(day, datetime.min.time())
+    person_filter = Attendance.person_id.is_(None) if key == UNKNOWN_PERSON_KEY else Attendance.person_id == key
+    duration = duration_minutes_expr(connection.dialect.name)
+    conditions = (person_filter, Attendance.time_in >= start, Attendance.time_in < start + timedelta(days=1))
+    row = connection.execute(
+        db.select(
+            func.count(Attendance.attendance_id),
+            func.count(Attendance.time_out),
+            _minutes_sum(duration),
+            func.min(Attendance.time_in),
+            func.max(Attendance.time_out)
+        ).where(*conditions)
+    ).one()
+    minutes = int(row[2] or 0)
+    if duration is None and row[1]:
+        minutes = sum(_duration_minutes(time_in, time_out) for time_in, time_out, _ in _iter_completed(connection, *conditions))
+    connection.execute(_daily.delete().where(_daily.c.day == day, _daily.c.person_key == key))
+    if row[0]:
+        connection.execute(_daily.insert().values(
+            day=day, person_key=key, checkins=row[0], completed=row[1],
+            total_minutes=minutes, first_in=row[3], last_out=row[4]))
+
+
+def _old_value(state, name):
+    """(known, value) của một thuộc tính trước khi flush"""
+    history = state.attrs[name].history
+    if history.deleted:
+        return True, history.deleted[0]
+    if history.added:
+        # Attribute was not loaded before it changed: previous value unknown
+        return False, None
+    return True, state.attrs[name].value
+
+
+def _after_flush(session, flush_context):
+    attendances_new = [obj for obj in session.new if isinstance(obj, Attendance)]
+    attendances_dirty = [obj for obj in session.dirty if isinstance(obj, Attendance)]
+    attendances_deleted = [obj for obj in session.deleted if isinstance(obj, Attendance)]
+    if not (attendances_new or attendances_dirty or attendances_deleted):
+        return
+
+    connection = session.connection()
+    recompute = set()
+
+    for obj in attendances_new:
+        if obj.time_in is None:
+            continue
+        _add(connection, obj.time_in.date(), _person_key(obj.person_id),
+             checkins=1,
+             completed=1 if obj.time_out is not None else 0,
+             minutes=_duration_minutes(obj.time_in, obj.time_out),
+             first_in=obj.time_in, last_out=obj.time_out)
+
+    for obj in attendances_dirty:
+        state = inspect(obj)
+        known = [_old_value(state, name) for name in ('time_in', 'time_out', 'person_id')]
+        if not all(k for k, _ in known):
+            if obj.time_in is not None:
+                recompute.add((obj.time_in.date(), _person_key(obj.person_id)))
+            continue
+        old_in, old_out, old_person = (value for _, value in known)
+        if (old_in, old_out, old_person) == (obj.time_in, obj.time_out, obj.person_id):
+            continue
+        if old_in == obj.time_in and old_person == obj.person_id and old_out is None and obj.time_out is not None:
+            # Hot path: an open attendance is closed
+            _add(connection, obj.time_in.date(), _person_key(obj.person_id),
+                 completed=1, minutes=_duration_minutes(obj.time_in, obj.time_out), last_out=obj.time_out)
+            continue
+        # Identity change, reopen or edited times: rebuild the affected rows
+        if old_in is not None:
+            recompute.add((old_in.date(), _person_key(old_person)))
+        if obj.time_in is not None:
+            recompute.add((obj.time_in.date(), _person_key(obj.person_id)))
+
+    for obj in attendances_deleted:
+        known_in, old_in = _old_value(inspect(obj), 'time_in')
+        known_person, old_person = _old_value(inspect(obj), 'person_id')
+        if known_in and known_person and old_in is not None:
+            recompute.add((old_in.date(), _person_key(old_person)))
+
+    for day, key in recompute:
+        _recompute(connection, day, key)
+
+
+def install_rollup_hooks():
+    """Đăng ký hook after_flush để cập nhật attendance_daily cùng transaction"""
+    global _hooks_installed
+    if not _hooks_installed:
+        event.listen(Session, 'after_flush', _after_flush)
+        _hooks_installed = True
+
+
+# ----- backfill -----
+
+def _day_expr(dialect_name):
+    if dialect_name == 'sqlite':
+        return func.date(Attendance.time_in)
+    return cast(Attendance.time_in, db.Date)
+
+
+def rebuild_rollup(date_from=None, date_to=None):
+    """Xây lại attendance_daily từ bảng attendance (toàn bộ hoặc trong khoảng ngày).
+
+    Must run inside an app context. Returns the number of rollup rows written.
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+    day = _day_expr(dialect)
+    duration = duration_minutes_expr(dialect)
+
+    delete = _daily.delete()
+    query = db.select(
+        day.label('day'),
+        func.coalesce(Attendance.person_id, UNKNOWN_PERSON_KEY).label('person_key'),
+        func.count(Attendance.attendance_id),
+        func.count(Attendance.time_out),
+        _minutes_sum(duration),
+        func.min(Attendance.time_in),
+        func.max(Attendance.time_out)
+    )
+    conditions = []
+    if date_from is not None:
+        delete = delete.where(_daily.c.day >= date_from)
+        conditions.append(Attendance.time_in >= datetime.combine(date_from, datetime.min.time()))
+    if date_to is not None:
+        delete = delete.where(_daily.c.day <= date_to)
+        conditions.append(Attendance.time_in < datetime.combine(date_to, datetime.min.time()) + timedelta(days=1))
+    query = query.where(*conditions).group_by(day, func.coalesce(Attendance.person_id, UNKNOWN_PERSON_KEY))
+
+    minutes = None
+    if duration is None:
+        # No SQL duration expression for this dialect: sum the minutes in Python
+        minutes = {}
+        for time_in, time_out, person_id in _iter_completed(connection, *conditions):
+            key = (time_in.date(), _person_key(person_id))
+            minutes[key] = minutes.get(key, 0) + _duration_minutes(time_in, time_out)
+
+    connection.execute(delete)
+    rows = []
+    for row in connection.execute(query):
+        row_day = row[0] if isinstance(row[0], date) else date.fromisoformat(str(row[0])[:10])
+        rows.append({
+            'day': row_day, 'person_key': row[1], 'checkins': row[2], 'completed': row[3],
+            'total_minutes': int(row[4] or 0) if minutes is None else minutes.get((row_day, row[1]), 0),
+            'first_in': row[5], 'last_out': row[6]
+        })
+    if rows:
+        connection.execute(_daily.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def ensure_rollup():
+    """Backfill attendance_daily nếu bảng còn trống nhưng đã có dữ liệu attendance"""
+    if db.session.query(AttendanceDaily.day).first() is None and db.session.query(Attendance.attendance_id).first() is not None:
+        rows = rebuild_rollup()
+        print(f"Attendance rollup backfilled: {rows} rows")
+
+
+def clear_rollup():
+    """Xóa toàn bộ bảng tổng hợp (dùng cùng với xóa lịch sử attendance)"""
+    db.session.execute(_daily.delete())
+
+
+install_rollup_hooks()
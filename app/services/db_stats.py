@@ -0,0 +1,184 @@
+import threading
+import time
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app.models.database import Person, Attendance, Device, Log, get_db_stats
+from app.services.event_bus import event_bus
+from config import Config
+
+
+_COUNTED_TABLES = {'person', 'attendance', 'device', 'log'}
+
+
+class DBStatsCache:
+    """Cache trong tiến trình cho get_db_stats, cập nhật theo các lần ghi.
+
+    A full refresh runs the COUNT queries of ``get_db_stats``. After that,
+    every committed ORM flush adjusts the counters in place (persons,
+    attendances, open attendances, devices, logs), so polling ``get``
+    costs no query. Writes the cache cannot account for exactly (bulk
+    ``query.delete()``, Core statements executed through the session, an
+    attribute changed without its previous value loaded) mark it stale,
+    and the next ``get`` refreshes. Writes made by other processes are
+    picked up by the periodic refresh: the cache is never older than
+    ``DB_STATS_MAX_AGE`` seconds.
+    """
+
+    def __init__(self, max_age=None, enabled=None):
+        self.max_age = Config.DB_STATS_MAX_AGE if max_age is None else max_age
+        self.enabled = Config.DB_STATS_CACHE_ENABLED if enabled is None else enabled
+        self._lock = threading.Lock()
+        self._stats = None
+        self._refreshed_at = 0.0
+        self.hits = 0
+        self.refreshes = 0
+        self.invalidations = 0
+
+    def get(self):
+        """Thống kê database (cần app context khi phải refresh)"""
+        if not self.enabled:
+            return get_db_stats()
+        with self._lock:
+            if self._stats is not None and time.monotonic() - self._refreshed_at < self.max_age:
+                self.hits += 1
+                return dict(self._stats)
+        return self.refresh()
+
+    def refresh(self):
+        """Đếm lại toàn bộ bằng COUNT(*)"""
+        stats = get_db_stats()
+        with self._lock:
+            self._stats = dict(stats)
+            self._refreshed_at = time.monotonic()
+            self.refreshes += 1
+        return stats
+
+    def invalidate(self):
+        with self._lock:
+            self._stats = None
+            self.invalidations += 1
+        # Dashboards re-read /api/stats once instead of receiving the counts
+        event_bus.publish('stats', {'stale': True})
+
+    def apply(self, deltas):
+        """Cộng các thay đổi đã commit vào bộ đếm và đẩy số mới tới dashboard (SSE)"""
+        with self._lock:
+            if self._stats is None:
+                return
+            for key, delta in deltas.items():
+                self._stats[key] = max(0, self._stats.get(key, 0) + delta)
+            stats = dict(self._stats)
+        # The dashboard does not show log counts: skip log-only commits
+        if any(delta and key != 'total_logs' for key, delta in deltas.items()):
+            event_bus.publish('stats', stats)
+
+    def stats(self):
+        with self._lock:
+            age = time.monotonic() - self._refreshed_at if self._stats is not None else None
+        return {
+            'enabled': self.enabled,
+            'max_age': self.max_age,
+            'age_seconds': round(age, 3) if age is not None else None,
+            'hits': self.hits,
+            'refreshes': self.refreshes,
+            'invalidations': self.invalidations
+        }
+
+
+db_stats_cache = DBStatsCache()
+
+
+# ----- session hooks: collect deltas per flush, apply on commit -----
+
+def _pending(session):
+    return session.info.setdefault('db_stats_deltas', {})
+
+
+def _add_delta(deltas, key, value):
+    deltas[key] = deltas.get(key, 0) + value
+
+
+def _time_out_was_open(obj):
+    """True/False nếu biết time_out trước flush có NULL hay không; None nếu không biết"""
+    history = inspect(obj).attrs.time_out.history
+    if history.deleted:
+        return history.deleted[0] is None
+    if history.added:
+        return None
+    return obj.time_out is None
+
+
+def _after_flush(session, flush_context):
+    deltas = _pending(session)
+    for obj in session.new:
+        if isinstance(obj, Person):
+            _add_delta(deltas, 'total_persons', 1)
+        elif isinstance(obj, Attendance):
+            _add_delta(deltas, 'total_attendances', 1)
+            if obj.time_out is None:
+                _add_delta(deltas, 'active_attendances', 1)
+        elif isinstance(obj, Log):
+            _add_delta(deltas, 'total_logs', 1)
+        elif isinstance(obj, Device):
+            _add_delta(deltas, 'total_devices', 1)
+    for obj in session.dirty:
+        if not isinstance(obj, Attendance):
+            continue
+        was_open = _time_out_was_open(obj)
+        if was_open is None:
+            session.info['db_stats_invalidate'] = True
+        elif was_open != (obj.time_out is None):
+            _add_delta(deltas, 'active_attendances', -1 if was_open else 1)
+    for obj in session.deleted:
+        if isinstance(obj, Person):
+            _add_delta(deltas, 'total_persons', -1)
+        elif isinstance(obj, Attendance):
+            _add_delta(deltas, 'total_attendances', -1)
+            was_open = _time_out_was_open(obj)
+            if was_open is None:
+                session.info['db_stats_invalidate'] = True
+            elif was_open:
+                _add_delta(deltas, 'active_attendances', -1)
+        elif isinstance(obj, Log):
+            _add_delta(deltas, 'total_logs', -1)
+        elif isinstance(obj, Device):
+            _add_delta(deltas, 'total_devices', -1)
+
+
+def _do_orm_execute(orm_execute_state):
+    # Bulk insert / update / delete bypass the flush: counts are unknown
+    if orm_execute_state.is_select:
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None and getattr(table, 'name', None) in _COUNTED_TABLES:
+        orm_execute_state.session.info['db_stats_invalidate'] = True
+
+
+def _after_commit(session):
+    deltas = session.info.pop('db_stats_deltas', None)
+    if session.info.pop('db_stats_invalidate', False):
+        db_stats_cache.invalidate()
+    elif deltas:
+        db_stats_cache.apply(deltas)
+
+
+def _after_rollback(session):
+    session.info.pop('db_stats_deltas', None)
+    session.info.pop('db_stats_invalidate', None)
+
+
+_hooks_installed = False
+
+
+def install_stats_hooks():
+    """Đăng ký các hook Session cập nhật db_stats_cache"""
+    global _hooks_installed
+    if not _hooks_installed:
+        event.listen(Session, 'after_flush', _after_flush)
+        event.listen(Session, 'do_orm_execute', _do_orm_execute)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
+        _hooks_installed = True
+
+
+install_stats_hooks()
@@ -0,0 +1,78 @@
+import itertools
+import json
+import threading
+import time
+from app.utils.queues import BoundedQueue, DROP_OLDEST
+from config import Config
+
+
+class EventBus:
+    """Phát sự kiện realtime (track, vào/ra, thống kê) tới các client SSE.
+
+    Each subscriber owns a small bounded queue (oldest events dropped when
+    a slow client falls behind), so ``publish`` never blocks the frame
+    loop or a database commit. ``stream`` turns a subscription into the
+    Server-Sent Events wire format, with a comment line every
+    ``SSE_HEARTBEAT`` seconds so dead connections are noticed.
+    """
+
+    def __init__(self, queue_size=None, heartbeat=None):
+        self.queue_size = queue_size or Config.SSE_CLIENT_QUEUE_SIZE
+        self.heartbeat = heartbeat or Config.SSE_HEARTBEAT
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published = 0
+
+    def subscribe(self):
+        queue = BoundedQueue(self.queue_size, DROP_OLDEST, 'sse')
+        with self._lock:
+            self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        queue.close()
+        with self._lock:
+            self._subscribers.discard(queue)
+
+    def publish(self, event_type, data):
+        """Gửi sự kiện tới mọi subscriber; không làm gì khi chưa có ai nghe"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        event = (next(self._ids), event_type, json.dumps(data, default=str))
+        for queue in subscribers:
+            queue.put(event)
+        self.published += 1
+
+    def stream(self, queue):
+        """Generator SSE cho một subscriber (dùng làm body của Response)"""
+        try:
+            # Tell EventSource how long to wait before reconnecting
+            yield f'retry: {int(Config.SSE_RETRY_MS)}\n\n'
+            last_sent = time.monotonic()
+            while not queue.closed:
+                event = queue.get(timeout=self.heartbeat)
+                if event is None:
+                    if time.monotonic() - last_sent >= self.heartbeat:
+                        yield ': keep-alive\n\n'
+                        last_sent = time.monotonic()
+                    continue
+                event_id, event_type, payload = event
+                yield f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'
+                last_sent = time.monotonic()
+        finally:
+            self.unsubscribe(queue)
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return {
+            'subscribers': len(subscribers),
+            'published': self.published,
+            'dropped': sum(queue.dropped for queue in subscribers)
+        }
+
+
+event_bus = EventBus()
@@ -0,0 +1,125 @@
+import numpy as np
+from collections import Counter
+
+
+class FaceGalleryIndex:
+    """Chỉ mục gallery khuôn mặt trong bộ nhớ cho việc so khớp vector hoá.
+
+    All gallery vectors live in one contiguous float32 matrix of shape (n, d)
+    with parallel name/id arrays, so a whole batch of probe embeddings is
+    matched with a single matrix product. Instances are never mutated after
+    construction: callers build a new index and swap the reference, which
+    keeps readers on other threads consistent.
+    """
+
+    def __init__(self, vectors=None, names=None, ids=None):
+        names = list(names or [])
+        ids = list(ids) if ids is not None else [None] * len(names)
+        if vectors is None or len(names) == 0:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+            self.dim = None
+        else:
+            self.matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).reshape(len(names), -1))
+            self.dim = int(self.matrix.shape[1])
+        self.names = np.array(names, dtype=object)
+        self.ids = np.array(ids, dtype=object)
+        # Squared norms cached so distances need only the probe-gallery dot product
+        self._sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+
+    @classmethod
+    def from_centroids(cls, centroids, name_to_id=None, dim=None):
+        """Build an index from a {name: vector} mapping.
+
+        Vectors whose dimension differs from ``dim`` (or from the most common
+        dimension when ``dim`` is None) are skipped, since they can never be
+        compared against probes from the active encoder.
+        """
+        name_to_id = name_to_id or {}
+        items = [(name, np.asarray(vec, dtype=np.float32).ravel()) for name, vec in centroids.items()]
+        if not items:
+            return cls()
+        if dim is None:
+            dim = Counter(vec.shape[0] for _, vec in items).most_common(1)[0][0]
+
+        names, ids, vectors = [], [], []
+        for name, vec in items:
+            if vec.shape[0] != dim:
+                print(f"Skipping gallery entry {name}: dimension {vec.shape[0]} != expected {dim}")
+                continue
+            names.append(name)
+            ids.append(name_to_id.get(name))
+            vectors.append(vec)
+
+        if not vectors:
+            return cls()
+        return cls(np.stack(vectors), names, ids)
+
+    def with_entry(self, name, vector, person_id=None):
+        """Index mới với vector của ``name`` được thay (hoặc thêm) - các dòng khác giữ nguyên"""
+        return self.with_changes({name: (vector, person_id)})
+
+    def with_changes(self, updates=None, removed=()):
+        """Index mới sau khi thay/thêm các dòng trong ``updates`` ({name: (vector, person_id)}) và bỏ ``removed``.
+
+        Only the rows are copied, nothing is re-encoded. Vectors whose
+        dimension does not match the index are skipped. Returns ``self``
+        when nothing changes.
+        """
+        updates = updates or {}
+        drop = set(updates) | set(removed)
+        if not drop:
+            return self
+        if len(self) == 0:
+            centroids = {name: vector for name, (vector, _) in updates.items()}
+            return FaceGalleryIndex.from_centroids(centroids, {name: pid for name, (_, pid) in updates.items()})
+
+        names, ids, vectors = [], [], []
+        for name, (vector, person_id) in updates.items():
+            vector = np.asarray(vector, dtype=np.float32).ravel()
+            if vector.shape[0] != self.dim:
+                print(f"Skipping gallery entry {name}: dimension {vector.shape[0]} != expected {self.dim}")
+                continue
+            names.append(name)
+            ids.append(person_id)
+            vectors.append(vector)
+
+        keep = ~np.isin(self.names, list(drop))
+        if keep.all() and not vectors:
+            return self
+        matrix = np.vstack([self.matrix[keep]] + [v[None, :] for v in vectors])
+        return FaceGalleryIndex(matrix, list(self.names[keep]) + names, list(self.ids[keep]) + ids)
+
+    def __len__(self):
+        return int(self.matrix.shape[0])
+
+    def search(self, probes, k=1):
+        """Tìm top-k khuôn mặt gần nhất cho một batch probe embeddings.
+
+        Returns ``(names, ids, distances)``, each of shape (n_probes, k') with
+        k' = min(k, len(index)), sorted by ascending Euclidean distance. When
+        the index is empty or the probe dimension does not match, k' is 0.
+        """
+        probes = np.asarray(probes, dtype=np.float32)
+        if probes.ndim == 1:
+            probes = probes[None, :]
+        n_probes = probes.shape[0]
+        k = min(int(k), len(self))
+
+        if k <= 0 or n_probes == 0 or probes.shape[1] != self.dim:
+            empty = np.empty((n_probes, 0), dtype=object)
+            return empty, empty.copy(), np.empty((n_probes, 0), dtype=np.float32)
+
+        probe_sq = np.einsum('ij,ij->i', probes, probes)
+        d2 = probe_sq[:, None] + self._sq_norms[None, :] - 2.0 * (probes @ self.matrix.T)
+        np.maximum(d2, 0.0, out=d2)
+
+        if k < len(self):
+            top = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(len(self)), (n_probes, len(self)))
+        top_d2 = np.take_along_axis(d2, top, axis=1)
+        order = np.argsort(top_d2, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        distances = np.sqrt(np.take_along_axis(top_d2, order, axis=1))
+
+        return self.names[top], self.ids[top], distances
@@ -2,10 +2,24 @@ import cv2
 import numpy as np
 import os
 import json
-from datetime import datetime
-from app.models.database import Person, Log, Device, db
+import time
+import threading
+from datetime import datetime, timedelta
+from app.models.database import Person, db
+from app.services.face_gallery import FaceGalleryIndex
+from app.utils.timing import stage_timer
+from app.services.monitoring import FACE_RECOGNITIONS
+from app.services.log_writer import log_writer
 from config import Config
 
+def _box_overlap(a, b):
+    """IoU giữa hai box (x, y, w, h)"""
+    ix = max(0, min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
 class FaceRecognitionService:
     """Service xử lý nhận diện khuôn mặt sử dụng OpenCV"""
     
@@ -15,224 +29,445 @@ class FaceRecognitionService:
         self.known_face_ids = []
         # Centroid (mean) encoding per person name for more stable matching
         self.centroids = {}
-        # Embedding model (facenet-pytorch) lazy-loaded
+        # Vectorized index over the centroids, rebuilt whenever they change
+        self.gallery = FaceGalleryIndex()
+        # Incremental refresh state: database entries by person_id, known_faces files by name
+        self._db_faces = {}
+        self._file_faces = {}
+        self._faces_watermark = None
+        self._faces_lock = threading.RLock()
+        # Embedding model (facenet-pytorch), loaded once by load_embedding_backend
         self._embedding_model = None
-        # choose device if torch available
-        try:
-            import torch
-            self._embedding_device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        except Exception:
-            self._embedding_device = 'cpu'
+        self._embedding_device = 'cpu'
+        self._torch = None
         # optional MTCNN detector
         self._mtcnn = None
         # expected encoding dimension (set after model/hist chosen)
         self.encoding_dim = None
         self._embedding_enabled = False
+        # Record of the chosen backend and its startup / first-frame latency
+        self.backend_info = {}
         
         # Load OpenCV face cascade
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
         
+        self.load_embedding_backend()
         self.load_known_faces()
+
+    def load_embedding_backend(self):
+        """Chọn và nạp backend embedding một lần khi khởi động service.
+
+        Config.EMBEDDING_BACKEND selects 'facenet', 'histogram' or 'auto'
+        (facenet when facenet-pytorch is importable, histogram otherwise).
+        The chosen backend is warmed up with a dummy batch so the first real
+        frame does not pay for lazy initialisation.
+        """
+        requested = (Config.EMBEDDING_BACKEND or 'auto').lower()
+        info = {
+            'requested': requested,
+            'backend': 'histogram',
+            'device': 'cpu',
+            'mtcnn': False,
+            'encoding_dim': None,
+            'load_seconds': 0.0,
+            'warmup_seconds': 0.0,
+            'first_frame_seconds': None,
+            'error': None
+        }
+
+        self._embedding_model = None
+        self._mtcnn = None
+        self._embedding_enabled = False
+
+        start = time.perf_counter()
+        if requested in ('auto', 'facenet'):
+            try:
+                from facenet_pytorch import InceptionResnetV1, MTCNN
+                import torch
+                self._torch = torch
+                self._embedding_device = 'cuda' if torch.cuda.is_available() else 'cpu'
+                model = InceptionResnetV1(pretrained='vggface2').eval()
+                model.to(self._embedding_device)
+                self._embedding_model = model
+                self._embedding_enabled = True
+                try:
+                    # create single-face detector; keep_all=False
+                    self._mtcnn = MTCNN(keep_all=False, device=self._embedding_device)
+                except Exception as e:
+                    print(f"MTCNN unavailable, using cascade crops only: {e}")
+                    self._mtcnn = None
+                info['backend'] = 'facenet'
+                info['device'] = self._embedding_device
+                info['mtcnn'] = self._mtcnn is not None
+            except Exception as e:
+                info['error'] = str(e)
+                if requested == 'facenet':
+                    print(f"Facenet backend requested but unavailable, falling back to histogram: {e}")
+        info['load_seconds'] = time.perf_counter() - start
+
+        # Warm up with a dummy batch (first forward pass allocates buffers / kernels)
+        start = time.perf_counter()
+        dummy = np.zeros((160, 160), dtype=np.uint8)
+        warmup = self.encode_faces([dummy] * max(1, Config.EMBEDDING_WARMUP_BATCH))
+        info['warmup_seconds'] = time.perf_counter() - start
+        if warmup:
+            info['encoding_dim'] = int(np.asarray(warmup[0]).shape[0])
+            self.encoding_dim = info['encoding_dim']
+
+        self.backend_info = info
+        print(f"Embedding backend: {info['backend']} on {info['device']} "
+              f"(dim={info['encoding_dim']}, load {info['load_seconds']:.2f}s, warm-up {info['warmup_seconds']:.2f}s)")
+        return info
     
     def load_known_faces(self):
-        """Load các khuôn mặt đã biết từ database và thư mục known_faces"""
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_face_ids = []
-        
-        # Load từ database (chỉ khi có application context)
+        """Load lại toàn bộ khuôn mặt đã biết từ database và thư mục known_faces"""
+        with self._faces_lock:
+            self._db_faces = {}
+            self._file_faces = {}
+            self._faces_watermark = None
+            self._refresh_known_faces(full=True)
+        print(f"Loaded {len(self.known_face_encodings)} known faces")
+
+    def refresh_known_faces(self):
+        """Cập nhật gallery theo các thay đổi kể từ lần load trước (không load lại toàn bộ).
+
+        Only persons whose ``updated_at`` is newer than the last watermark
+        are re-read from the database, and only image files whose mtime or
+        size changed are decoded and encoded again. Deleted persons, persons
+        whose encoding was cleared and removed files are dropped. The
+        centroids of the affected names are recomputed and a new gallery
+        index is published with a single reference swap. Returns a summary
+        of what changed.
+        """
+        with self._faces_lock:
+            summary = self._refresh_known_faces(full=False)
+        print(f"Refreshed known faces: {summary}")
+        return summary
+
+    def _app_context(self):
+        app_ctx = getattr(self, 'app', None)
+        if app_ctx:
+            return app_ctx.app_context()
+        from flask import current_app
+        return current_app.app_context()
+
+    def _refresh_known_faces(self, full):
+        started = time.perf_counter()
+        affected = set()
+        summary = {'db_changed': 0, 'db_removed': 0, 'files_changed': 0, 'files_removed': 0}
+
+        # Database: rows changed since the watermark, plus deletions
         try:
-            from flask import current_app
-            with current_app.app_context():
-                persons = Person.query.filter(Person.face_encoding.isnot(None)).all()
-                for person in persons:
-                    try:
-                        encoding = json.loads(person.face_encoding)
-                        arr = np.array(encoding)
-                        # normalize loaded encoding to unit length for consistent distance metrics
-                        try:
-                            arr = arr / (np.linalg.norm(arr) + 1e-7)
-                        except Exception:
-                            pass
-                        # If we already determined encoding_dim, ensure shapes match
-                        if self.encoding_dim is not None and arr.shape != (self.encoding_dim,):
-                            print(f"Skipping DB encoding for {person.name}: dimension {arr.shape} != expected {self.encoding_dim}")
-                            continue
-                        self.known_face_encodings.append(arr)
-                        self.known_face_names.append(person.name)
-                        self.known_face_ids.append(person.person_id)
-                    except (json.JSONDecodeError, ValueError) as e:
-                        print(f"Error loading face encoding for {person.name}: {e}")
+            with self._app_context():
+                affected |= self._refresh_db_faces(summary)
         except RuntimeError:
             # Không có application context, bỏ qua database
             print("No application context, skipping database load")
-        
-        # Load từ thư mục known_faces
+
+        # Thư mục known_faces: chỉ các file có mtime / size thay đổi
+        affected |= self._refresh_file_faces(summary)
+
+        # Rebuild the flat lists: database entries first, files only for names not in the database
+        encodings, names, ids = [], [], []
+        for person_id, (name, enc) in sorted(self._db_faces.items()):
+            encodings.append(enc)
+            names.append(name)
+            ids.append(person_id)
+        seen = set(names)
+        for filename, entry in sorted(self._file_faces.items()):
+            if entry['encoding'] is None or entry['name'] in seen:
+                continue
+            seen.add(entry['name'])
+            encodings.append(entry['encoding'])
+            names.append(entry['name'])
+            ids.append(entry['person_id'])
+        self.known_face_encodings = encodings
+        self.known_face_names = names
+        self.known_face_ids = ids
+
+        if full:
+            try:
+                self._rebuild_centroids()
+            except Exception:
+                pass
+        elif affected:
+            self._update_centroids(affected)
+
+        summary['names_changed'] = len(affected)
+        summary['gallery_size'] = len(self.gallery)
+        summary['seconds'] = round(time.perf_counter() - started, 4)
+        return summary
+
+    def _refresh_db_faces(self, summary):
+        """Đọc các Person thay đổi từ sau watermark; trả về tập tên bị ảnh hưởng"""
+        affected = set()
+        query = db.session.query(Person.person_id, Person.name, Person.face_encoding, Person.updated_at)
+        if self._faces_watermark is not None:
+            query = query.filter(Person.updated_at >= self._faces_watermark)
+        else:
+            query = query.filter(Person.face_encoding.isnot(None))
+        read_at = datetime.now()
+        watermark = self._faces_watermark
+
+        for person_id, name, face_encoding, updated_at in query.all():
+            if updated_at is not None and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+            old = self._db_faces.get(person_id)
+            enc = None
+            if face_encoding is not None:
+                try:
+                    # normalize loaded encoding to unit length for consistent distance metrics
+                    enc = np.array(json.loads(face_encoding))
+                    enc = enc / (np.linalg.norm(enc) + 1e-7)
+                    if self.encoding_dim is not None and enc.shape != (self.encoding_dim,):
+                        print(f"Skipping DB encoding for {name}: dimension {enc.shape} != expected {self.encoding_dim}")
+                        enc = None
+                except (json.JSONDecodeError, ValueError) as e:
+                    print(f"Error loading face encoding for {name}: {e}")
+                    enc = None
+
+            if enc is None:
+                if old is not None:
+                    del self._db_faces[person_id]
+                    affected.add(old[0])
+                    summary['db_removed'] += 1
+                continue
+            if old is not None and old[0] == name and old[1].shape == enc.shape and np.allclose(old[1], enc):
+                continue
+            self._db_faces[person_id] = (name, enc)
+            affected.add(name)
+            if old is not None:
+                affected.add(old[0])
+            summary['db_changed'] += 1
+
+        # Deleted persons: only their ids are compared, nothing is parsed
+        if self._faces_watermark is not None and self._db_faces:
+            existing = {row[0] for row in db.session.query(Person.person_id).filter(Person.face_encoding.isnot(None))}
+            for person_id in set(self._db_faces) - existing:
+                affected.add(self._db_faces.pop(person_id)[0])
+                summary['db_removed'] += 1
+
+        # Transactions still open during this read may commit rows stamped a little
+        # earlier than the newest row seen: keep the watermark within the overlap
+        if watermark is not None:
+            watermark = min(watermark, read_at - timedelta(seconds=Config.FACE_REFRESH_OVERLAP))
+        self._faces_watermark = watermark
+        db.session.rollback()
+        return affected
+
+    def _refresh_file_faces(self, summary):
+        """Encode lại các file known_faces mới hoặc đã thay đổi; trả về tập tên bị ảnh hưởng"""
+        affected = set()
+        files = {}
         if os.path.exists(Config.KNOWN_FACES_DIR):
             for filename in os.listdir(Config.KNOWN_FACES_DIR):
                 if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    image_path = os.path.join(Config.KNOWN_FACES_DIR, filename)
                     try:
-                        name = os.path.splitext(filename)[0]
-                        # Skip if this name was already loaded from DB
-                        if name in self.known_face_names:
-                            continue
-
-                        # Robust image load to support Unicode paths on Windows
-                        image = None
-                        try:
-                            with open(image_path, 'rb') as f:
-                                file_bytes = f.read()
-                            import numpy as _np
-                            nparr = _np.frombuffer(file_bytes, dtype=_np.uint8)
-                            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                        except Exception:
-                            try:
-                                image = cv2.imread(image_path)
-                            except Exception:
-                                image = None
-
-                        if image is None:
-                            continue
-
-                        # Detect face and create encoding
-                        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
-                        if len(faces) == 0:
-                            continue
-                        x, y, w, h = faces[0]
-                        face_roi = gray[y:y+h, x:x+w]
-                        encoding = self._create_face_encoding(face_roi)
-                        # normalize encoding
-                        try:
-                            encoding = np.array(encoding)
-                            encoding = encoding / (np.linalg.norm(encoding) + 1e-7)
-                        except Exception:
-                            encoding = np.array(encoding)
-
-                        # Set encoding_dim if not yet set
-                        if self.encoding_dim is None:
-                            try:
-                                self.encoding_dim = int(np.array(encoding).shape[0])
-                            except Exception:
-                                pass
-
-                        # Associate with DB person (create if missing)
-                        person_id = None
-                        try:
-                            app_ctx = getattr(self, 'app', None)
-                            if app_ctx:
-                                with app_ctx.app_context():
-                                    person = Person.query.filter_by(name=name).first()
-                                    if person:
-                                        person_id = person.person_id
-                                    else:
-                                        person = Person(name=name, role='user', face_encoding=json.dumps(encoding.tolist()))
-                                        db.session.add(person)
-                                        db.session.commit()
-                                        person_id = person.person_id
-                            else:
-                                from flask import current_app
-                                with current_app.app_context():
-                                    person = Person.query.filter_by(name=name).first()
-                                    if person:
-                                        person_id = person.person_id
-                                    else:
-                                        person = Person(name=name, role='user', face_encoding=json.dumps(encoding.tolist()))
-                                        db.session.add(person)
-                                        db.session.commit()
-                                        person_id = person.person_id
-                        except RuntimeError:
-                            person_id = None
-                        except Exception as e:
-                            print(f"Error associating known face '{name}' with DB: {e}")
-
-                        # Ensure encoding shape matches expected dim (if set)
-                        if self.encoding_dim is not None and np.array(encoding).shape[0] != self.encoding_dim:
-                            print(f"Skipping file {filename}: encoding dim {np.array(encoding).shape} != expected {self.encoding_dim}")
-                            continue
-                        self.known_face_encodings.append(np.array(encoding))
-                        self.known_face_names.append(name)
-                        self.known_face_ids.append(person_id)
-                    except Exception as e:
-                        print(f"Error loading face from {filename}: {e}")
-        
-        # Rebuild centroids for stable matching now that we loaded faces
+                        st = os.stat(os.path.join(Config.KNOWN_FACES_DIR, filename))
+                        files[filename] = (st.st_mtime_ns, st.st_size)
+                    except OSError:
+                        continue
+
+        for filename in set(self._file_faces) - set(files):
+            entry = self._file_faces.pop(filename)
+            if entry['encoding'] is not None:
+                affected.add(entry['name'])
+            summary['files_removed'] += 1
+
+        db_names = {name for name, _ in self._db_faces.values()}
+        for filename in sorted(files):
+            name = os.path.splitext(filename)[0]
+            entry = self._file_faces.get(filename)
+            if entry is not None and entry['stat'] == files[filename]:
+                if entry['encoded'] or name in db_names:
+                    # Unchanged; a file is only encoded once its name is not in the database
+                    if entry['encoding'] is not None and entry['person_id'] is None and name not in db_names:
+                        entry['person_id'] = self._known_face_person_id(name, entry['encoding'])
+                    continue
+            elif entry is not None and entry['encoding'] is not None:
+                affected.add(name)
+
+            entry = {'stat': files[filename], 'name': name, 'encoded': False, 'encoding': None, 'person_id': None}
+            self._file_faces[filename] = entry
+            summary['files_changed'] += 1
+            # Skip if this name was already loaded from DB
+            if name in db_names:
+                continue
+            entry['encoded'] = True
+            try:
+                encoding = self._encode_known_face_file(os.path.join(Config.KNOWN_FACES_DIR, filename))
+                if encoding is None:
+                    continue
+                # Ensure encoding shape matches expected dim (if set)
+                if self.encoding_dim is not None and encoding.shape[0] != self.encoding_dim:
+                    print(f"Skipping file {filename}: encoding dim {encoding.shape} != expected {self.encoding_dim}")
+                    continue
+                entry['encoding'] = encoding
+                entry['person_id'] = self._known_face_person_id(name, encoding)
+                affected.add(name)
+            except Exception as e:
+                print(f"Error loading face from {filename}: {e}")
+        return affected
+
+    def _encode_known_face_file(self, image_path):
+        """Encoding (đã chuẩn hoá) của khuôn mặt đầu tiên trong ảnh known_faces, None nếu không có"""
+        # Robust image load to support Unicode paths on Windows
+        image = None
         try:
-            self._rebuild_centroids()
+            with open(image_path, 'rb') as f:
+                file_bytes = f.read()
+            nparr = np.frombuffer(file_bytes, dtype=np.uint8)
+            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        except Exception:
+            try:
+                image = cv2.imread(image_path)
+            except Exception:
+                image = None
+
+        if image is None:
+            return None
+
+        # Detect face and create encoding
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+        if len(faces) == 0:
+            return None
+        x, y, w, h = faces[0]
+        face_roi = gray[y:y+h, x:x+w]
+        encoding = np.array(self._create_face_encoding(face_roi))
+        # normalize encoding
+        try:
+            encoding = encoding / (np.linalg.norm(encoding) + 1e-7)
         except Exception:
             pass
 
-        print(f"Loaded {len(self.known_face_encodings)} known faces")
-    
+        # Set encoding_dim if not yet set
+        if self.encoding_dim is None:
+            try:
+                self.encoding_dim = int(encoding.shape[0])
+            except Exception:
+                pass
+        return encoding
+
+    def _known_face_person_id(self, name, encoding):
+        """person_id của file known_faces (tạo Person nếu chưa có); None nếu không có app context"""
+        try:
+            with self._app_context():
+                person = Person.query.filter_by(name=name).first()
+                if not person:
+                    person = Person(name=name, role='user', face_encoding=json.dumps(encoding.tolist()))
+                    db.session.add(person)
+                    db.session.commit()
+                return person.person_id
+        except RuntimeError:
+            return None
+        except Exception as e:
+            print(f"Error associating known face '{name}' with DB: {e}")
+            return None
+
     def recognize_faces_in_frame(self, frame):
         """Nhận diện khuôn mặt trong frame sử dụng OpenCV"""
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Detect faces
-        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
-        
+        gray, faces = self.detect_faces(frame)
+        return self.recognize_face_rois(gray, faces)
+
+    def detect_faces(self, frame, detect_frame=None):
+        """Phát hiện khuôn mặt (Haar cascade), trả về (gray, [(x, y, w, h), ...])
+
+        When ``detect_frame`` (a downscaled copy of ``frame``) is given, the
+        cascade runs on it and boxes are rescaled to ``frame`` coordinates;
+        the returned gray image is always full resolution for cropping.
+        """
+        with stage_timer.measure('face_detect'):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            detect_gray, scale = self._detection_gray(gray, detect_frame)
+            faces = self.face_cascade.detectMultiScale(detect_gray, 1.1, 4)
+            return gray, [self._scale_box(face, scale, gray.shape) for face in faces]
+
+    def detect_faces_in_regions(self, frame, regions, top_fraction=0.5, detect_frame=None):
+        """Phát hiện khuôn mặt chỉ trong phần trên của từng vùng người (track bbox).
+
+        ``regions`` is a list of (key, (left, top, right, bottom)) in frame
+        coordinates. Returns (gray, [(key, (x, y, w, h)), ...]) with face boxes
+        mapped back to frame space, so each face is tied directly to the region
+        it was found in. Faces found twice in overlapping regions are kept once.
+        With ``detect_frame``, regions are scanned on the downscaled copy.
+        """
+        with stage_timer.measure('face_detect'):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            detect_gray, scale = self._detection_gray(gray, detect_frame)
+            det_h, det_w = detect_gray.shape[:2]
+            detected = []
+            for key, (left, top, right, bottom) in regions:
+                x1 = max(int(left / scale), 0)
+                y1 = max(int(top / scale), 0)
+                x2 = min(int(right / scale), det_w)
+                y2 = min(int((top + (bottom - top) * top_fraction) / scale), det_h)
+                if x2 - x1 < 20 or y2 - y1 < 20:
+                    continue
+                faces = self.face_cascade.detectMultiScale(detect_gray[y1:y2, x1:x2], 1.1, 4)
+                for (x, y, w, h) in faces:
+                    box = self._scale_box((x + x1, y + y1, w, h), scale, gray.shape)
+                    if any(_box_overlap(box, other) > 0.5 for _, other in detected):
+                        continue
+                    detected.append((key, box))
+            return gray, detected
+
+    def _detection_gray(self, gray, detect_frame):
+        """Gray image the cascade runs on, and its scale back to ``gray``"""
+        if detect_frame is None or detect_frame.shape[1] == gray.shape[1]:
+            return gray, 1.0
+        detect_gray = detect_frame if detect_frame.ndim == 2 else cv2.cvtColor(detect_frame, cv2.COLOR_BGR2GRAY)
+        return detect_gray, gray.shape[1] / float(detect_gray.shape[1])
+
+    def _scale_box(self, box, scale, shape):
+        """Rescale an (x, y, w, h) box to full resolution, clipped to the image"""
+        x, y, w, h = (int(round(v * scale)) for v in box)
+        x = min(max(x, 0), shape[1] - 1)
+        y = min(max(y, 0), shape[0] - 1)
+        return (x, y, min(w, shape[1] - x), min(h, shape[0] - y))
+
+    def recognize_face_rois(self, gray, faces):
+        """Tạo encoding và so khớp gallery cho các khuôn mặt đã phát hiện trong frame"""
         results = []
-        
-        for (x, y, w, h) in faces:
-            # Extract face ROI
-            face_roi = gray[y:y+h, x:x+w]
-            
-            # Create face encoding
-            face_encoding = self._create_face_encoding(face_roi)
-            
-            # Compare with centroids if available, otherwise fall back to known encodings
+        if len(faces) == 0:
+            return results
+
+        first_frame = self.backend_info.get('first_frame_seconds') is None
+        start = time.perf_counter()
+
+        # Encode every face of the frame in a single batch
+        with stage_timer.measure('embed'):
+            face_encodings = self.encode_faces([gray[y:y+h, x:x+w] for (x, y, w, h) in faces])
+
+        # Match every face against the gallery in one matrix product
+        gallery = self.gallery
+        with stage_timer.measure('match'):
+            names, ids, distances = gallery.search(face_encodings, k=1)
+
+        for i, (x, y, w, h) in enumerate(faces):
             name = Config.UNKNOWN_PERSON_LABEL
             person_id = None
             confidence = 0.0
 
-            if len(self.centroids) > 0:
-                # compute distances to centroids
-                centroid_items = list(self.centroids.items())
-                centroid_names = [c[0] for c in centroid_items]
-                centroid_vecs = [c[1] for c in centroid_items]
-                distances = []
-                for v in centroid_vecs:
-                    try:
-                        a, b = self._align_vectors(face_encoding, v)
-                        distances.append(np.linalg.norm(a - b))
-                    except Exception as e:
-                        print(f"Error computing distance to centroid: {e}")
-                        distances.append(float('inf'))
-                min_distance = min(distances)
-                if min_distance < Config.FACE_RECOGNITION_TOLERANCE:
-                    best_index = distances.index(min_distance)
-                    name = centroid_names[best_index]
-                    # Resolve person_id by finding first known_face_ids matching name
-                    try:
-                        pid_index = self.known_face_names.index(name)
-                        person_id = self.known_face_ids[pid_index]
-                    except ValueError:
-                        person_id = None
-                    confidence = 1 - (min_distance / Config.FACE_RECOGNITION_TOLERANCE)
-            elif len(self.known_face_encodings) > 0:
-                distances = []
-                for k in self.known_face_encodings:
-                    try:
-                        a, b = self._align_vectors(face_encoding, k)
-                        distances.append(np.linalg.norm(a - b))
-                    except Exception as e:
-                        print(f"Error computing distance to known encoding: {e}")
-                        distances.append(float('inf'))
-                min_distance = min(distances)
+            if distances.shape[1] > 0:
+                min_distance = float(distances[i, 0])
                 if min_distance < Config.FACE_RECOGNITION_TOLERANCE:
-                    best_match_index = distances.index(min_distance)
-                    name = self.known_face_names[best_match_index]
-                    person_id = self.known_face_ids[best_match_index]
+                    name = names[i, 0]
+                    person_id = ids[i, 0]
                     confidence = 1 - (min_distance / Config.FACE_RECOGNITION_TOLERANCE)
-            
+            FACE_RECOGNITIONS.inc(outcome='known' if name != Config.UNKNOWN_PERSON_LABEL else 'unknown')
+
             results.append({
                 'location': (y, x+w, y+h, x),  # (top, right, bottom, left)
                 'name': name,
                 'person_id': person_id,
                 'confidence': confidence,
-                'face_encoding': face_encoding.tolist()
+                'face_encoding': face_encodings[i].tolist()
             })
+
+        if first_frame:
+            self.backend_info['first_frame_seconds'] = time.perf_counter() - start
+            print(f"First frame recognized in {self.backend_info['first_frame_seconds']:.3f}s")
         
         return results
     
@@ -268,6 +503,30 @@ class FaceRecognitionService:
         except Exception:
             pass
     
+    def update_person_faces(self, name, face_encoding, person_id=None):
+        """Thay khuôn mặt của một người trong gallery mà không load lại toàn bộ known_faces.
+
+        The person's previous entries are replaced by ``face_encoding`` (the
+        centroid stored in the database), their centroid is recomputed and
+        only that row of the gallery index is swapped. Other identities are
+        left untouched and nothing is re-encoded.
+        """
+        enc = np.array(face_encoding, dtype=float)
+        enc = enc / (np.linalg.norm(enc) + 1e-7)
+        with self._faces_lock:
+            # Keep the incremental refresh state in sync so the next refresh sees no change
+            if person_id is not None:
+                self._db_faces[person_id] = (name, enc)
+            keep = [i for i, known in enumerate(self.known_face_names) if known != name]
+            self.known_face_encodings = [self.known_face_encodings[i] for i in keep] + [enc]
+            self.known_face_names = [self.known_face_names[i] for i in keep] + [name]
+            self.known_face_ids = [self.known_face_ids[i] for i in keep] + [person_id]
+
+            centroids = dict(self.centroids)
+            centroids[name] = enc
+            self.centroids = centroids
+            self.gallery = self.gallery.with_entry(name, enc, person_id)
+    
     def save_face_to_database(self, name, face_encoding, role='user'):
         """Lưu khuôn mặt mới vào database"""
         try:
@@ -303,102 +562,89 @@ class FaceRecognitionService:
             return None
     
     def log_recognition_event(self, event_type, details):
-        """Ghi log sự kiện nhận diện"""
+        """Ghi log sự kiện nhận diện (bất đồng bộ qua log_writer)"""
         try:
-            from flask import current_app
-            with current_app.app_context():
-                device = Device.query.first()  # Sử dụng device đầu tiên
-                log = Log(
-                    device_id=device.device_id if device else None,
-                    event_type=event_type,
-                    details=json.dumps(details) if isinstance(details, dict) else str(details)
-                )
-                db.session.add(log)
-                db.session.commit()
-        except RuntimeError:
-            # Không có application context, bỏ qua logging
-            pass
+            log_writer.submit(event_type, details)
         except Exception as e:
             print(f"Error logging recognition event: {e}")
     
     def _create_face_encoding(self, face_roi):
-        """Tạo face encoding từ face ROI sử dụng histogram"""
-        # Try to use facenet-pytorch embedding if available
-        if not self._embedding_enabled:
-            try:
-                # Lazy import to avoid hard dependency
-                from facenet_pytorch import InceptionResnetV1
-                import torch
-                model = InceptionResnetV1(pretrained='vggface2').eval()
-                model.to(self._embedding_device)
-                self._embedding_model = model
-                self._embedding_enabled = True
-            except Exception:
-                self._embedding_model = None
-                self._embedding_enabled = False
+        """Tạo face encoding từ một face ROI"""
+        return self.encode_faces([face_roi])[0]
 
-        if self._embedding_enabled and self._embedding_model is not None:
-            try:
-                # prefer MTCNN-based detection/alignment if available
-                try:
-                    from facenet_pytorch import MTCNN
-                    if self._mtcnn is None:
-                        # create single-face detector; keep_all=False
-                        self._mtcnn = MTCNN(keep_all=False, device=self._embedding_device)
-                except Exception:
-                    self._mtcnn = None
+    def encode_faces(self, face_rois):
+        """Tạo face encoding cho nhiều face ROI cùng lúc.
 
-                # face_roi may be grayscale; convert to RGB
-                face_rgb = None
-                try:
-                    face_rgb = cv2.cvtColor(face_roi, cv2.COLOR_GRAY2RGB)
-                except Exception:
-                    try:
-                        face_rgb = cv2.cvtColor(face_roi, cv2.COLOR_BGR2RGB)
-                    except Exception:
-                        # as a fallback, stack
-                        face_rgb = cv2.cvtColor(face_roi, cv2.COLOR_GRAY2RGB)
-
-                # If we have mtcnn, try to detect a tighter face box inside this ROI
-                crop_img = None
-                if self._mtcnn is not None:
-                    try:
-                        # mtcnn.detect accepts RGB numpy arrays
-                        boxes, probs = self._mtcnn.detect(face_rgb)
-                        if boxes is not None and len(boxes) > 0 and probs[0] is not None and probs[0] > 0.1:
-                            x1, y1, x2, y2 = boxes[0]
-                            # Ensure integer bounds and within image
-                            h, w = face_rgb.shape[:2]
-                            x1i = max(int(x1), 0)
-                            y1i = max(int(y1), 0)
-                            x2i = min(int(x2), w - 1)
-                            y2i = min(int(y2), h - 1)
-                            if x2i > x1i and y2i > y1i:
-                                crop_img = face_rgb[y1i:y2i, x1i:x2i]
-                    except Exception:
-                        crop_img = None
-
-                if crop_img is None:
-                    # no mtcnn crop found; use original ROI
-                    crop_img = face_rgb
+        All crops are stacked into a single tensor so InceptionResnetV1 runs
+        one forward pass per frame instead of one per face. Falls back to the
+        histogram encoding when facenet-pytorch is unavailable or fails.
+        """
+        if len(face_rois) == 0:
+            return []
 
-                try:
-                    crop_resized = cv2.resize(crop_img, (160, 160))
-                except Exception:
-                    crop_resized = cv2.resize(crop_img, (64, 64))
+        if self._embedding_enabled and self._embedding_model is not None:
+            try:
+                face_rgbs = [self._to_rgb(roi) for roi in face_rois]
+                crops = self._refine_face_crops(face_rgbs)
+                batch = np.stack([cv2.resize(crop, (160, 160)) for crop in crops]).astype(np.float32)
 
-                import torch
-                img = torch.tensor(crop_resized, dtype=torch.float32).permute(2, 0, 1).unsqueeze(0)
-                img = (img - 127.5) / 128.0
+                torch = self._torch
+                imgs = torch.from_numpy(batch).permute(0, 3, 1, 2)
+                imgs = (imgs - 127.5) / 128.0
                 with torch.no_grad():
-                    emb = self._embedding_model(img.to(self._embedding_device))
-                emb = emb.squeeze(0).cpu().numpy()
-                emb = emb / (np.linalg.norm(emb) + 1e-7)
-                return emb
+                    emb = self._embedding_model(imgs.to(self._embedding_device))
+                emb = emb.cpu().numpy()
+                emb = emb / (np.linalg.norm(emb, axis=1, keepdims=True) + 1e-7)
+                return list(emb)
             except Exception as e:
                 print(f"Embedding error, falling back to histogram: {e}")
 
-        # Fallback: histogram-based encoding with CLAHE
+        return [self._histogram_encoding(roi) for roi in face_rois]
+
+    def _to_rgb(self, face_roi):
+        """Convert a grayscale or BGR face ROI to RGB"""
+        if face_roi.ndim == 2:
+            return cv2.cvtColor(face_roi, cv2.COLOR_GRAY2RGB)
+        return cv2.cvtColor(face_roi, cv2.COLOR_BGR2RGB)
+
+    def _refine_face_crops(self, face_rgbs, detect_size=160):
+        """Tighten each ROI to the MTCNN face box, detecting on the whole batch at once.
+
+        MTCNN needs equally sized images for batched detection, so every ROI is
+        resized to ``detect_size`` and the boxes are scaled back to ROI space.
+        ROIs without a confident detection are returned unchanged.
+        """
+        if self._mtcnn is None:
+            return face_rgbs
+
+        try:
+            resized = [cv2.resize(rgb, (detect_size, detect_size)) for rgb in face_rgbs]
+            batch_boxes, batch_probs = self._mtcnn.detect(resized)
+        except Exception:
+            return face_rgbs
+
+        crops = []
+        for rgb, boxes, probs in zip(face_rgbs, batch_boxes, batch_probs):
+            crop_img = rgb
+            if boxes is not None and len(boxes) > 0 and probs[0] is not None and probs[0] > 0.1:
+                h, w = rgb.shape[:2]
+                sx = w / float(detect_size)
+                sy = h / float(detect_size)
+                x1, y1, x2, y2 = boxes[0]
+                # Ensure integer bounds and within image
+                x1i = max(int(x1 * sx), 0)
+                y1i = max(int(y1 * sy), 0)
+                x2i = min(int(x2 * sx), w - 1)
+                y2i = min(int(y2 * sy), h - 1)
+                if x2i > x1i and y2i > y1i:
+                    crop_img = rgb[y1i:y2i, x1i:x2i]
+            crops.append(crop_img)
+        return crops
+
+    def _histogram_encoding(self, face_roi):
+        """Fallback: histogram-based encoding with CLAHE"""
+        if face_roi.ndim == 3:
+            face_roi = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
         try:
             proc = cv2.resize(face_roi, (160, 160))
         except Exception:
@@ -415,23 +661,47 @@ class FaceRecognitionService:
         return hist
 
     def _rebuild_centroids(self):
-        """Recompute mean encoding per person name (centroid)"""
+        """Recompute mean encoding per person name (centroid) and rebuild the gallery index"""
+        centroids, name_to_id = self._compute_centroids()
+        self.centroids = centroids
+        self.gallery = FaceGalleryIndex.from_centroids(centroids, name_to_id, dim=self.encoding_dim)
+
+    def _update_centroids(self, names):
+        """Tính lại centroid chỉ cho các tên trong ``names`` rồi publish gallery mới (một lần swap)"""
+        changed, name_to_id = self._compute_centroids(names)
+        centroids = dict(self.centroids)
+        for name in names:
+            if name in changed:
+                centroids[name] = changed[name]
+            else:
+                centroids.pop(name, None)
+        updates = {name: (vec, name_to_id[name]) for name, vec in changed.items()}
+        self.centroids = centroids
+        self.gallery = self.gallery.with_changes(updates, [name for name in names if name not in changed])
+
+    def _compute_centroids(self, names=None):
+        """({name: centroid đã chuẩn hoá}, {name: person_id}) cho tất cả tên hoặc chỉ ``names``"""
         centroids = {}
         counts = {}
-        for enc, name in zip(self.known_face_encodings, self.known_face_names):
+        name_to_id = {}
+        for enc, name, person_id in zip(self.known_face_encodings, self.known_face_names, self.known_face_ids):
+            if names is not None and name not in names:
+                continue
+            enc = np.array(enc, dtype=float)
             if name not in centroids:
-                centroids[name] = np.array(enc, dtype=float)
+                centroids[name] = enc.copy()
                 counts[name] = 1
-            else:
-                centroids[name] += np.array(enc, dtype=float)
+                # person_id resolves to the first known entry with this name
+                name_to_id[name] = person_id
+            elif centroids[name].shape == enc.shape:
+                centroids[name] += enc
                 counts[name] += 1
 
         for name in centroids:
             centroids[name] = centroids[name] / counts[name]
             # normalize centroid
             centroids[name] = centroids[name] / (np.linalg.norm(centroids[name]) + 1e-7)
-
-        self.centroids = centroids
+        return centroids, name_to_id
 
     def _align_vectors(self, a, b):
         """Align two 1-D numpy vectors to same length by truncating or padding with zeros.
@@ -521,7 +791,7 @@ class FaceRecognitionService:
                 x, y, w, h = faces[0]
                 face_roi = gray[y:y+h, x:x+w]
                 print(f"Face detected in {image_path}: size {w}x{h}")
-                return self._create_face_encoding(face_roi)
+                return self.encode_faces([face_roi])[0]
             else:
                 print(f"No face detected in {image_path} after trying multiple methods")
                 return None
@@ -0,0 +1,81 @@
+from datetime import datetime
+from app.utils.image import resize_to_width
+from app.services.motion_gate import MotionGate
+from config import Config
+
+
+class FrameContext:
+    """Kết quả phân tích của một frame, dùng chung cho vẽ, chấm công và tracking"""
+
+    def __init__(self, frame, frame_index):
+        self.frame = frame
+        self.frame_index = frame_index
+        self.timestamp = datetime.now()
+        # Downscaled copy used for person / face detection and its scale back to frame
+        self.detect_frame = frame
+        self.detect_scale = 1.0
+        # YOLO person detections: [([x, y, w, h], conf, 'person'), ...]
+        self.detections = []
+        # Face results as returned by FaceRecognitionService.recognize_faces_in_frame
+        self.face_results = []
+        # Confirmed tracks as returned by TrackingService.process_frame
+        self.tracking_results = []
+        # True when the motion gate skipped detection, recognition and tracking
+        self.idle = False
+
+    @property
+    def active_track_ids(self):
+        return [result['track_id'] for result in self.tracking_results]
+
+
+class FrameAnalyzer:
+    """Chạy detect người, nhận diện khuôn mặt và tracking đúng một lần cho mỗi frame.
+
+    The resulting FrameContext is shared by drawing, attendance and the
+    tracker, so no consumer has to run face recognition on the frame again.
+    """
+
+    def __init__(self, face_service, tracking_service, motion_gate=None):
+        self.face_service = face_service
+        self.tracking_service = tracking_service
+        self.motion_gate = motion_gate or MotionGate()
+        self.frame_count = 0
+
+    def analyze(self, frame):
+        """Phân tích một frame và trả về FrameContext"""
+        self.frame_count += 1
+        ctx = FrameContext(frame, self.frame_count)
+
+        # Empty, still scene: skip every heavy stage until something moves
+        has_tracks = self.tracking_service is not None and self.tracking_service.has_live_tracks()
+        if not self.motion_gate.check(frame, has_tracks):
+            ctx.idle = True
+            if self.tracking_service is not None:
+                # Tracks of people who left still expire while the scene is still
+                self.tracking_service.expire_tracks()
+            return ctx
+
+        if self.tracking_service is None:
+            if self.face_service is not None:
+                try:
+                    ctx.face_results = self.face_service.recognize_faces_in_frame(frame)
+                except Exception as e:
+                    print(f"Error running face recognition on frame: {e}")
+            return ctx
+
+        # Detect on a downscaled copy; boxes come back in native resolution
+        ctx.detect_frame, ctx.detect_scale = resize_to_width(frame, Config.DETECTION_WIDTH)
+        # YOLO runs every few frames; in between, tracks advance by Kalman prediction
+        ctx.detections, tracks = self.tracking_service.detect_and_track(frame, ctx.detect_frame, ctx.detect_scale)
+        ctx.tracking_results = self.tracking_service.process_tracks(tracks)
+
+        if self.face_service is not None:
+            try:
+                # Identity cache: only unverified / stale tracks are embedded,
+                # from crops cut out of the native-resolution frame
+                ctx.face_results = self.tracking_service.recognize_tracks(
+                    frame, ctx.tracking_results, self.face_service, ctx.detect_frame)
+            except Exception as e:
+                print(f"Error running face recognition on frame: {e}")
+
+        return ctx
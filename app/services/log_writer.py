@@ -0,0 +1,117 @@
+import json
+import threading
+from datetime import datetime
+from app.models.database import db, Device, Log
+from app.utils.queues import BoundedQueue, BLOCK
+from app.utils.workers import BackgroundWorker
+from config import Config
+
+
+class LogWriter(BackgroundWorker):
+    """Ghi bảng Log bất đồng bộ theo lô trên một thread riêng.
+
+    ``submit`` only serializes the event and puts it on a bounded queue, so
+    the camera thread never waits for a SQLite commit. The writer thread
+    drains up to ``LOG_BATCH_SIZE`` events at a time and inserts them in a
+    single transaction. The device id is looked up once and cached. When
+    the queue is full the configured policy applies: drop the oldest or
+    newest event, or block the producer for ``LOG_QUEUE_PUT_TIMEOUT``
+    seconds. ``stop`` flushes whatever is still queued; the writer is
+    stopped after the other workers, which may still submit logs.
+    """
+
+    thread_name = 'log-writer'
+    stop_order = 100
+    _UNSET = object()
+
+    def __init__(self, maxsize=None, policy=None, batch_size=None, flush_interval=None):
+        self.maxsize = maxsize or Config.LOG_QUEUE_SIZE
+        self.policy = policy or Config.LOG_QUEUE_POLICY
+        self.batch_size = max(1, int(batch_size or Config.LOG_BATCH_SIZE))
+        self.flush_interval = flush_interval or Config.LOG_FLUSH_INTERVAL
+        super().__init__()
+        self._device_id = self._UNSET
+        self._flush_lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def _new_queue(self):
+        return BoundedQueue(self.maxsize, self.policy, 'log')
+
+    def submit(self, event_type, details=None):
+        """Đưa một log vào hàng đợi; trả về False nếu log bị bỏ"""
+        record = {
+            'event_type': event_type,
+            'timestamp': datetime.now(),
+            'details': json.dumps(details) if isinstance(details, dict) else (None if details is None else str(details))
+        }
+        if not self.running:
+            # No writer thread (e.g. scripts using the services directly): write now
+            return self._write_now(record)
+        timeout = Config.LOG_QUEUE_PUT_TIMEOUT if self.queue.policy == BLOCK else None
+        return self.queue.put(record, timeout)
+
+    def _run(self):
+        while True:
+            batch = self.queue.get_batch(self.batch_size, timeout=self.flush_interval)
+            if batch:
+                self._flush(batch)
+                self._mark_done(len(batch))
+            elif self.queue.closed:
+                break
+
+    def _write_now(self, record):
+        app = self.app
+        if app is None:
+            try:
+                from flask import current_app
+                app = current_app._get_current_object()
+            except RuntimeError:
+                # Không có application context, bỏ qua logging
+                return False
+        return self._flush([record], app)
+
+    def _flush(self, batch, app=None):
+        app = app or self.app
+        if app is None:
+            self.failed += len(batch)
+            return False
+        with self._flush_lock:
+            try:
+                with app.app_context():
+                    device_id = self._get_device_id()
+                    db.session.add_all([Log(device_id=device_id, **record) for record in batch])
+                    db.session.commit()
+                self.written += len(batch)
+                self.flushes += 1
+                return True
+            except Exception as e:
+                try:
+                    with app.app_context():
+                        db.session.rollback()
+                except Exception:
+                    pass
+                self.failed += len(batch)
+                print(f"Error writing {len(batch)} log events: {e}")
+                return False
+
+    def _get_device_id(self):
+        if self._device_id is self._UNSET:
+            device = Device.query.first()
+            self._device_id = device.device_id if device else None
+        return self._device_id
+
+    def stats(self):
+        """Thống kê writer: số log đã ghi, lỗi, số lần flush và trạng thái queue"""
+        return {
+            'running': self.running,
+            'written': self.written,
+            'failed': self.failed,
+            'flushes': self.flushes,
+            'queue': self.queue.stats()
+        }
+
+
+# Shared writer used by the tracking, recognition and attendance services
+log_writer = LogWriter()
@@ -0,0 +1,119 @@
+import time
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.models.database import db, Attendance, Log
+from app.utils.metrics import MetricsRegistry
+from app.utils.timing import stage_timer
+from app.services.log_writer import log_writer
+from app.services.event_bus import event_bus
+
+
+# Metrics exposed at /metrics (Prometheus text format)
+registry = MetricsRegistry('ptud')
+
+FRAME_STAGE_SECONDS = registry.histogram(
+    'frame_stage_seconds', 'Latency of each camera frame stage in seconds.', ('stage',))
+CAMERA_FPS = registry.gauge(
+    'camera_fps', 'Frames processed per second over the latency window.', callback=stage_timer.fps)
+FACE_RECOGNITIONS = registry.counter(
+    'face_recognitions_total', 'Face recognition results by outcome (known, unknown, cached).', ('outcome',))
+GALLERY_SIZE = registry.gauge(
+    'gallery_size', 'Number of identities in the face gallery index.')
+ACTIVE_TRACKS = registry.gauge(
+    'active_tracks', 'Confirmed tracks currently followed by the tracker.')
+ACTIVE_ATTENDANCES = registry.gauge(
+    'active_attendances', 'Open attendance sessions held in memory.')
+ATTENDANCE_WRITES = registry.counter(
+    'attendance_writes_total', 'Attendance rows flushed to the database by operation.', ('operation',))
+ATTENDANCE_JOURNAL_PENDING = registry.gauge(
+    'attendance_journal_pending', 'Attendance changes journaled but not yet committed.')
+LOG_WRITES = registry.counter(
+    'log_writes_total', 'Log rows inserted into the database.')
+LOG_QUEUE_DEPTH = registry.gauge(
+    'log_queue_depth', 'Log events waiting for the background writer.',
+    callback=lambda: len(log_writer.queue))
+LOG_DROPPED = registry.gauge(
+    'log_events_dropped', 'Log events dropped because the writer queue was full.',
+    callback=lambda: log_writer.queue.dropped)
+DB_QUERY_SECONDS = registry.histogram(
+    'db_query_seconds', 'SQL statement latency in seconds by statement type.', ('statement',))
+SSE_CLIENTS = registry.gauge(
+    'sse_clients', 'Dashboards connected to the /api/events stream.',
+    callback=lambda: event_bus.stats()['subscribers'])
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', 'Flask request latency in seconds by route.', ('endpoint', 'method', 'status'))
+
+stage_timer.add_listener(lambda stage, seconds: FRAME_STAGE_SECONDS.observe(seconds, stage=stage))
+
+_session_hooks_installed = False
+
+
+def _statement_type(statement):
+    word = statement.lstrip().split(None, 1)[0].lower() if statement and statement.strip() else 'other'
+    return word if word in ('select', 'insert', 'update', 'delete') else 'other'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if starts:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - starts.pop(), statement=_statement_type(statement))
+
+
+def _after_flush(session, flush_context):
+    for operation, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        count = sum(1 for obj in objects if isinstance(obj, Attendance))
+        if count:
+            ATTENDANCE_WRITES.inc(count, operation=operation)
+    logs = sum(1 for obj in session.new if isinstance(obj, Log))
+    if logs:
+        LOG_WRITES.inc(logs)
+
+
+def init_monitoring(app):
+    """Gắn các hook đo lường vào Flask app, engine SQLAlchemy và các service"""
+    global _session_hooks_installed
+
+    face_service = getattr(app, 'face_service', None)
+    tracking_service = getattr(app, 'tracking_service', None)
+    attendance_service = getattr(app, 'attendance_service', None)
+    if face_service is not None:
+        GALLERY_SIZE.set_function(lambda: len(face_service.gallery))
+    if tracking_service is not None:
+        ACTIVE_TRACKS.set_function(lambda: len(tracking_service.tracked_objects))
+    if attendance_service is not None:
+        ACTIVE_ATTENDANCES.set_function(lambda: len(attendance_service.active_attendances))
+        ATTENDANCE_JOURNAL_PENDING.set_function(lambda: attendance_service.journal.stats()['pending'])
+
+    # SQL query counts / latency (the histogram _count is the query count)
+    with app.app_context():
+        engine = db.engine
+        if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    # Attendance / log writes, counted once per flush for every session
+    if not _session_hooks_installed:
+        event.listen(Session, 'after_flush', _after_flush)
+        _session_hooks_installed = True
+
+    # Per-route request latency
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_request_start = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop('metrics_request_start', None)
+        if start is not None:
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                endpoint=request.url_rule.rule if request.url_rule is not None else 'unmatched',
+                method=request.method,
+                status=response.status_code
+            )
+        return response
@@ -0,0 +1,102 @@
+import threading
+import time
+import cv2
+import numpy as np
+from config import Config
+
+
+class MotionGate:
+    """Cổng chuyển động: bỏ qua các stage nặng khi cảnh trống và đứng yên.
+
+    Each frame is reduced to a small blurred gray thumbnail and compared
+    with the previous one. While no pixels change by more than
+    ``MOTION_GATE_PIXEL_THRESHOLD`` over more than ``MOTION_GATE_MIN_AREA``
+    of the image and the tracker has no live tracks, the gate reports the
+    frame as idle and the caller skips YOLO, face detection and DeepSORT.
+    Any motion wakes the full pipeline, which then stays active for at
+    least ``MOTION_GATE_HOLD_FRAMES`` frames so new tracks can be confirmed.
+    """
+
+    def __init__(self, enabled=None):
+        self.enabled = Config.MOTION_GATE_ENABLED if enabled is None else enabled
+        self._lock = threading.Lock()
+        self._previous = None
+        self._hold = 0
+        self.active = True
+        self.last_motion = 0.0
+        self.frames_seen = 0
+        self.frames_skipped = 0
+        self.wake_ups = 0
+        self.idle_seconds = 0.0
+        self._idle_since = None
+
+    def check(self, frame, has_tracks=False):
+        """Trả về True nếu frame cần xử lý đầy đủ, False nếu có thể bỏ qua"""
+        with self._lock:
+            self.frames_seen += 1
+            if not self.enabled:
+                return True
+
+            thumb = self._thumbnail(frame)
+            previous = self._previous
+            self._previous = thumb
+            if previous is None or previous.shape != thumb.shape:
+                self._set_active(True)
+                return True
+
+            diff = cv2.absdiff(thumb, previous)
+            self.last_motion = float(np.count_nonzero(diff > Config.MOTION_GATE_PIXEL_THRESHOLD)) / diff.size
+            if self.last_motion > Config.MOTION_GATE_MIN_AREA:
+                self._hold = max(1, Config.MOTION_GATE_HOLD_FRAMES)
+            elif self._hold > 0:
+                self._hold -= 1
+
+            process = has_tracks or self._hold > 0
+            self._set_active(process)
+            if not process:
+                self.frames_skipped += 1
+            return process
+
+    def reset(self):
+        """Quên frame trước; frame kế tiếp luôn được xử lý"""
+        with self._lock:
+            self._previous = None
+            self._hold = 0
+            self._set_active(True)
+
+    def _set_active(self, active):
+        now = time.time()
+        if active and not self.active:
+            self.wake_ups += 1
+            if self._idle_since is not None:
+                self.idle_seconds += now - self._idle_since
+            self._idle_since = None
+        elif not active and self.active:
+            self._idle_since = now
+        self.active = active
+
+    def _thumbnail(self, frame):
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape[:2]
+        width = max(8, int(Config.MOTION_GATE_WIDTH))
+        height = max(1, int(round(h * width / float(w))))
+        small = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+        # Blur suppresses sensor noise so it does not count as motion
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def stats(self):
+        """Thống kê cổng chuyển động: trạng thái, thời gian idle, số lần đánh thức"""
+        with self._lock:
+            idle_seconds = self.idle_seconds
+            if self._idle_since is not None:
+                idle_seconds += time.time() - self._idle_since
+            return {
+                'enabled': self.enabled,
+                'state': 'active' if self.active else 'idle',
+                'last_motion': round(self.last_motion, 4),
+                'frames_seen': self.frames_seen,
+                'frames_skipped': self.frames_skipped,
+                'skip_ratio': round(self.frames_skipped / float(self.frames_seen), 4) if self.frames_seen else 0.0,
+                'wake_ups': self.wake_ups,
+                'idle_seconds': round(idle_seconds, 3)
+            }
@@ -0,0 +1,117 @@
+import threading
+import time
+from app.utils.queues import BoundedQueue
+from app.utils.timing import stage_timer
+from config import Config
+
+
+class CameraPipeline:
+    """Pipeline nhiều luồng: capture -> inference -> render.
+
+    A capture thread reads the camera continuously and keeps only the latest
+    frame(s) in a bounded queue, so a slow inference stage never backs up the
+    camera buffer. An inference thread runs ``process_fn(frame)`` on the most
+    recent frame and publishes its output to a second bounded queue, which
+    the render/output stage (the caller's thread, since OpenCV windows must
+    be driven from the main thread) consumes with ``get_output``.
+    """
+
+    def __init__(self, camera, process_fn,
+                 capture_queue_size=None, output_queue_size=None, drop_policy=None):
+        self.camera = camera
+        self.process_fn = process_fn
+        policy = drop_policy or Config.PIPELINE_DROP_POLICY
+        self.capture_queue = BoundedQueue(capture_queue_size or Config.PIPELINE_CAPTURE_QUEUE_SIZE, policy, 'capture')
+        self.output_queue = BoundedQueue(output_queue_size or Config.PIPELINE_OUTPUT_QUEUE_SIZE, policy, 'output')
+        self._stop = threading.Event()
+        self._threads = []
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.frames_rendered = 0
+        self.capture_failures = 0
+        self.inference_errors = 0
+        self.failed = False
+
+    def start(self):
+        """Khởi động các thread capture và inference"""
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name='pipeline-capture', daemon=True),
+            threading.Thread(target=self._inference_loop, name='pipeline-inference', daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=2.0):
+        """Dừng pipeline và chờ các thread kết thúc"""
+        self._stop.set()
+        self.capture_queue.close()
+        self.output_queue.close()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
+
+    def get_output(self, timeout=0.1):
+        """Lấy kết quả mới nhất của stage inference (None nếu chưa có)"""
+        output = self.output_queue.get(timeout)
+        if output is not None:
+            self.frames_rendered += 1
+        return output
+
+    def _capture_loop(self):
+        while not self._stop.is_set():
+            with stage_timer.measure('capture'):
+                ret, frame = self.camera.read()
+            if not ret:
+                self.capture_failures += 1
+                if self.capture_failures >= Config.PIPELINE_MAX_CAPTURE_FAILURES:
+                    print("Failed to read frame from camera")
+                    self.failed = True
+                    self._stop.set()
+                    self.capture_queue.close()
+                    break
+                time.sleep(0.01)
+                continue
+            self.capture_failures = 0
+            self.frames_captured += 1
+            self.capture_queue.put(frame)
+
+    def _inference_loop(self):
+        while not self._stop.is_set():
+            frame = self.capture_queue.get(timeout=0.1)
+            if frame is None:
+                if self.capture_queue.closed:
+                    break
+                continue
+            try:
+                output = self.process_fn(frame)
+            except Exception as e:
+                self.inference_errors += 1
+                print(f"Error processing frame: {e}")
+                continue
+            self.frames_processed += 1
+            self.output_queue.put(output)
+        # Let the render stage drain and notice the end of the stream
+        self.output_queue.close()
+
+    def stats(self):
+        """Thống kê từng stage: số frame, độ sâu queue và số frame bị bỏ"""
+        return {
+            'capture': {
+                'frames': self.frames_captured,
+                'failures': self.capture_failures,
+                'queue': self.capture_queue.stats()
+            },
+            'inference': {
+                'frames': self.frames_processed,
+                'errors': self.inference_errors,
+                'queue': self.output_queue.stats()
+            },
+            'render': {
+                'frames': self.frames_rendered
+            }
+        }
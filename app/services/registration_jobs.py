@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from app.models.database import db, Person
+from app.utils.queues import BoundedQueue, DROP_NEWEST
+from app.utils.workers import BackgroundWorker
+from app.services.event_bus import event_bus
+from config import Config
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class RegistrationJobs(BackgroundWorker):
+    """Đăng ký người mới bất đồng bộ: encode ảnh và cập nhật gallery trên thread riêng.
+
+    ``submit`` only queues the saved image paths and returns a job id, so
+    the HTTP request returns immediately. The worker thread computes one
+    encoding per image, stores the normalized centroid on the Person row
+    and updates just that person's gallery entry
+    (``FaceRecognitionService.update_person_faces``) instead of reloading
+    every known face. Job status is kept in memory for the last
+    ``REGISTRATION_JOB_HISTORY`` jobs.
+    """
+
+    thread_name = 'registration-worker'
+    stop_order = 10
+
+    def __init__(self, face_service, maxsize=None):
+        self.face_service = face_service
+        self.maxsize = maxsize or Config.REGISTRATION_QUEUE_SIZE
+        super().__init__()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _new_queue(self):
+        return BoundedQueue(self.maxsize, DROP_NEWEST, 'registration')
+
+    def submit(self, name, image_paths):
+        """Tạo job đăng ký; trả về job (dict) hoặc None nếu hàng đợi đầy"""
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'name': name,
+            'status': QUEUED,
+            'images': len(image_paths),
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None
+        }
+        with self._lock:
+            self._jobs[job['job_id']] = job
+            self._trim()
+        if not self.queue.put((job['job_id'], name, list(image_paths))):
+            self._finish(job['job_id'], FAILED, error='Registration queue is full')
+            return None
+        return dict(job)
+
+    def get(self, job_id):
+        """Trạng thái của một job (bản sao), None nếu không tồn tại"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _trim(self):
+        # Drop the oldest finished jobs beyond the history size
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in (SUCCEEDED, FAILED)]
+        for job_id in finished[:max(0, len(self._jobs) - Config.REGISTRATION_JOB_HISTORY)]:
+            del self._jobs[job_id]
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._update(job_id, status=status, result=result, error=error, finished_at=datetime.now().isoformat())
+        event_bus.publish('registration', {'job_id': job_id, 'status': status, 'result': result, 'error': error})
+
+    def _run(self):
+        while True:
+            item = self.queue.get(timeout=1.0)
+            if item is None:
+                if self.queue.closed:
+                    break
+                continue
+            job_id, name, image_paths = item
+            self._update(job_id, status=RUNNING, started_at=datetime.now().isoformat())
+            try:
+                result, error = self._register(name, image_paths)
+                if error:
+                    self._finish(job_id, FAILED, result=result, error=error)
+                else:
+                    self._finish(job_id, SUCCEEDED, result=result)
+            except Exception as e:
+                print(f"Registration job {job_id} failed: {e}")
+                self._finish(job_id, FAILED, error=str(e))
+            self._mark_done()
+
+    def _register(self, name, image_paths):
+        """Encode ảnh, lưu centroid vào Person và cập nhật gallery; trả về (result, error)"""
+        encodings = []
+        failed_files = []
+        for path in image_paths:
+            filename = os.path.basename(path)
+            try:
+                enc = self.face_service.get_face_encoding_from_image(path)
+                if enc is not None:
+                    encodings.append(enc)
+                    print(f"Successfully processed {filename}, encoding shape: {enc.shape}")
+                else:
+                    failed_files.append(filename)
+                    print(f"No face detected in {filename}")
+            except Exception as e:
+                failed_files.append(filename)
+                print(f"Error processing {filename}: {e}")
+
+        if not encodings:
+            error_msg = 'No valid faces detected in uploaded images'
+            if failed_files:
+                error_msg += f'. Failed files: {", ".join(failed_files)}'
+            error_msg += '. Please ensure images contain clear, front-facing faces with good lighting.'
+            return {'failed_files': failed_files}, error_msg
+
+        centroid = np.mean(encodings, axis=0)
+        centroid = centroid / (np.linalg.norm(centroid) + 1e-7)
+
+        with self.app.app_context():
+            try:
+                person = Person.query.filter_by(name=name).first()
+                if not person:
+                    person = Person(name=name, role='user')
+                    db.session.add(person)
+                person.face_encoding = json.dumps(centroid.tolist())
+                db.session.commit()
+                person_id = person.person_id
+            except Exception:
+                db.session.rollback()
+                raise
+
+        self.face_service.update_person_faces(name, centroid, person_id)
+        print(f"Successfully registered {name} with {len(encodings)} face encodings")
+
+        return {
+            'person_id': person_id,
+            'name': name,
+            'saved_files': list(image_paths),
+            'encodings_count': len(encodings),
+            'failed_files': failed_files,
+            'gallery_size': len(self.face_service.gallery)
+        }, None
+
+    def stats(self):
+        with self._lock:
+            statuses = [job['status'] for job in self._jobs.values()]
+        return {
+            'running': self.running,
+            'queued': len(self.queue),
+            'jobs': {status: statuses.count(status) for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        }
@@ -3,9 +3,23 @@ import numpy as np
 from ultralytics import YOLO
 from deep_sort_realtime.deepsort_tracker import DeepSort
 from datetime import datetime
-from app.models.database import Log, Device, db
+from app.utils.image import resize_to_width
+from app.utils.timing import stage_timer
+from app.services.monitoring import FACE_RECOGNITIONS
+from app.services.log_writer import log_writer
+from app.services.event_bus import event_bus
 from config import Config
-import json
+
+
+def _bbox_iou(a, b):
+    """IoU giữa hai bbox (left, top, right, bottom)"""
+    if a is None or b is None:
+        return 0.0
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
 
 class TrackingService:
     """Service xử lý tracking người với YOLOv8 + DeepSORT"""
@@ -13,7 +27,16 @@ class TrackingService:
     def __init__(self):
         self.yolo_model = None
         self.tracker = None
-        self.tracked_objects = {}  # {track_id: {'name': str, 'last_seen': datetime, 'person_id': int}}
+        self.tracked_objects = {}  # {track_id: {'name': str, 'last_seen': datetime, 'person_id': int, ...}}
+        self.frame_index = 0
+        # Detection stride state: YOLO runs every N frames (or on motion /
+        # track uncertainty), the Kalman filter predicts in between
+        self._frames_since_detection = None
+        self._last_detection_thumb = None
+        self.detection_frames = 0
+        self.predicted_frames = 0
+        # Last track list pushed to SSE clients: {track_id: (name, person_id)}
+        self._published_tracks = {}
         self.load_models()
     
     def load_models(self):
@@ -32,8 +55,12 @@ class TrackingService:
             self.yolo_model = None
             self.tracker = None
     
-    def detect_people(self, frame):
-        """Phát hiện người trong frame bằng YOLO"""
+    def detect_people(self, frame, scale=1.0):
+        """Phát hiện người trong frame bằng YOLO
+
+        ``scale`` maps boxes found on a downscaled detection frame back to
+        the original resolution.
+        """
         if self.yolo_model is None:
             return []
         
@@ -47,7 +74,7 @@ class TrackingService:
                 
                 # Class 0 = "person" trong COCO dataset
                 if cls == 0 and conf >= Config.TRACKING_CONFIDENCE_THRESHOLD:
-                    x1, y1, x2, y2 = map(int, r.xyxy[0])
+                    x1, y1, x2, y2 = (int(v * scale) for v in r.xyxy[0])
                     width = x2 - x1
                     height = y2 - y1
                     
@@ -71,25 +98,131 @@ class TrackingService:
             print(f"Error in tracking update: {e}")
             return []
     
-    def process_frame(self, frame, face_recognition_service=None):
-        """Xử lý frame để detect và track người"""
-        # Detect people
-        detections = self.detect_people(frame)
-        
-        # Update tracking
-        tracks = self.update_tracking(frame, detections)
+    def has_live_tracks(self):
+        """Còn track nào (kể cả tentative) trong tracker không"""
+        if self.tracker is None:
+            return False
+        return len(self.tracker.tracker.tracks) > 0
+
+    def should_detect(self, detect_frame):
+        """Có cần chạy YOLO ở frame này không (stride, chuyển động, độ bất định của track)"""
+        if self.tracker is None or self._frames_since_detection is None:
+            return True
+        if self._frames_since_detection + 1 >= max(1, Config.DETECTION_STRIDE):
+            return True
+        if not Config.DETECTION_ADAPTIVE:
+            return False
+
+        tracks = self.tracker.tracker.tracks
+        # New people are only confirmed by fresh detections
+        if any(track.is_tentative() for track in tracks):
+            return True
+        # Kalman position uncertainty grows with every prediction-only step
+        for track in tracks:
+            if not track.is_confirmed():
+                continue
+            height = max(float(track.mean[3]), 1.0)
+            spread = float(np.sqrt(track.covariance[0, 0] + track.covariance[1, 1]))
+            if spread / height > Config.DETECTION_UNCERTAINTY_THRESHOLD:
+                return True
+        # Scene changed noticeably since the last detection
+        thumb = self._motion_thumbnail(detect_frame)
+        if self._last_detection_thumb is not None and thumb.shape == self._last_detection_thumb.shape:
+            motion = float(np.mean(cv2.absdiff(thumb, self._last_detection_thumb)))
+            if motion > Config.DETECTION_MOTION_THRESHOLD:
+                return True
+        return False
+
+    def detect_and_track(self, frame, detect_frame=None, scale=1.0):
+        """Chạy YOLO + DeepSORT, hoặc chỉ dự đoán vị trí track giữa các lần detect.
+
+        Returns ``(detections, tracks)``; detections is empty on
+        prediction-only frames.
+        """
+        if detect_frame is None:
+            detect_frame = frame
+        if self.should_detect(detect_frame):
+            with stage_timer.measure('yolo'):
+                detections = self.detect_people(detect_frame, scale)
+            with stage_timer.measure('deepsort'):
+                self._undo_predict_steps()
+                tracks = self.update_tracking(frame, detections)
+            self._frames_since_detection = 0
+            self._last_detection_thumb = self._motion_thumbnail(detect_frame)
+            self.detection_frames += 1
+            return detections, tracks
+
+        self._frames_since_detection += 1
+        self.predicted_frames += 1
+        with stage_timer.measure('deepsort'):
+            tracks = self.predict_tracks()
+        return [], tracks
+
+    def predict_tracks(self):
+        """Tiến Kalman filter một bước (không có detection mới).
+
+        ``Track.predict`` also bumps ``time_since_update``; those steps are
+        undone before the next real update (see ``_undo_predict_steps``).
+        """
+        if self.tracker is None:
+            return []
+        try:
+            self.tracker.tracker.predict()
+            return self.tracker.tracker.tracks
+        except Exception as e:
+            print(f"Error in tracking prediction: {e}")
+            return []
+
+    def _undo_predict_steps(self):
+        """Trừ các bước chỉ dự đoán khỏi ``time_since_update`` trước khi update bằng detection.
+
+        DeepSORT only offers tracks with ``time_since_update == 1`` to its
+        IOU fallback, so without this, confirmed tracks would reach every
+        update with a count of DETECTION_STRIDE and lose IOU re-association.
+        The Kalman state keeps its predicted position. As a consequence,
+        DEEPSORT_MAX_AGE counts detection frames only: a track survives up
+        to about DEEPSORT_MAX_AGE * DETECTION_STRIDE camera frames unmatched.
+        """
+        steps = self._frames_since_detection or 0
+        if self.tracker is None or steps <= 0:
+            return
+        for track in self.tracker.tracker.tracks:
+            track.time_since_update = max(track.time_since_update - steps, 0)
+
+    def _motion_thumbnail(self, frame):
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (64, 48), interpolation=cv2.INTER_AREA)
+
+    def process_frame(self, frame, face_recognition_service=None, face_results=None):
+        """Xử lý frame để detect và track người
+
+        Pass ``face_results`` when faces were already recognized for this frame
+        to assign them to tracks directly. Otherwise, when a face service is
+        given, faces are recognized through the per-track identity cache
+        (see recognize_tracks).
+        """
+        # Detect people on a downscaled copy, track on the native frame
+        detect_frame, scale = resize_to_width(frame, Config.DETECTION_WIDTH)
         
-        # Process tracking results
-        current_track_ids = []
-        frame_results = []
-        # If face_recognition_service provided, detect faces once on the full frame
-        face_results = []
-        if face_recognition_service:
+        # Update tracking (YOLO every few frames, Kalman prediction in between)
+        detections, tracks = self.detect_and_track(frame, detect_frame, scale)
+
+        frame_results = self.process_tracks(tracks, face_results)
+        if face_results is None and face_recognition_service:
             try:
-                face_results = face_recognition_service.recognize_faces_in_frame(frame)
+                self.recognize_tracks(frame, frame_results, face_recognition_service, detect_frame)
             except Exception as e:
                 print(f"Error running face recognition on frame: {e}")
 
+        return frame_results
+
+    def process_tracks(self, tracks, face_results=None):
+        """Cập nhật trạng thái track và gán danh tính từ face_results đã có sẵn"""
+        face_results = face_results or []
+        current_track_ids = []
+        frame_results = []
+        self.frame_index += 1
+
         for track in tracks:
             if not track.is_confirmed():
                 continue
@@ -107,7 +240,12 @@ class TrackingService:
                 self.tracked_objects[track_id] = {
                     'name': Config.UNKNOWN_PERSON_LABEL,
                     'last_seen': datetime.now(),
-                    'person_id': None
+                    'person_id': None,
+                    # Identity cache: confidence of the last recognition and
+                    # the frame / bbox at which it was made
+                    'confidence': 0.0,
+                    'verified_frame': None,
+                    'verified_bbox': None
                 }
 
             self.tracked_objects[track_id]['last_seen'] = datetime.now()
@@ -121,48 +259,159 @@ class TrackingService:
 
         # Match detected faces to tracks by spatial containment (face center in track bbox)
         try:
-            for fr in face_results:
-                ftop, fright, fbottom, fleft = fr.get('location', (None, None, None, None))
-                if None in (ftop, fright, fbottom, fleft):
-                    continue
-                # compute face center
-                cx = (fleft + fright) / 2.0
-                cy = (ftop + fbottom) / 2.0
-
-                # find candidate tracks containing the center
-                candidates = []
-                for item in frame_results:
-                    tid = item['track_id']
-                    l, t, r, b = item['bbox']
-                    if (cx >= l and cx <= r and cy >= t and cy <= b):
-                        candidates.append((tid, l, t, r, b))
-
-                if not candidates:
-                    continue
-
-                # if multiple, pick the one with smallest bbox-center distance
-                best_tid = None
-                best_dist = None
-                for tid, l, t, r, b in candidates:
-                    tx = (l + r) / 2.0
-                    ty = (t + b) / 2.0
-                    dist = ((tx - cx)**2 + (ty - cy)**2)**0.5
-                    if best_dist is None or dist < best_dist:
-                        best_dist = dist
-                        best_tid = tid
-
-                # assign if we found a match and face result is known
-                if best_tid is not None and fr.get('name') and fr.get('name') != Config.UNKNOWN_PERSON_LABEL:
-                    if best_tid in self.tracked_objects:
-                        self.tracked_objects[best_tid]['name'] = fr.get('name')
-                        self.tracked_objects[best_tid]['person_id'] = fr.get('person_id')
+            if face_results:
+                face_tracks = self.match_faces_to_tracks([fr.get('location') for fr in face_results], frame_results)
+                bboxes = {item['track_id']: item['bbox'] for item in frame_results}
+                for fr, tid in zip(face_results, face_tracks):
+                    if tid is not None:
+                        self.update_identity(tid, fr, bboxes[tid])
+                self._refresh_result_identities(frame_results)
         except Exception as e:
             print(f"Error matching faces to tracks: {e}")
         
         # Kiểm tra các track đã mất
         self.check_lost_tracks(current_track_ids)
+        self.publish_track_changes()
         
         return frame_results
+
+    def match_faces_to_tracks(self, face_locations, frame_results):
+        """Gán mỗi khuôn mặt (top, right, bottom, left) cho track chứa tâm khuôn mặt.
+
+        Returns one track_id (or None) per face. When several tracks contain
+        the face center, the one whose bbox center is closest wins.
+        """
+        matches = []
+        for location in face_locations:
+            ftop, fright, fbottom, fleft = location if location else (None, None, None, None)
+            if None in (ftop, fright, fbottom, fleft):
+                matches.append(None)
+                continue
+            # compute face center
+            cx = (fleft + fright) / 2.0
+            cy = (ftop + fbottom) / 2.0
+
+            best_tid = None
+            best_dist = None
+            for item in frame_results:
+                l, t, r, b = item['bbox']
+                if not (cx >= l and cx <= r and cy >= t and cy <= b):
+                    continue
+                tx = (l + r) / 2.0
+                ty = (t + b) / 2.0
+                dist = ((tx - cx)**2 + (ty - cy)**2)**0.5
+                if best_dist is None or dist < best_dist:
+                    best_dist = dist
+                    best_tid = item['track_id']
+            matches.append(best_tid)
+        return matches
+
+    def needs_recognition(self, track_id, bbox):
+        """Track có cần chạy embedding lại không (cache miss, hết hạn, hoặc bbox thay đổi nhiều)"""
+        info = self.tracked_objects.get(track_id)
+        if info is None or info.get('verified_frame') is None:
+            return True
+        if info['name'] == Config.UNKNOWN_PERSON_LABEL:
+            return True
+        if info.get('confidence', 0.0) < Config.TRACK_CACHE_MIN_CONFIDENCE:
+            return True
+        if self.frame_index - info['verified_frame'] >= Config.TRACK_REVERIFY_INTERVAL:
+            return True
+        return _bbox_iou(bbox, info['verified_bbox']) < Config.TRACK_REVERIFY_IOU
+
+    def update_identity(self, track_id, face_result, bbox):
+        """Cập nhật cache danh tính của track từ một kết quả nhận diện"""
+        info = self.tracked_objects.get(track_id)
+        if info is None:
+            return
+        name = face_result.get('name')
+        if name and name != Config.UNKNOWN_PERSON_LABEL:
+            info['name'] = name
+            info['person_id'] = face_result.get('person_id')
+            info['confidence'] = float(face_result.get('confidence', 0.0))
+        else:
+            # Keep the last known name but force re-verification on the next frame
+            info['confidence'] = 0.0
+        info['verified_frame'] = self.frame_index
+        info['verified_bbox'] = bbox
+
+    def recognize_tracks(self, frame, frame_results, face_service, detect_frame=None):
+        """Nhận diện khuôn mặt trong frame, dùng cache danh tính theo track.
+
+        Faces on confirmed, confidently named tracks reuse the cached identity
+        and skip embedding until the track is due for re-verification
+        (Config.TRACK_REVERIFY_INTERVAL frames) or its bbox moved a lot. At
+        most Config.RECOGNITION_BUDGET_PER_FRAME faces are embedded per frame,
+        unidentified tracks first, then re-verifications, then faces outside
+        any track. Updates frame_results in place and returns face results.
+
+        When ``detect_frame`` (a downscaled copy of ``frame``) is given, face
+        detection runs on it and only the crops are cut from ``frame``.
+        """
+        if Config.FACE_DETECTION_MODE == 'tracks':
+            # Scan only the upper part of each confirmed track; faces map to their track directly
+            regions = [(item['track_id'], item['bbox']) for item in frame_results]
+            gray, detected = face_service.detect_faces_in_regions(frame, regions, Config.FACE_REGION_TOP_FRACTION, detect_frame)
+            faces = [box for _, box in detected]
+            face_tracks = [tid for tid, _ in detected]
+            locations = [(y, x + w, y + h, x) for (x, y, w, h) in faces]
+        else:
+            gray, faces = face_service.detect_faces(frame, detect_frame)
+            locations = [(y, x + w, y + h, x) for (x, y, w, h) in faces]
+            face_tracks = self.match_faces_to_tracks(locations, frame_results)
+        if len(faces) == 0:
+            return []
+
+        bboxes = {item['track_id']: item['bbox'] for item in frame_results}
+
+        face_results = [None] * len(faces)
+        candidates = []
+        for i, tid in enumerate(face_tracks):
+            if tid is None:
+                candidates.append((2, i))
+            elif self.needs_recognition(tid, bboxes[tid]):
+                unidentified = self.tracked_objects[tid]['name'] == Config.UNKNOWN_PERSON_LABEL
+                candidates.append((0 if unidentified else 1, i))
+            else:
+                face_results[i] = self._cached_face_result(tid, locations[i])
+        candidates.sort()
+
+        budget = Config.RECOGNITION_BUDGET_PER_FRAME
+        selected = [i for _, i in candidates[:budget]] if budget > 0 else [i for _, i in candidates]
+        recognized = face_service.recognize_face_rois(gray, [faces[i] for i in selected])
+        for i, result in zip(selected, recognized):
+            face_results[i] = result
+            tid = face_tracks[i]
+            if tid is not None:
+                self.update_identity(tid, result, bboxes[tid])
+
+        # Faces over budget keep whatever their track already knows
+        for i, result in enumerate(face_results):
+            if result is None:
+                face_results[i] = self._cached_face_result(face_tracks[i], locations[i])
+
+        self._refresh_result_identities(frame_results)
+        return face_results
+
+    def _cached_face_result(self, track_id, location):
+        """Face result built from the track identity cache (no embedding)"""
+        info = self.tracked_objects.get(track_id) or {}
+        FACE_RECOGNITIONS.inc(outcome='cached')
+        return {
+            'location': location,
+            'name': info.get('name', Config.UNKNOWN_PERSON_LABEL),
+            'person_id': info.get('person_id'),
+            'confidence': info.get('confidence', 0.0),
+            'face_encoding': None,
+            'cached': True
+        }
+
+    def _refresh_result_identities(self, frame_results):
+        for item in frame_results:
+            info = self.tracked_objects.get(item['track_id'])
+            if info:
+                item['name'] = info['name']
+                item['person_id'] = info['person_id']
     
     def check_lost_tracks(self, current_track_ids):
         """Kiểm tra các track đã mất dấu"""
@@ -182,6 +431,22 @@ class TrackingService:
             del self.tracked_objects[track_id]
             self.log_tracking_event('track_lost', {'track_id': track_id})
     
+    def expire_tracks(self):
+        """Bookkeeping cho frame bị motion gate bỏ qua: xoá track đã rời đi và đẩy thay đổi tới dashboard"""
+        self.check_lost_tracks([])
+        self.publish_track_changes()
+
+    def publish_track_changes(self):
+        """Đẩy danh sách track tới dashboard (SSE) khi có track mới, mất track hoặc đổi danh tính"""
+        current = {track_id: (info['name'], info['person_id']) for track_id, info in self.tracked_objects.items()}
+        if current == self._published_tracks:
+            return
+        self._published_tracks = current
+        event_bus.publish('tracks', [
+            {'track_id': track_id, 'name': name, 'person_id': person_id}
+            for track_id, (name, person_id) in current.items()
+        ])
+    
     def draw_tracking_boxes(self, frame, tracking_results):
         """Vẽ khung tracking lên frame"""
         for result in tracking_results:
@@ -230,21 +495,9 @@ class TrackingService:
             })
     
     def log_tracking_event(self, event_type, details):
-        """Ghi log sự kiện tracking"""
+        """Ghi log sự kiện tracking (bất đồng bộ qua log_writer)"""
         try:
-            from flask import current_app
-            with current_app.app_context():
-                device = Device.query.first()
-                log = Log(
-                    device_id=device.device_id if device else None,
-                    event_type=f'tracking_{event_type}',
-                    details=json.dumps(details) if isinstance(details, dict) else str(details)
-                )
-                db.session.add(log)
-                db.session.commit()
-        except RuntimeError:
-            # Không có application context, bỏ qua logging
-            pass
+            log_writer.submit(f'tracking_{event_type}', details)
         except Exception as e:
             print(f"Error logging tracking event: {e}")
     
@@ -253,4 +506,7 @@ class TrackingService:
         self.tracked_objects.clear()
         if self.tracker:
             self.tracker = DeepSort(max_age=Config.DEEPSORT_MAX_AGE)
+        self._frames_since_detection = None
+        self._last_detection_thumb = None
+        self.publish_track_changes()
         print("Tracking reset")
@@ -0,0 +1,57 @@
+import csv
+import io
+import tempfile
+
+
+def iter_csv(header, rows, chunk_rows=500):
+    """Sinh nội dung CSV theo từng khối (dùng làm body của Response streaming)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_xlsx(header, rows, title='Sheet', widths=None, spool_max_size=8 * 1024 * 1024):
+    """Ghi XLSX ở chế độ write-only vào file tạm (trong RAM tới spool_max_size, sau đó ra đĩa).
+
+    openpyxl's write-only workbook keeps no cell objects in memory, so
+    memory use does not grow with the number of rows. Column widths must
+    be set before the first row is written. Returns the file positioned
+    at 0; the caller closes it.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    ws = workbook.create_sheet(title)
+    if widths:
+        from openpyxl.utils import get_column_letter
+        for index, width in enumerate(widths, start=1):
+            ws.column_dimensions[get_column_letter(index)].width = width
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+
+    output = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def iter_file(fileobj, chunk_size=64 * 1024):
+    """Đọc file theo khối rồi đóng file (body của Response streaming)"""
+    try:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
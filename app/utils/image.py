@@ -0,0 +1,17 @@
+import cv2
+
+
+def resize_to_width(frame, width):
+    """Thu nhỏ frame về chiều rộng ``width`` (giữ tỉ lệ) để chạy detector.
+
+    Returns ``(resized, scale)`` where ``scale`` maps coordinates in the
+    resized image back to the original (original = resized * scale). Frames
+    already at or below ``width`` (or width <= 0) are returned unchanged with
+    scale 1.0.
+    """
+    h, w = frame.shape[:2]
+    if not width or width <= 0 or w <= width:
+        return frame, 1.0
+    scale = w / float(width)
+    resized = cv2.resize(frame, (int(width), int(round(h / scale))), interpolation=cv2.INTER_AREA)
+    return resized, scale
@@ -0,0 +1,84 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+NEXT = 'next'  # trang cũ hơn
+PREV = 'prev'  # trang mới hơn
+
+
+def encode_cursor(direction, timestamp, row_id):
+    """Cursor dạng chuỗi (base64 URL-safe) cho vị trí (timestamp, id)"""
+    raw = json.dumps([direction, timestamp.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(direction, timestamp, id) từ cursor; ValueError nếu cursor không hợp lệ"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if direction not in (NEXT, PREV):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def parse_limit(value, default, max_limit):
+    """Số dòng mỗi trang từ ``?limit=``; ValueError nếu không phải số nguyên trong [1, max_limit]"""
+    if value is None or value == '':
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= max_limit:
+        raise ValueError(f'limit must be between 1 and {max_limit}')
+    return limit
+
+
+def keyset_page(query, time_column, id_column, limit, cursor=None):
+    """Một trang kết quả, mới nhất trước, phân trang theo (time_column, id_column).
+
+    Instead of OFFSET, each page continues from the key of the last row
+    seen: ``(time, id) < (cursor_time, cursor_id)`` for older rows, ``>``
+    for newer ones. With an index on (time, id) every page costs the same
+    as the first one. ``query`` may already carry filters; rows must
+    expose the two key columns as attributes. Returns
+    ``(rows, next_cursor, prev_cursor)``; a cursor is None when there is
+    no page in that direction.
+    """
+    key = tuple_(time_column, id_column)
+    direction = None
+    if cursor:
+        direction, cursor_time, cursor_id = decode_cursor(cursor)
+
+    if direction == PREV:
+        query = query.filter(key > tuple_(cursor_time, cursor_id)).order_by(time_column.asc(), id_column.asc())
+    else:
+        if direction == NEXT:
+            query = query.filter(key < tuple_(cursor_time, cursor_id))
+        query = query.order_by(time_column.desc(), id_column.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == PREV:
+        rows.reverse()
+
+    def row_key(row):
+        return getattr(row, time_column.key), getattr(row, id_column.key)
+
+    if direction == PREV:
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = direction == NEXT, has_more
+
+    next_cursor = prev_cursor = None
+    if rows and has_older:
+        next_cursor = encode_cursor(NEXT, *row_key(rows[-1]))
+    if rows and has_newer:
+        prev_cursor = encode_cursor(PREV, *row_key(rows[0]))
+    return rows, next_cursor, prev_cursor
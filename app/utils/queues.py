@@ -0,0 +1,103 @@
+import threading
+from collections import deque
+
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+
+
+class BoundedQueue:
+    """Hàng đợi giới hạn kích thước với chính sách xử lý khi đầy.
+
+    Policies when the queue is full:
+      - 'drop_oldest': discard the oldest item to make room (keeps latest data)
+      - 'drop_newest': discard the incoming item
+      - 'block': wait up to ``timeout`` seconds for room, then drop the
+        incoming item (backpressure on the producer)
+    Counters for accepted / dropped items are kept for monitoring.
+    """
+
+    def __init__(self, maxsize=1, policy=DROP_OLDEST, name='queue'):
+        if policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError(f"Unknown drop policy: {policy}")
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.name = name
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.put_count = 0
+        self.get_count = 0
+        self.dropped = 0
+
+    def put(self, item, timeout=None):
+        """Thêm item; trả về False nếu item mới bị bỏ (queue đầy hoặc đã đóng)"""
+        with self._cond:
+            if self._closed:
+                return False
+            if len(self._items) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                elif self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                else:
+                    self._cond.wait_for(lambda: len(self._items) < self.maxsize or self._closed, timeout)
+                    if self._closed or len(self._items) >= self.maxsize:
+                        self.dropped += 1
+                        return False
+            self._items.append(item)
+            self.put_count += 1
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """Lấy item cũ nhất; trả về None khi hết thời gian chờ hoặc queue đã đóng và rỗng"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self.get_count += 1
+            self._cond.notify_all()
+            return item
+
+    def get_batch(self, max_items, timeout=None):
+        """Lấy tối đa max_items item (chờ tối đa timeout cho item đầu tiên)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            batch = []
+            while self._items and len(batch) < max_items:
+                batch.append(self._items.popleft())
+            self.get_count += len(batch)
+            if batch:
+                self._cond.notify_all()
+            return batch
+
+    def close(self):
+        """Đóng queue và đánh thức mọi thread đang chờ"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'name': self.name,
+                'depth': len(self._items),
+                'maxsize': self.maxsize,
+                'policy': self.policy,
+                'put': self.put_count,
+                'get': self.get_count,
+                'dropped': self.dropped
+            }
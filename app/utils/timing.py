@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import deque
+import numpy as np
+from config import Config
+
+
+# Stages of the frame path, in the order they run
+FRAME_STAGES = ('capture', 'yolo', 'deepsort', 'face_detect', 'embed', 'match',
+                'attendance', 'draw', 'display', 'frame')
+
+
+class _StageSpan:
+    """Context manager đo thời gian một stage"""
+
+    __slots__ = ('timer', 'stage', 'start')
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timer.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class StageTimer:
+    """Đo độ trễ từng stage của vòng lặp camera trên một cửa sổ trượt.
+
+    Each stage keeps its last ``window`` durations; ``stats`` reports
+    p50 / p95 / p99 / mean in milliseconds plus the frame rate derived from
+    ``tick`` timestamps. Recording is thread-safe so the capture, inference
+    and render threads can all report into one timer.
+    """
+
+    def __init__(self, window=None, enabled=None):
+        self.window = max(2, int(window or Config.LATENCY_WINDOW))
+        self.enabled = Config.LATENCY_INSTRUMENTATION if enabled is None else enabled
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = {}
+        self._ticks = deque(maxlen=self.window)
+        self._listeners = []
+
+    def measure(self, stage):
+        """Dùng với ``with``: ``with stage_timer.measure('yolo'): ...``"""
+        return _StageSpan(self, stage)
+
+    def record(self, stage, seconds):
+        """Ghi lại một lần đo (giây) cho stage"""
+        if not self.enabled:
+            return
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+                self._counts[stage] = 0
+            samples.append(seconds)
+            self._counts[stage] += 1
+        for listener in self._listeners:
+            try:
+                listener(stage, seconds)
+            except Exception:
+                pass
+
+    def add_listener(self, listener):
+        """Đăng ký callback(stage, seconds) nhận mọi lần đo (ví dụ để xuất metrics)"""
+        self._listeners.append(listener)
+
+    def tick(self):
+        """Đánh dấu một frame đã xử lý xong (dùng để tính FPS)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._ticks.append(time.perf_counter())
+
+    def fps(self):
+        with self._lock:
+            if len(self._ticks) < 2:
+                return 0.0
+            span = self._ticks[-1] - self._ticks[0]
+            return (len(self._ticks) - 1) / span if span > 0 else 0.0
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._ticks.clear()
+
+    def stats(self):
+        """p50 / p95 / p99 / mean (ms) cho từng stage và FPS"""
+        with self._lock:
+            snapshot = {stage: (list(samples), self._counts[stage]) for stage, samples in self._samples.items()}
+        stages = {}
+        ordered = [s for s in FRAME_STAGES if s in snapshot] + sorted(s for s in snapshot if s not in FRAME_STAGES)
+        for stage in ordered:
+            samples, count = snapshot[stage]
+            values = np.asarray(samples, dtype=np.float64) * 1000.0
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[stage] = {
+                'count': count,
+                'p50_ms': round(float(p50), 3),
+                'p95_ms': round(float(p95), 3),
+                'p99_ms': round(float(p99), 3),
+                'mean_ms': round(float(values.mean()), 3)
+            }
+        return {
+            'enabled': self.enabled,
+            'window': self.window,
+            'fps': round(self.fps(), 2),
+            'stages': stages
+        }
+
+
+# Shared timer for the camera loop and the services it calls
+stage_timer = StageTimer()
@@ -0,0 +1,113 @@
+import atexit
+import threading
+
+
+_workers = []
+_workers_lock = threading.Lock()
+_atexit_registered = False
+
+
+class BackgroundWorker:
+    """Khung chung cho các thread nền xử lý một BoundedQueue (log, attendance journal, đăng ký người).
+
+    Subclasses build ``self.queue`` in ``_new_queue`` and implement
+    ``_run``, which must return once the queue is closed and drained.
+    ``start`` is idempotent and reopens a closed queue; ``_on_start`` runs
+    before the thread starts (e.g. journal replay) and may return False to
+    leave the worker stopped. Every started worker
+    is stopped by one atexit hook, in ascending ``stop_order``: producers
+    stop first, so the workers they feed (the log writer, last) still
+    drain what was submitted during shutdown.
+
+    ``flush`` waits until every item queued before the call has been
+    processed; subclasses report progress with ``_mark_done``.
+    """
+
+    thread_name = 'worker'
+    stop_order = 0
+
+    def __init__(self):
+        self.queue = self._new_queue()
+        self.app = None
+        self._thread = None
+        self._done_cond = threading.Condition()
+        self._done = 0
+
+    def _new_queue(self):
+        raise NotImplementedError
+
+    def _run(self):
+        raise NotImplementedError
+
+    def _on_start(self, app):
+        return True
+
+    def _on_stop(self):
+        pass
+
+    def start(self, app):
+        """Gắn Flask app và khởi động thread nếu chưa chạy; trả về True nếu worker đang chạy"""
+        self.app = app
+        if self.running:
+            return True
+        if self.queue.closed:
+            self.queue = self._new_queue()
+            with self._done_cond:
+                self._done = 0
+        if self._on_start(app) is False:
+            return False
+        self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+        _register(self)
+        return True
+
+    def stop(self, timeout=5.0):
+        """Đóng queue, chờ thread xử lý nốt các item còn lại rồi dừng"""
+        self.queue.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._on_stop()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def flush(self, timeout=5.0):
+        """Chờ xử lý xong các item đã đưa vào queue; False nếu quá thời gian"""
+        queue = self.queue
+        target = queue.get_count + len(queue)
+
+        def flushed():
+            # Items dropped from a full queue are never processed: an empty,
+            # fully processed queue also counts as flushed
+            return self._done >= target or (len(queue) == 0 and self._done >= queue.get_count)
+
+        with self._done_cond:
+            return self._done_cond.wait_for(lambda: flushed() or not self.running, timeout) and flushed()
+
+    def _mark_done(self, count=1):
+        with self._done_cond:
+            self._done += count
+            self._done_cond.notify_all()
+
+
+def _register(worker):
+    global _atexit_registered
+    with _workers_lock:
+        if worker not in _workers:
+            _workers.append(worker)
+        if not _atexit_registered:
+            atexit.register(stop_workers)
+            _atexit_registered = True
+
+
+def stop_workers(timeout=5.0):
+    """Dừng mọi worker đã start theo ``stop_order`` (producer trước, log writer sau cùng)"""
+    with _workers_lock:
+        workers = sorted(_workers, key=lambda worker: worker.stop_order)
+    for worker in workers:
+        try:
+            worker.stop(timeout)
+        except Exception as e:
+            print(f"Error stopping {worker.thread_name}: {e}")
@@ -1,26 +1,85 @@
 import os
 from datetime import timedelta
 
+
+def sqlite_engine_options(uri):
+    """Tùy chọn engine SQLAlchemy cho SQLite file: busy timeout và pool cho 1 writer + nhiều reader"""
+    if not uri or not uri.startswith('sqlite:') or ':memory:' in uri or uri.rstrip('/') == 'sqlite:':
+        return {}
+    return {
+        'connect_args': {
+            'timeout': Config.SQLITE_BUSY_TIMEOUT,
+            # Connections are shared by the writer threads and Flask request threads
+            'check_same_thread': False
+        },
+        'pool_size': Config.DB_POOL_SIZE,
+        'max_overflow': Config.DB_MAX_OVERFLOW,
+        'pool_timeout': Config.DB_POOL_TIMEOUT,
+        'pool_pre_ping': False
+    }
+
+
 class Config:
     """Cấu hình chung cho hệ thống"""
     
     # Database
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or f'sqlite:///{os.path.join(os.path.dirname(os.path.abspath(__file__)), "database", "attendance.db")}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite tuning (áp dụng cho mỗi connection trong init_db)
+    SQLITE_JOURNAL_MODE = 'WAL'  # reader không bị chặn bởi writer
+    SQLITE_SYNCHRONOUS = 'NORMAL'  # an toàn với WAL, nhanh hơn FULL
+    SQLITE_CACHE_SIZE_KB = 20000  # page cache mỗi connection
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # bytes
+    SQLITE_BUSY_TIMEOUT = 10.0  # giây chờ khi database bị khóa
+    # Pool: 1 writer thread (journal / log) + các request thread đọc
+    DB_POOL_SIZE = 8
+    DB_MAX_OVERFLOW = 4
+    DB_POOL_TIMEOUT = 10  # giây chờ connection rảnh
+    # /api/stats: bộ đếm trong bộ nhớ, cập nhật theo các lần ghi
+    DB_STATS_CACHE_ENABLED = True
+    DB_STATS_MAX_AGE = 30.0  # giây; quá hạn thì đếm lại bằng COUNT(*)
     
     # Face Recognition
     KNOWN_FACES_DIR = 'known_faces'
     FACE_RECOGNITION_TOLERANCE = 0.4
     FACE_RECOGNITION_MODEL = 'hog'  # hoặc 'cnn' cho độ chính xác cao hơn hog
+    EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'auto')  # 'auto', 'facenet' hoặc 'histogram'
+    EMBEDDING_WARMUP_BATCH = 2  # số ảnh giả dùng để warm-up model khi khởi động
+    FACE_REFRESH_OVERLAP = 5.0  # giây; refresh đọc lại cả các Person cập nhật ngay trước watermark
+    
+    # Đăng ký người mới: encode ảnh trên worker thread (POST /api/persons/register trả về job id)
+    REGISTRATION_QUEUE_SIZE = 20  # số job chờ tối đa
+    REGISTRATION_JOB_HISTORY = 100  # số job đã xong được giữ lại để tra cứu trạng thái
     
     # Tracking
     YOLO_MODEL_PATH = 'yolov8n.pt'
     # YOLO_MODEL_PATH = 'person.pt'
-    DEEPSORT_MAX_AGE = 30
+    DEEPSORT_MAX_AGE = 30  # số lần detect (không tính frame chỉ dự đoán) track được phép mất trước khi bị xoá
     TRACKING_CONFIDENCE_THRESHOLD = 0.5
+    # Chạy YOLO mỗi N frame; các frame ở giữa chỉ dự đoán vị trí bằng Kalman filter
+    DETECTION_STRIDE = 3
+    DETECTION_ADAPTIVE = True  # detect sớm hơn khi có chuyển động hoặc track bất định
+    DETECTION_MOTION_THRESHOLD = 8.0  # chênh lệch xám trung bình so với lần detect trước
+    DETECTION_UNCERTAINTY_THRESHOLD = 0.2  # độ lệch vị trí Kalman / chiều cao bbox
+    # Cache danh tính theo track: track đã nhận diện chắc chắn bỏ qua embedding
+    TRACK_REVERIFY_INTERVAL = 30  # frame - nhận diện lại định kỳ
+    TRACK_CACHE_MIN_CONFIDENCE = 0.3  # dưới ngưỡng này luôn nhận diện lại
+    TRACK_REVERIFY_IOU = 0.5  # bbox thay đổi nhiều (IoU thấp hơn) thì nhận diện lại
+    RECOGNITION_BUDGET_PER_FRAME = 4  # số khuôn mặt tối đa được embedding mỗi frame (0 = không giới hạn)
+    # 'full': quét khuôn mặt trên toàn frame; 'tracks': chỉ quét phần trên bbox của các track
+    FACE_DETECTION_MODE = 'tracks'
+    FACE_REGION_TOP_FRACTION = 0.5  # tỉ lệ phần trên của bbox người được quét khuôn mặt
     
     # Attendance
     CHECKOUT_TIMEOUT = 10  # giây
+    # Write-behind: thay đổi attendance ghi vào journal rồi commit DB theo lô trên thread riêng
+    ATTENDANCE_JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database', 'attendance_journal.jsonl')
+    ATTENDANCE_JOURNAL_FSYNC = True  # fsync mỗi thay đổi (an toàn khi mất điện)
+    ATTENDANCE_QUEUE_SIZE = 10000
+    ATTENDANCE_BATCH_SIZE = 200  # số thay đổi tối đa mỗi transaction
+    ATTENDANCE_FLUSH_INTERVAL = 0.5  # giây
+    ATTENDANCE_FLUSH_TIMEOUT = 5.0  # giây chờ journal commit trước thao tác thủ công / xoá / export
+    ATTENDANCE_ID_BLOCK = 100  # số attendance_id journal giữ chỗ mỗi lần trong id_sequence
     UNKNOWN_PERSON_LABEL = 'Unknown'
     
     # Camera
@@ -28,25 +87,63 @@ class Config:
     CAMERA_WIDTH = 640
     CAMERA_HEIGHT = 480
     CAMERA_FPS = 30
+    # Độ rộng ảnh dùng cho detect người/khuôn mặt (0 = dùng độ phân giải gốc).
+    # Khuôn mặt vẫn được cắt từ frame gốc để tạo embedding.
+    DETECTION_WIDTH = 640
+    # Pipeline nhiều luồng (capture / inference / hiển thị) với queue giới hạn
+    PIPELINE_THREADED = True
+    PIPELINE_CAPTURE_QUEUE_SIZE = 1  # chỉ giữ frame mới nhất
+    PIPELINE_OUTPUT_QUEUE_SIZE = 2
+    PIPELINE_DROP_POLICY = 'drop_oldest'  # 'drop_oldest', 'drop_newest' hoặc 'block'
+    PIPELINE_MAX_CAPTURE_FAILURES = 30  # số lần đọc camera lỗi liên tiếp trước khi dừng
+    PIPELINE_UI_COMMAND_QUEUE_SIZE = 16  # lệnh từ phím / chuột chờ thread inference xử lý
+    # Cổng chuyển động: bỏ qua YOLO / khuôn mặt / DeepSORT khi cảnh trống và đứng yên
+    MOTION_GATE_ENABLED = True
+    MOTION_GATE_WIDTH = 160  # độ rộng ảnh xám dùng để so sánh frame
+    MOTION_GATE_PIXEL_THRESHOLD = 25  # chênh lệch mức xám để tính là pixel thay đổi
+    MOTION_GATE_MIN_AREA = 0.002  # tỉ lệ pixel thay đổi tối thiểu để đánh thức pipeline
+    MOTION_GATE_HOLD_FRAMES = 15  # số frame tiếp tục xử lý đầy đủ sau chuyển động cuối
+    # Đo độ trễ từng stage (capture, yolo, deepsort, face_detect, embed, match, attendance, draw, display)
+    LATENCY_INSTRUMENTATION = True
+    LATENCY_WINDOW = 300  # số lần đo gần nhất dùng để tính p50/p95/p99
+    LATENCY_OVERLAY = False  # vẽ độ trễ lên frame (bật/tắt bằng phím 'p')
+    
+    # Log writer: ghi bảng Log theo lô trên thread riêng
+    LOG_QUEUE_SIZE = 1000
+    LOG_QUEUE_POLICY = 'drop_oldest'  # 'drop_oldest', 'drop_newest' hoặc 'block'
+    LOG_QUEUE_PUT_TIMEOUT = 0.05  # giây chờ tối đa khi policy = 'block'
+    LOG_BATCH_SIZE = 100  # số log tối đa mỗi transaction
+    LOG_FLUSH_INTERVAL = 1.0  # giây
     
     # API
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     API_HOST = '0.0.0.0'
     API_PORT = 5000
     DEBUG = True
+    PAGINATION_MAX_LIMIT = 1000  # số dòng tối đa mỗi trang (/api/attendance, /api/logs)
     
     # Logging
     LOG_LEVEL = 'INFO'
     LOG_FILE = 'logs/system.log'
     
+    # Export attendance (CSV / Excel) cho khoảng thời gian lớn
+    EXPORT_CHUNK_SIZE = 1000  # số dòng đọc từ DB mỗi lần
+    EXPORT_SPOOL_MAX_SIZE = 8 * 1024 * 1024  # bytes; file Excel lớn hơn được ghi ra file tạm trên đĩa
+    
     # Dashboard
     DASHBOARD_REFRESH_INTERVAL = 5000  # milliseconds
+    # Server-Sent Events (/api/events): đẩy thay đổi tới dashboard thay vì polling
+    SSE_CLIENT_QUEUE_SIZE = 100  # số sự kiện tối đa chờ gửi mỗi client (bỏ cũ nhất khi đầy)
+    SSE_HEARTBEAT = 15.0  # giây giữa các dòng keep-alive
+    SSE_RETRY_MS = 3000  # thời gian chờ trước khi EventSource kết nối lại
     
     @staticmethod
     def init_app(app):
         """Khởi tạo ứng dụng với cấu hình"""
         pass
 
+Config.SQLALCHEMY_ENGINE_OPTIONS = sqlite_engine_options(Config.SQLALCHEMY_DATABASE_URI)
+
 class DevelopmentConfig(Config):
     """Cấu hình cho môi trường phát triển"""
     DEBUG = True
@@ -60,6 +157,7 @@ class ProductionConfig(Config):
     
     # Local database
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or f'sqlite:///{os.path.join(os.path.dirname(os.path.abspath(__file__)), "database", "attendance.db")}'
+    SQLALCHEMY_ENGINE_OPTIONS = sqlite_engine_options(SQLALCHEMY_DATABASE_URI)
     
     # Local API settings
     API_HOST = '127.0.0.1'
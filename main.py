@@ -14,16 +14,23 @@ from app.models.database import db, init_db, Person
 from app.services.face_recognition import FaceRecognitionService
 from app.services.tracking import TrackingService
 from app.services.attendance import AttendanceService
+from app.services.frame_analysis import FrameAnalyzer
+from app.services.pipeline import CameraPipeline
+from app.utils.timing import stage_timer
+from app.utils.queues import BoundedQueue, DROP_NEWEST
+from app.utils.workers import stop_workers
 from app.api.routes import create_app
 
 class FaceTrackingSystem:
     """Hệ thống nhận diện và tracking người chính"""
     
-    def __init__(self, face_service=None, tracking_service=None, attendance_service=None):
+    def __init__(self, face_service=None, tracking_service=None, attendance_service=None, motion_gate=None):
         # Allow injecting services (useful when running API + camera in same process)
         self.face_service = face_service or FaceRecognitionService()
         self.tracking_service = tracking_service or TrackingService()
         self.attendance_service = attendance_service or AttendanceService()
+        self.analyzer = FrameAnalyzer(self.face_service, self.tracking_service, motion_gate)
+        self.motion_gate = self.analyzer.motion_gate
         self.checkbox_states = {
             'check_in': False,
             'check_out': False
@@ -34,8 +41,14 @@ class FaceTrackingSystem:
         self.last_display_frame = None
         self.last_tracking_results = []
         self.camera = None
+        self.pipeline = None
         self.running = False
         self.frame_count = 0
+        self.show_latency = Config.LATENCY_OVERLAY
+        # Key / mouse commands that touch tracking or attendance state run on
+        # the inference thread between frames, so the UI thread never waits
+        # for a frame to finish
+        self.ui_commands = BoundedQueue(Config.PIPELINE_UI_COMMAND_QUEUE_SIZE, DROP_NEWEST, 'ui_commands')
         
     def initialize_camera(self):
         """Khởi tạo camera"""
@@ -59,42 +72,49 @@ class FaceTrackingSystem:
     
     def process_frame(self, frame):
         """Xử lý một frame"""
+        self.run_ui_commands()
+        with stage_timer.measure('frame'):
+            output = self._process_frame(frame)
+        stage_timer.tick()
+        return output
+
+    def _process_frame(self, frame):
         self.frame_count += 1
         
-        # Nhận diện khuôn mặt
-        face_results = self.face_service.recognize_faces_in_frame(frame)
-        
-        # Tracking người
-        tracking_results = self.tracking_service.process_frame(frame, self.face_service)
+        # Nhận diện khuôn mặt + tracking người (chạy một lần, dùng chung kết quả)
+        ctx = self.analyzer.analyze(frame)
+        face_results = ctx.face_results
+        tracking_results = ctx.tracking_results
         
         # Xử lý attendance
-        active_track_ids = [result['track_id'] for result in tracking_results]
-        self.attendance_service.check_timeout_attendances(active_track_ids)
-        
-        # Log time_in cho các track mới
-        for result in tracking_results:
-            track_id = result['track_id']
-            person_id = result['person_id']
-            name = result['name']
+        with stage_timer.measure('attendance'):
+            self.attendance_service.check_timeout_attendances(ctx.active_track_ids)
             
-            if track_id in self.attendance_service.active_attendances:
-                # If an active attendance exists but person info was previously unknown
-                # and now we've recognized the person, update the active attendance
-                try:
-                    if person_id is not None and person_id != self.attendance_service.active_attendances[track_id].get('person_id'):
-                        self.attendance_service.update_active_attendance(track_id, person_id=person_id, person_name=name)
-                    elif name and name != self.attendance_service.active_attendances[track_id].get('person_name'):
-                        self.attendance_service.update_active_attendance(track_id, person_id=person_id, person_name=name)
-                except Exception:
-                    pass
+            # Log time_in cho các track mới
+            for result in tracking_results:
+                track_id = result['track_id']
+                person_id = result['person_id']
+                name = result['name']
+                
+                if track_id in self.attendance_service.active_attendances:
+                    # If an active attendance exists but person info was previously unknown
+                    # and now we've recognized the person, update the active attendance
+                    try:
+                        if person_id is not None and person_id != self.attendance_service.active_attendances[track_id].get('person_id'):
+                            self.attendance_service.update_active_attendance(track_id, person_id=person_id, person_name=name)
+                        elif name and name != self.attendance_service.active_attendances[track_id].get('person_name'):
+                            self.attendance_service.update_active_attendance(track_id, person_id=person_id, person_name=name)
+                    except Exception:
+                        pass
         
         # Vẽ kết quả lên frame
-        frame = self.face_service.draw_face_boxes(frame, face_results)
-        frame = self.tracking_service.draw_tracking_boxes(frame, tracking_results)
-        
-        # Thêm thông tin hệ thống
-        self.draw_system_info(frame, tracking_results)
-        self.draw_ui_controls(frame)
+        with stage_timer.measure('draw'):
+            frame = self.face_service.draw_face_boxes(frame, face_results)
+            frame = self.tracking_service.draw_tracking_boxes(frame, tracking_results)
+            
+            # Thêm thông tin hệ thống
+            self.draw_system_info(frame, tracking_results)
+            self.draw_ui_controls(frame)
         self.last_tracking_results = tracking_results
         try:
             self.last_display_frame = frame.copy()
@@ -112,6 +132,19 @@ class FaceTrackingSystem:
             f"Active Attendances: {len(self.attendance_service.active_attendances)}",
             f"Time: {datetime.now().strftime('%H:%M:%S')}"
         ]
+        if self.motion_gate.enabled:
+            gate = self.motion_gate.stats()
+            info_text.append(f"Motion gate: {gate['state']} (wake-ups {gate['wake_ups']}, idle {gate['idle_seconds']:.0f}s)")
+        if self.pipeline is not None:
+            stats = self.pipeline.stats()
+            info_text.append(
+                f"Dropped: capture {stats['capture']['queue']['dropped']} / output {stats['inference']['queue']['dropped']}"
+            )
+        if self.show_latency:
+            latency = stage_timer.stats()
+            info_text.append(f"FPS: {latency['fps']:.1f}")
+            for stage, values in latency['stages'].items():
+                info_text.append(f"{stage}: p50 {values['p50_ms']:.1f} / p95 {values['p95_ms']:.1f} ms")
         
         y_offset = 30
         for text in info_text:
@@ -189,8 +222,23 @@ class FaceTrackingSystem:
             self.checkbox_states[key] = False
         print(f"{key.replace('_', ' ').title()}: {self.checkbox_states[key]}")
     
+    def run_ui_commands(self):
+        """Chạy các lệnh từ phím / chuột đang chờ (trên thread inference, giữa hai frame)"""
+        while True:
+            command = self.ui_commands.get(timeout=0)
+            if command is None:
+                return
+            try:
+                command()
+            except Exception as e:
+                print(f"UI command failed: {e}")
+
     def capture_frame(self):
         """Xác nhận hành động hiện tại"""
+        if not self.ui_commands.put(self._capture_frame):
+            print("Too many pending commands, confirmation ignored")
+
+    def _capture_frame(self):
         if self.last_display_frame is None:
             print("No frame available to confirm")
             return
@@ -304,8 +352,18 @@ class FaceTrackingSystem:
         """Vòng lặp chính của camera"""
         print("Starting camera loop...")
         
+        if Config.PIPELINE_THREADED:
+            self.run_pipeline_loop()
+        else:
+            self.run_serial_loop()
+        
+        print("Camera loop ended")
+
+    def run_serial_loop(self):
+        """Đọc, xử lý và hiển thị tuần tự trên một thread"""
         while self.running:
-            ret, frame = self.camera.read()
+            with stage_timer.measure('capture'):
+                ret, frame = self.camera.read()
             if not ret:
                 print("Failed to read frame from camera")
                 break
@@ -315,32 +373,62 @@ class FaceTrackingSystem:
                 processed_frame, tracking_results = self.process_frame(frame)
                 
                 # Hiển thị frame
-                cv2.imshow(self.window_name, processed_frame)
+                with stage_timer.measure('display'):
+                    cv2.imshow(self.window_name, processed_frame)
+                    key = cv2.waitKey(1) & 0xFF
                 
-                # Kiểm tra phím thoát
-                key = cv2.waitKey(1) & 0xFF
-                if key == ord('q'):
-                    print("Quit key pressed")
+                # Kiểm tra phím
+                if not self.handle_key(key):
                     break
-                elif key == ord('r'):
-                    print("Reset tracking")
-                    self.tracking_service.reset_tracking()
-                    self.attendance_service.active_attendances.clear()
-                elif key == ord('i'):
-                    new_state = not self.checkbox_states['check_in']
-                    self.set_checkbox_state('check_in', new_state)
-                elif key == ord('o'):
-                    new_state = not self.checkbox_states['check_out']
-                    self.set_checkbox_state('check_out', new_state)
-                elif key == ord('c'):
-                    self.capture_frame()
                 
             except Exception as e:
                 print(f"Error processing frame: {e}")
                 continue
-        
-        print("Camera loop ended")
+
+    def run_pipeline_loop(self):
+        """Capture và inference chạy trên thread riêng; thread chính chỉ hiển thị và xử lý phím"""
+        self.pipeline = CameraPipeline(self.camera, self.process_frame)
+        self.pipeline.start()
+        try:
+            while self.running and (self.pipeline.running or len(self.pipeline.output_queue) > 0):
+                output = self.pipeline.get_output(timeout=0.05)
+                if output is not None:
+                    processed_frame, tracking_results = output
+                    with stage_timer.measure('display'):
+                        cv2.imshow(self.window_name, processed_frame)
+                
+                # Kiểm tra phím
+                if not self.handle_key(cv2.waitKey(1) & 0xFF):
+                    break
+        finally:
+            self.pipeline.stop()
+
+    def handle_key(self, key):
+        """Xử lý phím bấm; trả về False nếu cần thoát"""
+        if key == ord('q'):
+            print("Quit key pressed")
+            return False
+        elif key == ord('r'):
+            print("Reset tracking")
+            self.ui_commands.put(self.reset_tracking)
+        elif key == ord('i'):
+            new_state = not self.checkbox_states['check_in']
+            self.set_checkbox_state('check_in', new_state)
+        elif key == ord('o'):
+            new_state = not self.checkbox_states['check_out']
+            self.set_checkbox_state('check_out', new_state)
+        elif key == ord('c'):
+            self.capture_frame()
+        elif key == ord('p'):
+            self.show_latency = not self.show_latency
+        return True
     
+    def reset_tracking(self):
+        """Xoá trạng thái tracking, điểm danh đang mở và cổng chuyển động"""
+        self.tracking_service.reset_tracking()
+        self.attendance_service.active_attendances.clear()
+        self.motion_gate.reset()
+
     def start(self):
         """Khởi động hệ thống"""
         print("Starting Face Tracking System...")
@@ -417,11 +505,13 @@ def main():
         face_service = getattr(app, 'face_service', None)
         tracking_service = getattr(app, 'tracking_service', None)
         attendance_service = getattr(app, 'attendance_service', None)
+        motion_gate = getattr(app, 'motion_gate', None)
 
         system = FaceTrackingSystem(
             face_service=face_service,
             tracking_service=tracking_service,
-            attendance_service=attendance_service
+            attendance_service=attendance_service,
+            motion_gate=motion_gate
         )
 
         try:
@@ -447,6 +537,9 @@ def main():
         if 'system' in locals():
             system.stop()
         
+        # Ghi nốt attendance và log đang chờ (log writer dừng sau cùng)
+        stop_workers()
+        
         # Dừng API server nếu có endpoint shutdown
         try:
             import requests
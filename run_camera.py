@@ -19,7 +19,9 @@ from app.models.database import db, init_db
 from app.services.face_recognition import FaceRecognitionService
 from app.services.tracking import TrackingService
 from app.services.attendance import AttendanceService
+from app.services.frame_analysis import FrameAnalyzer
 from app.api.routes import create_app
+from app.utils.timing import stage_timer
 
 def run_camera_system():
     """Chạy hệ thống camera với nhận diện và tracking"""
@@ -41,9 +43,13 @@ def run_camera_system():
     face_service = app.face_service
     tracking_service = app.tracking_service
     attendance_service = app.attendance_service
+    analyzer = FrameAnalyzer(face_service, tracking_service, app.motion_gate)
     
     print(f"Loaded {len(face_service.known_face_encodings)} known faces")
     print(f"Encoding dimension: {face_service.encoding_dim}")
+    backend_info = face_service.backend_info
+    print(f"Embedding backend: {backend_info.get('backend')} on {backend_info.get('device')} "
+          f"(load {backend_info.get('load_seconds', 0):.2f}s, warm-up {backend_info.get('warmup_seconds', 0):.2f}s)")
     print(f"Recognition threshold: {Config.FACE_RECOGNITION_TOLERANCE}")
     print("Press 'r' to reset tracking, 'l' to reload face encodings, 'q' to quit")
     
@@ -64,22 +70,22 @@ def run_camera_system():
     
     try:
         while running:
-            ret, frame = camera.read()
+            with stage_timer.measure('capture'):
+                ret, frame = camera.read()
             if not ret:
                 print("Failed to read frame from camera")
                 break
             
             frame_count += 1
             
-            # Nhận diện khuôn mặt
-            face_results = face_service.recognize_faces_in_frame(frame)
-            
-            # Tracking người
-            tracking_results = tracking_service.process_frame(frame, face_service)
+            # Nhận diện khuôn mặt + tracking người (chạy một lần, dùng chung kết quả)
+            frame_start = time.perf_counter()
+            ctx = analyzer.analyze(frame)
+            face_results = ctx.face_results
+            tracking_results = ctx.tracking_results
             
             # Xử lý attendance
-            active_track_ids = [result['track_id'] for result in tracking_results]
-            attendance_service.check_timeout_attendances(active_track_ids)
+            attendance_service.check_timeout_attendances(ctx.active_track_ids)
             
             # Log time_in cho các track mới
             for result in tracking_results:
@@ -118,11 +124,15 @@ def run_camera_system():
                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
                 y_offset += 25
             
-            # Hiển thị frame
-            cv2.imshow('Face Tracking System', frame)
+            stage_timer.record('frame', time.perf_counter() - frame_start)
+            stage_timer.tick()
             
-            # Kiểm tra phím thoát
-            key = cv2.waitKey(1) & 0xFF
+            # Hiển thị frame
+            with stage_timer.measure('display'):
+                cv2.imshow('Face Tracking System', frame)
+                
+                # Kiểm tra phím thoát
+                key = cv2.waitKey(1) & 0xFF
             if key == ord('q'):
                 print("Quit key pressed")
                 break
@@ -130,14 +140,15 @@ def run_camera_system():
                 print("Reset tracking")
                 tracking_service.reset_tracking()
                 attendance_service.active_attendances.clear()
+                analyzer.motion_gate.reset()
             elif key == ord('l'):
                 print("Reloading face encodings...")
-                face_service.load_known_faces()
+                face_service.refresh_known_faces()
                 print(f"Reloaded {len(face_service.known_face_encodings)} known faces")
             
             # Print results every 30 frames
             if frame_count % 30 == 0 and face_results:
-                print(f"Frame {frame_count}: Found {len(face_results)} faces")
+                print(f"Frame {frame_count}: Found {len(face_results)} faces ({stage_timer.fps():.1f} fps)")
                 for result in face_results:
                     print(f"  - {result['name']} (confidence: {result['confidence']:.3f})")
     
@@ -0,0 +1,93 @@
+"""Benchmark per-face embedding latency: one forward pass per face versus
+one batched forward pass per frame.
+
+Face crops are taken from the images in `known_faces/` and repeated to fill
+batches of 1, 4 and 16 faces. The embedding model runs on CPU so results are
+comparable across machines.
+
+Run from project root:
+  python tools/benchmark_embedding.py [--repeats 10]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+# Ensure project root is importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import Config
+from app.services.face_recognition import FaceRecognitionService
+
+
+BATCH_SIZES = (1, 4, 16)
+
+
+def collect_face_rois(fr):
+    """Detect one face ROI per image in known_faces/"""
+    rois = []
+    known_dir = os.path.join(ROOT, Config.KNOWN_FACES_DIR)
+    for fn in sorted(os.listdir(known_dir)):
+        if not fn.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        image = cv2.imread(os.path.join(known_dir, fn))
+        if image is None:
+            continue
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        faces = fr.face_cascade.detectMultiScale(gray, 1.1, 4)
+        if len(faces) == 0:
+            continue
+        x, y, w, h = faces[0]
+        rois.append(gray[y:y+h, x:x+w])
+    return rois
+
+
+def time_call(fn, repeats):
+    """Return the median wall time of fn() in seconds"""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    fr = FaceRecognitionService()
+    # Force CPU so numbers are comparable
+    fr._embedding_device = 'cpu'
+    if fr._embedding_model is not None:
+        fr._embedding_model.to('cpu')
+
+    rois = collect_face_rois(fr)
+    if not rois:
+        print('No faces found in known_faces/. Add some images first.')
+        return
+
+    # Warm up the first forward pass on CPU
+    fr.encode_faces(rois[:1])
+    print(f"Embedding backend: {fr.backend_info.get('backend')} (device: cpu)")
+
+    print(f"\n{'batch':>6} {'per-face loop (ms/face)':>26} {'batched (ms/face)':>20} {'speedup':>9}")
+    for batch_size in BATCH_SIZES:
+        batch = [rois[i % len(rois)] for i in range(batch_size)]
+        loop_s = time_call(lambda: [fr.encode_faces([roi]) for roi in batch], args.repeats)
+        batched_s = time_call(lambda: fr.encode_faces(batch), args.repeats)
+        loop_ms = loop_s * 1000.0 / batch_size
+        batched_ms = batched_s * 1000.0 / batch_size
+        speedup = loop_ms / batched_ms if batched_ms > 0 else float('inf')
+        print(f'{batch_size:>6} {loop_ms:>26.2f} {batched_ms:>20.2f} {speedup:>8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Benchmark the multi-resolution pipeline: FPS versus recognition distance
+for 720p and 1080p inputs at several detection widths.
+
+Synthetic frames are built by placing each image from `known_faces/` on a
+720p / 1080p canvas. Person and face detection run on a copy downscaled to
+the detection width, while embeddings are computed from the native frame.
+Track re-verification is forced on every frame, so FPS includes one
+embedding per frame. Faces are scanned on the whole (downscaled) frame
+because the samples are portraits rather than full bodies. Distance is
+measured between each embedding and the centroid of the person in the
+image (lower is better).
+
+Run from project root:
+  python tools/benchmark_multires.py [--frames 30]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+# Ensure project root is importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import Config
+from app.services.face_recognition import FaceRecognitionService
+from app.services.tracking import TrackingService
+from app.services.frame_analysis import FrameAnalyzer
+
+
+INPUT_SIZES = {'720p': (1280, 720), '1080p': (1920, 1080)}
+DETECTION_WIDTHS = (0, 960, 640, 480)
+
+
+def build_frame(image, size, person_height=0.6):
+    """Place an image on a gray canvas of the given (width, height)"""
+    width, height = size
+    canvas = np.full((height, width, 3), 90, dtype=np.uint8)
+    h, w = image.shape[:2]
+    scale = (height * person_height) / float(h)
+    resized = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))))
+    rh, rw = resized.shape[:2]
+    top = (height - rh) // 2
+    left = (width - rw) // 2
+    canvas[top:top + rh, left:left + rw] = resized
+    return canvas
+
+
+def load_samples():
+    samples = []
+    known_dir = os.path.join(ROOT, Config.KNOWN_FACES_DIR)
+    for fn in sorted(os.listdir(known_dir)):
+        if not fn.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        image = cv2.imread(os.path.join(known_dir, fn))
+        if image is not None:
+            samples.append((os.path.splitext(fn)[0], image))
+    return samples
+
+
+def run(fr, samples, size, detection_width, n_frames):
+    """Return (fps, mean distance to expected centroid, recognized ratio)"""
+    Config.DETECTION_WIDTH = detection_width
+    distances = []
+    recognized = 0
+    total_frames = 0
+    elapsed = 0.0
+
+    for expected, image in samples:
+        frame = build_frame(image, size)
+        analyzer = FrameAnalyzer(fr, TrackingService())
+        centroid = fr.centroids.get(expected)
+        for _ in range(n_frames):
+            start = time.perf_counter()
+            ctx = analyzer.analyze(frame)
+            elapsed += time.perf_counter() - start
+            total_frames += 1
+            for result in ctx.face_results:
+                if result.get('face_encoding') is None:
+                    continue
+                if result['name'] == expected:
+                    recognized += 1
+                if centroid is not None:
+                    distances.append(float(np.linalg.norm(np.asarray(result['face_encoding']) - centroid)))
+
+    fps = total_frames / elapsed if elapsed > 0 else 0.0
+    mean_distance = float(np.mean(distances)) if distances else float('nan')
+    return fps, mean_distance, recognized / float(total_frames or 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=30, help='frames per sample image')
+    args = parser.parse_args()
+
+    fr = FaceRecognitionService()
+    samples = load_samples()
+    if not samples:
+        print('No images found in known_faces/.')
+        return
+
+    # Embed on every frame so the distance column reflects every input size
+    Config.TRACK_REVERIFY_INTERVAL = 1
+    # Sample images are portraits, not full bodies: scan the whole frame for faces
+    Config.FACE_DETECTION_MODE = 'full'
+    # Frames are static: keep the motion gate from idling the pipeline
+    Config.MOTION_GATE_ENABLED = False
+
+    print(f"Embedding backend: {fr.backend_info.get('backend')}, samples: {len(samples)}")
+    print(f"\n{'input':>6} {'detect width':>13} {'fps':>8} {'mean distance':>14} {'recognized':>11}")
+    for label, size in INPUT_SIZES.items():
+        for detection_width in DETECTION_WIDTHS:
+            fps, distance, ratio = run(fr, samples, size, detection_width, args.frames)
+            width_label = 'native' if detection_width <= 0 else str(detection_width)
+            print(f'{label:>6} {width_label:>13} {fps:>8.1f} {distance:>14.4f} {ratio:>10.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Benchmark concurrent SQLite write + read throughput, before and after the
+tuning profile (WAL, synchronous=NORMAL, cache/mmap size, busy timeout,
+pooled connections).
+
+Each run uses a fresh database file with the application tables. One
+writer thread inserts and closes Attendance rows and Log rows with one
+commit per change (the legacy per-event pattern). Several reader threads
+run the dashboard queries (daily stats, recent attendance, recent logs).
+The run reports writes/s, reads/s, read latency p95, and how many
+operations failed with "database is locked".
+
+Run from project root:
+  python tools/benchmark_sqlite.py [--seconds 10] [--readers 4]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import OperationalError
+
+# Ensure project root is importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import sqlite_engine_options
+from app.models.database import db, Attendance, Log, Person, Device, configure_sqlite
+
+
+def make_engine(path, tuned):
+    url = f'sqlite:///{path}'
+    if not tuned:
+        return create_engine(url, connect_args={'check_same_thread': False})
+    engine = create_engine(url, **sqlite_engine_options(url))
+    configure_sqlite(engine)
+    return engine
+
+
+def seed(Session, persons=50):
+    session = Session()
+    session.add(Device(name='Main Camera', location='Bench', status='Active'))
+    for i in range(persons):
+        session.add(Person(name=f'Person_{i}', role='user'))
+    session.commit()
+    session.close()
+
+
+def writer(Session, stop, counters):
+    session = Session()
+    i = 0
+    while not stop.is_set():
+        try:
+            attendance = Attendance(person_id=(i % 50) + 1, track_id=str(i), time_in=datetime.now(), status='Present')
+            session.add(attendance)
+            session.commit()
+            session.add(Log(device_id=1, event_type='attendance_time_in', details='{}'))
+            session.commit()
+            attendance.time_out = datetime.now()
+            session.commit()
+            counters['writes'] += 3
+        except OperationalError:
+            session.rollback()
+            counters['locked'] += 1
+        i += 1
+    session.close()
+
+
+def reader(Session, stop, counters, latencies):
+    session = Session()
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            session.query(func.count(Attendance.attendance_id)).filter(
+                Attendance.time_in >= today, Attendance.time_in < today + timedelta(days=1)).scalar()
+            session.query(Attendance).order_by(Attendance.time_in.desc()).limit(20).all()
+            session.query(Log).order_by(Log.timestamp.desc()).limit(50).all()
+            session.commit()
+            counters['reads'] += 1
+            latencies.append(time.perf_counter() - start)
+        except OperationalError:
+            session.rollback()
+            counters['locked'] += 1
+    session.close()
+
+
+def run(tuned, seconds, readers):
+    directory = tempfile.mkdtemp(prefix='sqlite_bench_')
+    path = os.path.join(directory, 'bench.db')
+    engine = make_engine(path, tuned)
+    db.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    seed(Session)
+
+    stop = threading.Event()
+    counters = {'writes': 0, 'reads': 0, 'locked': 0}
+    latencies = []
+    threads = [threading.Thread(target=writer, args=(Session, stop, counters))]
+    threads += [threading.Thread(target=reader, args=(Session, stop, counters, latencies)) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    p95 = float(np.percentile(latencies, 95)) * 1000 if latencies else float('nan')
+    return counters['writes'] / seconds, counters['reads'] / seconds, p95, counters['locked']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10.0, help='duration of each run')
+    parser.add_argument('--readers', type=int, default=4, help='concurrent reader threads')
+    args = parser.parse_args()
+
+    print(f"{'profile':>8} {'writes/s':>10} {'reads/s':>10} {'read p95 ms':>12} {'locked':>7}")
+    for label, tuned in (('default', False), ('tuned', True)):
+        writes, reads, p95, locked = run(tuned, args.seconds, args.readers)
+        print(f'{label:>8} {writes:>10.1f} {reads:>10.1f} {p95:>12.2f} {locked:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Check that list endpoints and exports run a fixed number of SQL queries,
+whatever the number of rows they return (no N+1 lazy loads).
+
+A throwaway SQLite database is seeded with persons, attendances and logs.
+Each endpoint is requested with a small and a large page, and the SQL
+statements executed by the request thread are counted. The check fails
+(exit code 1) if the count differs from the expected budget or grows with
+the number of rows.
+
+Run from project root:
+  python tools/check_query_counts.py [--rows 2000]
+"""
+
+import os
+import sys
+import tempfile
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+# Throwaway database: must be set before config is imported
+DB_DIR = tempfile.mkdtemp(prefix='query_counts_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DB_DIR, 'check.db')}"
+
+# Ensure project root is importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from sqlalchemy import event
+
+from config import Config
+Config.ATTENDANCE_JOURNAL_PATH = os.path.join(DB_DIR, 'attendance_journal.jsonl')
+
+from app.api.routes import create_app
+from app.models.database import db, Person, Attendance, Log, Device
+
+
+# (url, expected queries per request); {limit} is filled with a small and a large page size
+CHECKS = [
+    ('/api/attendance?limit={limit}', 1),
+    ('/api/attendance?limit={limit}&person_id=1', 1),
+    ('/api/logs?limit={limit}', 1),
+    ('/api/logs?limit={limit}&event_type=attendance', 2),
+    ('/api/export/attendance?format=json', 1),
+    ('/api/export/attendance?format=csv', 1),
+    ('/api/export/attendance?format=excel', 1),
+    ('/api/persons/attendance-summary', 1),
+]
+
+
+def seed(rows):
+    device = Device.query.first()
+    persons = [Person(name=f'Person_{i}', role='user') for i in range(20)]
+    db.session.add_all(persons)
+    db.session.flush()
+    now = datetime.now()
+    for i in range(rows):
+        time_in = now - timedelta(minutes=5 * i)
+        db.session.add(Attendance(
+            person_id=persons[i % len(persons)].person_id if i % 7 else None,
+            track_id=str(i), time_in=time_in,
+            time_out=time_in + timedelta(minutes=3) if i % 5 else None,
+            status='Present'
+        ))
+        db.session.add(Log(device_id=device.device_id if i % 3 else None,
+                           event_type='attendance_time_in' if i % 2 else 'tracking_track_lost',
+                           timestamp=time_in, details='{}'))
+    db.session.commit()
+
+
+class QueryCounter:
+    """Đếm số câu SQL do thread hiện tại thực thi"""
+
+    def __init__(self, engine):
+        self.thread_id = threading.get_ident()
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Background writer threads (log / attendance journal) are ignored
+        if threading.get_ident() == self.thread_id:
+            self.count += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000, help='attendance and log rows to seed')
+    args = parser.parse_args()
+
+    app = create_app()
+    client = app.test_client()
+    with app.app_context():
+        seed(args.rows)
+        counter = QueryCounter(db.engine)
+
+    failures = 0
+    for url, expected in CHECKS:
+        counts = []
+        for limit in (10, 1000):
+            counter.count = 0
+            response = client.get(url.format(limit=limit))
+            response.get_data()  # consume streamed bodies inside the count
+            counts.append(counter.count)
+            if response.status_code != 200:
+                print(f'FAIL {url}: HTTP {response.status_code}')
+                failures += 1
+        ok = all(count == expected for count in counts)
+        failures += 0 if ok else 1
+        print(f"{'ok  ' if ok else 'FAIL'} {url.replace('{limit}', 'N')}: {counts[0]} / {counts[1]} queries (expected {expected})")
+
+    app.attendance_service.journal.stop()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@ def clear_database():
     
     with app.app_context():
         from app.models.database import Person, Attendance, Log, Device, db
+        from app.services.attendance_rollup import clear_rollup
         
         print("Current database contents:")
         
@@ -50,6 +51,7 @@ def clear_database():
             
             # Delete attendances first (has foreign key to persons)
             deleted_attendances = db.session.query(Attendance).delete()
+            clear_rollup()
             print(f"  Deleted {deleted_attendances} attendances")
             
             # Delete logs
@@ -0,0 +1,72 @@
+"""Print EXPLAIN QUERY PLAN for the main endpoint queries, to confirm the
+indexes declared in app/models/database.py are used.
+
+Runs init_db first, so an existing database is migrated (missing indexes
+are created) before the plans are printed. A plan line containing
+"SCAN <table>" without an index means a full table scan.
+
+Run from project root:
+  python tools/explain_queries.py
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+# Ensure project root is importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from config import config
+from app.models.database import db, init_db, Person, Attendance, Log
+
+
+def build_queries():
+    """(label, SQLAlchemy query) pairs mirroring the endpoint / service queries"""
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    tomorrow = today + timedelta(days=1)
+    return [
+        ('check-in: open attendance of person',
+         Attendance.query.filter(Attendance.person_id == 1, Attendance.time_out.is_(None))),
+        ('person lookup by name',
+         Person.query.filter_by(name='Someone')),
+        ('/api/attendance/stats: attendances of the day',
+         Attendance.query.filter(Attendance.time_in >= today, Attendance.time_in < tomorrow)),
+        ('attendance summary: person over 30 days',
+         Attendance.query.filter(Attendance.person_id == 1, Attendance.time_in >= today - timedelta(days=30),
+                                 Attendance.time_in <= tomorrow)),
+        ('/api/attendance: latest attendances',
+         db.session.query(Attendance.attendance_id, Person.name)
+         .outerjoin(Person, Attendance.person_id == Person.person_id)
+         .order_by(Attendance.time_in.desc()).limit(20)),
+        ('/api/export/attendance: date range',
+         Attendance.query.filter(Attendance.time_in >= today - timedelta(days=7), Attendance.time_in <= tomorrow)
+         .order_by(Attendance.time_in.desc())),
+        ('/api/logs: latest logs',
+         Log.query.order_by(Log.timestamp.desc()).limit(100)),
+        ('/api/logs: filtered by event type',
+         Log.query.filter(Log.event_type.in_(['attendance_time_in', 'attendance_time_out']))
+         .order_by(Log.timestamp.desc()).limit(100)),
+    ]
+
+
+def main():
+    app = Flask(__name__)
+    app.config.from_object(config['default'])
+    db.init_app(app)
+    init_db(app)
+
+    with app.app_context():
+        for label, query in build_queries():
+            statement = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+            plan = db.session.execute(db.text(f'EXPLAIN QUERY PLAN {statement}')).all()
+            print(f'\n== {label}')
+            for row in plan:
+                print(f'   {row[-1]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Rebuild the daily attendance rollup table (attendance_daily) from the
+attendance table.
+
+The rollup is maintained incrementally as attendances open and close; use
+this to backfill it (for example after importing attendance rows with raw
+SQL) or to repair a range of days. Without --from/--to every day is
+rebuilt.
+
+Run from project root:
+  python tools/rebuild_attendance_rollup.py [--from 2024-01-01] [--to 2024-01-31]
+"""
+
+import os
+import sys
+import argparse
+from datetime import date
+
+# Ensure project root is importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from flask import Flask
+
+from config import config
+from app.models.database import db, init_db
+from app.services.attendance_rollup import rebuild_rollup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='first day to rebuild (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='last day to rebuild (YYYY-MM-DD)')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(config['default'])
+    db.init_app(app)
+    init_db(app)
+
+    with app.app_context():
+        rows = rebuild_rollup(args.date_from, args.date_to)
+    print(f'Rebuilt {rows} attendance_daily rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -50,10 +50,12 @@ def main():
 
     with app.app_context():
         from app.models.database import Person, Attendance, Log, db
+        from app.services.attendance_rollup import clear_rollup
 
         # Delete dependent records first
         try:
             num_att = db.session.query(Attendance).delete()
+            clear_rollup()
             num_logs = db.session.query(Log).delete()
             db.session.commit()
             print(f"Deleted {num_att} Attendance rows and {num_logs} Log rows")
@@ -0,0 +1,124 @@
+"""Stand-in Prometheus scraper for the /metrics endpoint.
+
+Polls the endpoint, prints a short summary of each scrape (FPS, stage
+p95 estimated from the histogram buckets, recognition outcomes, DB query
+rate, attendance writes per second) and flags the site when the camera
+FPS drops below the target. Exits with status 1 if any scrape was below
+target, so it can be used from cron or CI.
+
+Run from project root (with main.py running):
+  python tools/scrape_metrics.py [--url http://localhost:5000/metrics] [--interval 5] [--count 0] [--fps-target 10]
+"""
+
+import sys
+import time
+import argparse
+from collections import defaultdict
+
+import requests
+
+
+def parse_metrics(text):
+    """Parse text exposition format into {name: [(labels dict, value), ...]}"""
+    samples = defaultdict(list)
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        name_part, _, value = line.rpartition(' ')
+        labels = {}
+        if '{' in name_part:
+            name, _, label_text = name_part.partition('{')
+            for pair in label_text.rstrip('}').split('",'):
+                if '=' not in pair:
+                    continue
+                key, _, val = pair.partition('=')
+                labels[key.strip()] = val.strip().strip('"')
+        else:
+            name = name_part
+        samples[name].append((labels, float(value)))
+    return samples
+
+
+def histogram_quantile(samples, name, quantile, **match):
+    """Estimate a quantile from cumulative buckets (upper bound of the bucket)"""
+    buckets = []
+    for labels, value in samples.get(f'{name}_bucket', []):
+        if all(labels.get(k) == v for k, v in match.items()):
+            buckets.append((float(labels['le']), value))
+    if not buckets:
+        return None
+    buckets.sort()
+    total = buckets[-1][1]
+    if total <= 0:
+        return None
+    for bound, cumulative in buckets:
+        if cumulative >= quantile * total:
+            return bound
+    return buckets[-1][0]
+
+
+def total(samples, name, **match):
+    return sum(value for labels, value in samples.get(name, [])
+               if all(labels.get(k) == v for k, v in match.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000/metrics')
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between scrapes')
+    parser.add_argument('--count', type=int, default=0, help='number of scrapes (0 = until Ctrl+C)')
+    parser.add_argument('--fps-target', type=float, default=10.0, help='alert when camera FPS is below this')
+    args = parser.parse_args()
+
+    previous = None
+    below_target = False
+    scrapes = 0
+    try:
+        while args.count <= 0 or scrapes < args.count:
+            try:
+                response = requests.get(args.url, timeout=5)
+                response.raise_for_status()
+            except Exception as e:
+                print(f"Scrape failed: {e}")
+                time.sleep(args.interval)
+                continue
+            now = time.time()
+            samples = parse_metrics(response.text)
+            scrapes += 1
+
+            fps = total(samples, 'ptud_camera_fps')
+            stages = sorted({labels['stage'] for labels, _ in samples.get('ptud_frame_stage_seconds_count', [])})
+            p95 = []
+            for stage in stages:
+                value = histogram_quantile(samples, 'ptud_frame_stage_seconds', 0.95, stage=stage)
+                if value is not None:
+                    p95.append(f"{stage}<={value * 1000:g}ms")
+            outcomes = {labels['outcome']: int(value) for labels, value in samples.get('ptud_face_recognitions_total', [])}
+            queries = total(samples, 'ptud_db_query_seconds_count')
+            writes = total(samples, 'ptud_attendance_writes_total')
+
+            line = (f"[{time.strftime('%H:%M:%S')}] fps={fps:.1f} tracks={total(samples, 'ptud_active_tracks'):.0f} "
+                    f"gallery={total(samples, 'ptud_gallery_size'):.0f} recognitions={outcomes}")
+            if previous is not None:
+                elapsed = now - previous[0]
+                line += (f" queries/s={(queries - previous[1]) / elapsed:.1f}"
+                         f" attendance_writes/s={(writes - previous[2]) / elapsed:.2f}")
+            print(line)
+            if p95:
+                print(f"  p95: {', '.join(p95)}")
+            if fps < args.fps_target:
+                below_target = True
+                print(f"  ALERT: camera FPS {fps:.1f} below target {args.fps_target:g}")
+
+            previous = (now, queries, writes)
+            if args.count <= 0 or scrapes < args.count:
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+    sys.exit(1 if below_target else 0)
+
+
+if __name__ == '__main__':
+    main()